@@ -0,0 +1,4 @@
+"""
+Benchmarks for envoy-confgen. These are not shipped with the package; run them from a
+source checkout, e.g. ``python3 -m benchmarks.serialize``.
+"""
@@ -0,0 +1,50 @@
+"""
+Time the resource builders (``process_yaml`` + ``generate_bootstrap``) on synthetic inputs.
+
+Usage: python3 -m benchmarks.builders [backends ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import time
+import tracemalloc
+
+from envoyconfgen.bootstrap import generate_bootstrap
+from envoyconfgen.processors import zkfp
+
+from .inputs import zkfp_input
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("backends", nargs="*", type=int, default=[10000])
+    ap.add_argument("-r", "--repeat", type=int, default=3, help="Runs per input size")
+    args = ap.parse_args()
+
+    for count in args.backends:
+        contents = zkfp_input(count)
+        timings = []
+        for _ in range(args.repeat):
+            # process_yaml consumes its input
+            run_contents = copy.deepcopy(contents)
+            start = time.perf_counter()
+            listeners, clusters = zkfp().process_yaml(run_contents)
+            generate_bootstrap(listeners, clusters)
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        listeners, clusters = zkfp().process_yaml(copy.deepcopy(contents))
+        generate_bootstrap(listeners, clusters)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            "%6d backends: best %.3fs, median %.3fs, %.1f MiB peak traced"
+            % (count, min(timings), sorted(timings)[len(timings) // 2], peak / 2**20)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Compare the results of ``benchmarks.stages`` with a stored baseline.
+
+Prints the change of the best time and of the peak traced memory of every stage found in both
+files, and exits 1 if any of them got worse by more than the threshold.
+
+Usage: python3 -m benchmarks.compare baseline.json results.json [--threshold PERCENT]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Any
+
+# stages faster than this are too noisy to compare
+MIN_SECONDS = 0.001
+# and allocations smaller than this are mostly interpreter noise
+MIN_PEAK_BYTES = 64 * 1024
+
+
+def load_results(path: str) -> dict[tuple[str, str], dict[str, Any]]:
+    with open(path) as fp:
+        contents = json.load(fp)
+
+    return {(result["scenario"], result["stage"]): result for result in contents["results"]}
+
+
+def change(old: float, new: float, minimum: float) -> float:
+    """
+    The relative change from ``old`` to ``new``, ignoring values below ``minimum``.
+    """
+    if max(old, new) < minimum:
+        return 0.0
+
+    return (new - old) / max(old, minimum)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("baseline", help="Results to compare against")
+    ap.add_argument("results", help="New results")
+    ap.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="Percentage by which a stage may get slower or use more memory",
+    )
+    args = ap.parse_args()
+
+    baseline = load_results(args.baseline)
+    results = load_results(args.results)
+
+    regressions = 0
+    for key, new in results.items():
+        if key not in baseline:
+            print("%-24s %-16s (not in the baseline)" % key)
+            continue
+
+        old = baseline[key]
+        time_change = change(old["seconds_min"], new["seconds_min"], MIN_SECONDS)
+        memory_change = change(old["peak_bytes"], new["peak_bytes"], MIN_PEAK_BYTES)
+        worse = max(time_change, memory_change) * 100 > args.threshold
+        regressions += worse
+
+        print(
+            "%-24s %-16s %8.4fs -> %8.4fs (%+6.1f%%) %8.1f -> %8.1f MiB (%+6.1f%%)%s"
+            % (
+                *key,
+                old["seconds_min"],
+                new["seconds_min"],
+                time_change * 100,
+                old["peak_bytes"] / 2**20,
+                new["peak_bytes"] / 2**20,
+                memory_change * 100,
+                "  REGRESSION" if worse else "",
+            )
+        )
+
+    for key in baseline:
+        if key not in results:
+            print("%-24s %-16s (missing from the results)" % key)
+
+    if regressions > 0:
+        print(
+            "%d stages regressed by more than %g%%" % (regressions, args.threshold),
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Synthetic processor inputs.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+
+def zkfp_input(backends: int, patterns: int = 2, varied: bool = False) -> dict[str, Any]:
+    """
+    Generate a zkfp input with the given number of backends. Proxy protocol settings and
+    ports are varied so that every code path of the cluster builders is exercised. With
+    ``varied``, backends have between 2 and ``patterns`` patterns each.
+    """
+    proxy_protocols = [None, "v1", "v2"]
+
+    return {
+        "listeners": [
+            {"protocol": "http", "port": 80, "address": "::"},
+            {"protocol": "https", "port": 443, "address": "::"},
+        ],
+        "backends": [
+            {
+                "host": f"backend{i}.example.net",
+                "proxy_protocol": proxy_protocols[i % len(proxy_protocols)],
+                "patterns": [f"*.site{i}.example.com", f"site{i}.example.com"]
+                + [
+                    f"alias{j}.site{i}.example.org"
+                    for j in range((i * 7) % (patterns - 1) if varied else patterns - 2)
+                ],
+            }
+            for i in range(backends)
+        ],
+    }
+
+
+def mtls_sidecar_input(dns_patterns: int, spiffe_patterns: int) -> dict[str, Any]:
+    """
+    Generate an mtls_sidecar input with long ``match_dns`` and ``match_spiffe`` lists, mixing
+    literal names, ``*`` and ``**`` wildcards.
+    """
+    dns_forms = ["client{i}.svc.example.com", "client{i}.*.example.com", "client{i}.**.example.com"]
+    spiffe_forms = [
+        ("example.com", "ns{i}/client"),
+        ("example.com", "ns{i}/*"),
+        ("*.example.com", "ns{i}/**"),
+    ]
+
+    return {
+        "listener": {
+            "port": 8001,
+            "ca_cert": "/etc/secrets/mtls/root-ca.pem",
+            "cert": "/etc/secrets/mtls/my-service/fullchain.pem",
+            "key": "/etc/secrets/mtls/my-service/privkey.pem",
+            "match_dns": [dns_forms[i % 3].format(i=i) for i in range(dns_patterns)],
+            "match_spiffe": [
+                {
+                    "trust_domain": spiffe_forms[i % 3][0],
+                    "service": spiffe_forms[i % 3][1].format(i=i),
+                }
+                for i in range(spiffe_patterns)
+            ],
+        },
+        "backend": {"host": "127.0.0.1", "port": 8000},
+    }
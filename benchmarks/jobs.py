@@ -0,0 +1,80 @@
+"""
+Time renders of a large zkfp input with ``--jobs``, and check that every number of jobs
+produces the same output.
+
+The render is timed end to end, like the CLI does it. Loading and validating the input are
+not parallelized; their time is printed separately as the part which can't speed up.
+
+Usage: python3 -m benchmarks.jobs [-b BACKENDS] [-f FORMAT ...] [jobs ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import yaml
+
+from envoyconfgen import yamlio
+from envoyconfgen.convert import render
+from envoyconfgen.fileio import output_formats
+from envoyconfgen.processors import zkfp
+
+from .inputs import zkfp_input
+from .serialize import HashingStream
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("jobs", nargs="*", type=int, default=[1, 2, 4, 8])
+    ap.add_argument("-b", "--backends", type=int, default=50000, help="Number of zkfp backends")
+    ap.add_argument(
+        "-f", "--format", nargs="*", choices=output_formats, default=list(output_formats)
+    )
+    ap.add_argument("-r", "--repeat", type=int, default=1, help="Timed runs per number of jobs")
+    args = ap.parse_args()
+
+    raw = yaml.safe_dump(zkfp_input(args.backends)).encode("utf-8")
+
+    start = time.perf_counter()
+    zkfp().validate_yaml(yamlio.safe_load(raw))
+    serial = time.perf_counter() - start
+    print(
+        "%d backends, %s CPUs, load+validate %.2fs" % (args.backends, os.cpu_count(), serial),
+        file=sys.stderr,
+    )
+
+    failed = False
+    for output_format in args.format:
+        baseline = None
+        digest = None
+        for jobs in args.jobs:
+            timings = []
+            for _ in range(args.repeat):
+                stream = HashingStream()
+                start = time.perf_counter()
+                render(zkfp(), "<benchmark>", stream, output_format, raw_contents=raw, jobs=jobs)
+                timings.append(time.perf_counter() - start)
+
+            if digest is None:
+                digest = stream.digest.hexdigest()
+            same = stream.digest.hexdigest() == digest
+            failed = failed or not same
+
+            best = min(timings)
+            if baseline is None:
+                baseline = best
+            print(
+                "%-4s %2d jobs: best %7.2fs, %5.2fx%s"
+                % (output_format, jobs, best, baseline / best, "" if same else ", OUTPUT DIFFERS"),
+                file=sys.stderr,
+            )
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
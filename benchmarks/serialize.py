@@ -0,0 +1,103 @@
+"""
+Compare the legacy ``MessageToJson`` -> ``json.loads`` -> ``yaml.dump`` round trip with
+:func:`envoyconfgen.serialize.write_yaml`.
+
+Usage: python3 -m benchmarks.serialize [backends ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import time
+import tracemalloc
+from typing import Callable
+
+import yaml
+
+import google.protobuf.json_format
+import google.protobuf.message
+
+from envoyconfgen.bootstrap import generate_bootstrap
+from envoyconfgen.processors import zkfp
+from envoyconfgen.serialize import write_yaml
+
+from .inputs import zkfp_input
+
+
+class HashingStream:
+    """
+    Write-only binary stream that keeps a digest of everything written to it.
+    """
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+def legacy_write_yaml(message: google.protobuf.message.Message, stream: HashingStream) -> None:
+    result_str = google.protobuf.json_format.MessageToJson(
+        message, sort_keys=True, preserving_proto_field_name=True
+    ).replace("type.googleapis.com/envoyproto.", "type.googleapis.com/")
+
+    stream.write(yaml.dump(json.loads(result_str)).encode("utf-8"))
+
+
+def measure(
+    func: Callable[[google.protobuf.message.Message, HashingStream], None],
+    message: google.protobuf.message.Message,
+) -> dict:
+    stream = HashingStream()
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(message, stream)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": elapsed,
+        "peak_bytes": peak,
+        "output_bytes": stream.size,
+        "sha256": stream.digest.hexdigest(),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("backends", nargs="*", type=int, default=[100, 1000, 5000])
+    args = ap.parse_args()
+
+    for count in args.backends:
+        listeners, clusters = zkfp().process_yaml(zkfp_input(count))
+        message = generate_bootstrap(listeners, clusters)
+
+        legacy = measure(legacy_write_yaml, message)
+        direct = measure(write_yaml, message)
+        if legacy["sha256"] != direct["sha256"]:
+            raise AssertionError(f"output differs from the legacy path at {count} backends")
+
+        print(
+            "%6d backends: legacy %7.3fs %8.1f MiB peak | direct %7.3fs %8.1f MiB peak | %.2fx faster"
+            % (
+                count,
+                legacy["seconds"],
+                legacy["peak_bytes"] / 2**20,
+                direct["seconds"],
+                direct["peak_bytes"] / 2**20,
+                legacy["seconds"] / direct["seconds"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Time and trace the memory of every stage of the processor pipelines on synthetic inputs.
+
+The stages are: YAML load, ``validate_yaml``, struct conversion, proto build,
+``generate_bootstrap`` and serialization to each output format. Every stage gets its inputs
+from the previous one, outside of its measurement. The ``stream_*`` stages measure what the
+CLI does: conversion, build and serialization, with resources written as they are built.
+Results are written as JSON for ``benchmarks.compare``.
+
+Usage: python3 -m benchmarks.stages [--zkfp N ...] [--mtls N ...] [-o results.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Iterator, Optional
+
+import yaml
+
+from envoyconfgen import __version__, yamlio
+from envoyconfgen.bootstrap import generate_bootstrap
+from envoyconfgen.fileio import output_formats
+from envoyconfgen.processors import AbstractProcessor, mtls_sidecar, zkfp
+from envoyconfgen.serialize import write, write_streamed
+
+from .inputs import mtls_sidecar_input, zkfp_input
+from .serialize import HashingStream
+
+
+def measure(
+    func: Callable[..., Any], repeat: int, setup: Optional[Callable[[], Any]] = None
+) -> dict:
+    """
+    Run ``func(setup())`` ``repeat`` times, then once more under tracemalloc. ``setup`` is
+    not measured; without it ``func`` is called with no arguments.
+    """
+    timings = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+
+    args = () if setup is None else (setup(),)
+    tracemalloc.start()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "result": result,
+        "seconds_min": min(timings),
+        "seconds_median": statistics.median(timings),
+        "peak_bytes": peak,
+    }
+
+
+def pipeline(
+    processor: AbstractProcessor, contents: dict[str, Any], repeat: int
+) -> Iterator[tuple[str, dict]]:
+    """
+    Yield the measurements of every stage for one input.
+    """
+    raw = yaml.safe_dump(contents).encode("utf-8")
+
+    stage = measure(lambda: yamlio.safe_load(raw), repeat)
+    loaded = stage.pop("result")
+    yield "load", stage
+
+    stage = measure(lambda: processor.validate_yaml(loaded), repeat)
+    if len(stage.pop("result")) > 0:
+        raise AssertionError("the generated input does not validate")
+    yield "validate", stage
+
+    # the conversion consumes its input
+    stage = measure(processor._yaml_to_internal_structs, repeat, lambda: copy.deepcopy(loaded))
+    structs = stage.pop("result")
+    yield "convert", stage
+
+    stage = measure(lambda: processor._build_resources(structs), repeat)
+    listeners, clusters = stage.pop("result")
+    yield "build", stage
+
+    stage = measure(lambda: generate_bootstrap(listeners, clusters), repeat)
+    config = stage.pop("result")
+    yield "bootstrap", stage
+
+    for output_format in output_formats:
+        stream = HashingStream()
+        stage = measure(lambda: write(config, stream, output_format), repeat)
+        stage.pop("result")
+        stage["output_bytes"] = stream.size // (repeat + 1)
+        yield f"serialize_{output_format}", stage
+
+    # conversion, build and serialization at once, with the resources built as they are
+    # written
+    for output_format in output_formats:
+        stream = HashingStream()
+
+        def stream_config(contents: dict[str, Any]) -> None:
+            resources = processor.stream_resources(contents)
+            write_streamed(
+                generate_bootstrap([], []),
+                {
+                    "static_resources.listeners": resources.listeners,
+                    "static_resources.clusters": resources.clusters,
+                },
+                stream,
+                output_format,
+                printable=True,
+            )
+
+        stage = measure(stream_config, repeat, lambda: copy.deepcopy(loaded))
+        stage.pop("result")
+        stage["output_bytes"] = stream.size // (repeat + 1)
+        yield f"stream_{output_format}", stage
+
+
+def scenarios(args) -> Iterator[tuple[str, AbstractProcessor, dict[str, Any]]]:
+    for count in args.zkfp:
+        yield (
+            f"zkfp-{count}-p{args.patterns}",
+            zkfp(),
+            zkfp_input(count, args.patterns, varied=True),
+        )
+    for count in args.mtls:
+        yield f"mtls_sidecar-{count}", mtls_sidecar(), mtls_sidecar_input(count, count)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument(
+        "--zkfp",
+        nargs="*",
+        type=int,
+        default=[100, 1000, 10000],
+        help="zkfp backend counts, up to 100000",
+    )
+    ap.add_argument(
+        "--patterns", type=int, default=4, help="Maximum number of patterns per zkfp backend"
+    )
+    ap.add_argument(
+        "--mtls",
+        nargs="*",
+        type=int,
+        default=[10, 1000],
+        help="Number of match_dns and of match_spiffe patterns of mtls_sidecar inputs",
+    )
+    ap.add_argument("-r", "--repeat", type=int, default=3, help="Timed runs per stage")
+    ap.add_argument("-o", "--output", help="Write the results to this JSON file")
+    args = ap.parse_args()
+
+    results = []
+    for name, processor, contents in scenarios(args):
+        for stage, measured in pipeline(processor, contents, args.repeat):
+            results.append(dict(scenario=name, stage=stage, **measured))
+            print(
+                "%-24s %-16s best %8.4fs, median %8.4fs, %8.1f MiB peak traced"
+                % (
+                    name,
+                    stage,
+                    measured["seconds_min"],
+                    measured["seconds_median"],
+                    measured["peak_bytes"] / 2**20,
+                ),
+                file=sys.stderr,
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {
+                    "version": __version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "repeat": args.repeat,
+                    "results": results,
+                },
+                fp,
+                indent=2,
+            )
+            fp.write("\n")
+
+
+if __name__ == "__main__":
+    main()
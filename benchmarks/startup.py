@@ -0,0 +1,112 @@
+"""
+Guard the CLI's startup cost.
+
+Checks that importing the CLI and ``--check`` load no protobuf modules, that rendering with
+one processor doesn't load another processor's builders, and that ``--help`` stays within a
+wall time budget. Exits non-zero if any check fails.
+
+Usage: python3 -m benchmarks.startup [--budget MS] [--runs N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# modules that must not be loaded just by importing the CLI
+heavy_prefixes = ("envoyproto", "google.protobuf")
+
+# processor -> (sample input, builder packages of *other* processors)
+processor_samples = {
+    "zkfp": ("samples/zkfp/example.yml", ("envoyconfgen.mtls_sidecar",)),
+    "mtls_sidecar": ("samples/mtls_sidecar/example.yml", ("envoyconfgen.zkfp",)),
+}
+
+_report_modules = """
+import atexit, json, sys
+atexit.register(lambda: print(json.dumps(sorted(sys.modules)), file=sys.stderr))
+"""
+
+
+def loaded_modules(code: str) -> list[str]:
+    """
+    Run python code in a fresh interpreter and return the modules it loaded.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", _report_modules + code],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+        text=True,
+    )
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+
+def wall_time(argv: list[str], runs: int) -> float:
+    """
+    Best wall time of a command over several runs, in seconds.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--budget", type=float, default=250, help="--help budget in milliseconds")
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    failures = []
+
+    heavy = [m for m in loaded_modules("import envoyconfgen.main") if m.startswith(heavy_prefixes)]
+    print(f"import envoyconfgen.main: {len(heavy)} protobuf modules loaded")
+    if heavy:
+        failures.append("importing the CLI loads " + ", ".join(heavy[:5]))
+
+    for processor, (sample, foreign) in processor_samples.items():
+        code = (
+            "import sys; from envoyconfgen.main import main;"
+            f" sys.argv = ['envoy-confgen', '-p', {processor!r}, {sample!r},"
+            f" '-o', {os.devnull!r}]; main()"
+        )
+        unexpected = [m for m in loaded_modules(code) if m.startswith(foreign)]
+        print(f"render with {processor}: {len(unexpected)} foreign builder modules loaded")
+        if unexpected:
+            failures.append(f"rendering with {processor} loads " + ", ".join(unexpected))
+
+    for processor, (sample, _) in processor_samples.items():
+        code = (
+            "import sys; from envoyconfgen.main import main;"
+            f" sys.argv = ['envoy-confgen', '--check', '-p', {processor!r}, {sample!r}]; main()"
+        )
+        heavy = [m for m in loaded_modules(code) if m.startswith(heavy_prefixes)]
+        print(f"--check with {processor}: {len(heavy)} protobuf modules loaded")
+        if heavy:
+            failures.append(f"--check with {processor} loads " + ", ".join(heavy[:5]))
+
+    baseline = wall_time([sys.executable, "-c", "pass"], args.runs)
+    cli_help = wall_time([sys.executable, "-m", "envoyconfgen.main", "--help"], args.runs)
+    print(
+        "--help: %.1f ms (interpreter startup %.1f ms, budget %.1f ms)"
+        % (cli_help * 1000, baseline * 1000, args.budget)
+    )
+    if cli_help * 1000 > args.budget:
+        failures.append("--help took %.1f ms" % (cli_help * 1000))
+
+    for failure in failures:
+        print(f"FAILED: {failure}", file=sys.stderr)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
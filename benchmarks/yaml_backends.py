@@ -0,0 +1,110 @@
+"""
+Compare PyYAML's pure Python parser and emitter with libyaml's, and check that both produce
+byte-identical outputs.
+
+Generated configs are loaded and written with both implementations, as are configs with
+random printable ASCII names, the only strings libyaml is used for. Exits with an error on
+any difference.
+
+Usage: python3 -m benchmarks.yaml_backends [backends ...]
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import random
+import string
+import time
+
+import yaml
+
+import envoyproto.envoy.config.cluster.v3 as cluster
+
+from envoyconfgen.bootstrap import generate_bootstrap
+from envoyconfgen.processors import mtls_sidecar, zkfp
+from envoyconfgen.serialize import write_yaml, yaml_dumper_class
+
+from .inputs import mtls_sidecar_input, zkfp_input
+
+
+def dump(message, dumper_class: type[yaml.Dumper]) -> tuple[float, bytes]:
+    stream = io.BytesIO()
+    start = time.perf_counter()
+    write_yaml(message, stream, dumper_class)
+    return time.perf_counter() - start, stream.getvalue()
+
+
+def load(raw: bytes, loader_class: type[yaml.SafeLoader]) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = yaml.load(raw, Loader=loader_class)
+    return time.perf_counter() - start, result
+
+
+def compare_config(name: str, processor, contents: dict) -> None:
+    raw = yaml.safe_dump(contents).encode("utf-8")
+    python_load, python_contents = load(raw, yaml.SafeLoader)
+    c_load, c_contents = load(raw, yaml.CSafeLoader)
+    if python_contents != c_contents:
+        raise AssertionError(f"{name}: libyaml loads a different input")
+
+    message = generate_bootstrap(*processor.process_yaml(c_contents))
+    if yaml_dumper_class(message) is not yaml.CDumper:
+        raise AssertionError(f"{name}: libyaml is not used to write the config")
+
+    python_dump, python_output = dump(message, yaml.Dumper)
+    c_dump, c_output = dump(message, yaml.CDumper)
+    if python_output != c_output:
+        raise AssertionError(f"{name}: libyaml writes a different config")
+
+    print(
+        "%-20s load %7.3fs -> %7.3fs (%5.1fx) | dump %7.3fs -> %7.3fs (%5.1fx)"
+        % (
+            name,
+            python_load,
+            c_load,
+            python_load / c_load,
+            python_dump,
+            c_dump,
+            python_dump / c_dump,
+        )
+    )
+
+
+def compare_names(count: int) -> None:
+    """
+    Check configs with random printable names of every length around the line width.
+    """
+    rng = random.Random(0)
+    for i in range(count):
+        name = "".join(rng.choice(string.printable[:95]) for _ in range(rng.randint(0, 200)))
+        message = cluster.cluster.Cluster(name=name, alt_stat_name=name[::-1])
+        if yaml_dumper_class(message) is not yaml.CDumper:
+            raise AssertionError(f"libyaml is not used for {name!r}")
+        if dump(message, yaml.Dumper)[1] != dump(message, yaml.CDumper)[1]:
+            raise AssertionError(f"libyaml writes {name!r} differently")
+
+    # anything else is written by PyYAML
+    if yaml_dumper_class(cluster.cluster.Cluster(name="café")) is not yaml.Dumper:
+        raise AssertionError("non-ASCII names must be written by PyYAML")
+
+    print("%d random names: identical" % (count))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("backends", nargs="*", type=int, default=[100, 1000])
+    ap.add_argument("--names", type=int, default=2000, help="Random names to check")
+    args = ap.parse_args()
+
+    if not yaml.__with_libyaml__:
+        raise SystemExit("PyYAML was built without libyaml")
+
+    for count in args.backends:
+        compare_config(f"zkfp-{count}", zkfp(), zkfp_input(count, 4, varied=True))
+    compare_config("mtls_sidecar-1000", mtls_sidecar(), mtls_sidecar_input(1000, 1000))
+    compare_names(args.names)
+
+
+if __name__ == "__main__":
+    main()
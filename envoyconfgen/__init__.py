@@ -1,8 +1,19 @@
-from .bootstrap import generate_bootstrap
 from .structs import SNIProxyListener, SNIProxyVirtualHost
 
+__version__ = "0.2.0"
+
 __all__ = [
     "SNIProxyListener",
     "SNIProxyVirtualHost",
     "generate_bootstrap",
 ]
+
+
+def __getattr__(name):
+    # loaded on demand, as it pulls in the envoy protobuf modules
+    if name == "generate_bootstrap":
+        from .bootstrap import generate_bootstrap
+
+        return generate_bootstrap
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
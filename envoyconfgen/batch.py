@@ -0,0 +1,180 @@
+"""
+Batch mode: render many input files in one invocation.
+
+Inputs are rendered across a pool of worker processes. The processor's protobuf modules and
+the configuration are loaded before the workers are forked from the CLI process, so that they
+are only loaded once.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import sys
+import time
+import traceback
+from typing import IO, Any, Iterable, NamedTuple, Optional
+
+from . import registry
+from .cache import RenderCache
+from .convert import InvalidInputError, render
+from .fileio import atomic_open
+
+input_extensions = (".yml", ".yaml")
+
+
+class RenderResult(NamedTuple):
+    path: str
+    output: str
+    seconds: float
+    error: Optional[str] = None
+
+
+def expand_paths(paths: Iterable[str]) -> list[str]:
+    """
+    Expand directories in a list of input paths to the YAML files they contain.
+    """
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(
+                sorted(
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if name.endswith(input_extensions) and os.path.isfile(os.path.join(path, name))
+                )
+            )
+        else:
+            result.append(path)
+
+    return result
+
+
+def output_path(template: str, path: str, output_format: str, **fields: Any) -> str:
+    """
+    Fill in an output filename template for an input file. ``{name}`` is replaced with the
+    input's file name without its extension and ``{ext}`` with the output format; further
+    placeholders are filled in from ``fields``.
+    """
+    name, _ = os.path.splitext(os.path.basename(path))
+    return template.format(name=name, ext=output_format, **fields)
+
+
+def render_file(
+    processor_name: str,
+    path: str,
+    output: str,
+    output_format: str,
+    cache: Optional[RenderCache] = None,
+) -> RenderResult:
+    start = time.perf_counter()
+    try:
+        processor = registry.load(processor_name)
+        with atomic_open(output) as fp:
+            render(processor(), path, fp, output_format, cache, processor_name=processor_name)
+    except InvalidInputError as e:
+        return RenderResult(path, output, time.perf_counter() - start, str(e))
+    except Exception:
+        return RenderResult(path, output, time.perf_counter() - start, traceback.format_exc())
+
+    return RenderResult(path, output, time.perf_counter() - start)
+
+
+def render_batch(
+    processor_name: str,
+    jobs: Iterable[tuple[str, str]],
+    output_format: str,
+    workers: int = 1,
+    cache: Optional[RenderCache] = None,
+) -> list[RenderResult]:
+    """
+    Render ``(input, output)`` pairs, in parallel if ``workers`` is greater than 1. Results
+    are returned in input order.
+    """
+    jobs = list(jobs)
+    if workers <= 1 or len(jobs) <= 1:
+        return [
+            render_file(processor_name, path, output, output_format, cache) for path, output in jobs
+        ]
+
+    # imports are lazy, so whatever the workers need is loaded before they are forked
+    from . import bootstrap, serialize  # noqa: F401
+    from .config import get_singleton
+
+    get_singleton()
+    registry.load(processor_name)().preload()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(render_file, processor_name, path, output, output_format, cache)
+            for path, output in jobs
+        ]
+        return [future.result() for future in futures]
+
+
+def print_summary(results: list[RenderResult], elapsed: float, file: IO[str] = sys.stderr) -> None:
+    failed = [result for result in results if result.error is not None]
+
+    for result in failed:
+        print(f"{result.path}: FAILED", file=file)
+        print("".join(f"    {line}\n" for line in result.error.rstrip().splitlines()), file=file)
+
+    for result in results:
+        status = "ok" if result.error is None else "FAILED"
+        print(f"{result.seconds:9.3f}s  {status:6s}  {result.path} -> {result.output}", file=file)
+
+    print(
+        "%d rendered, %d failed in %.3fs (%.3fs of render time)"
+        % (
+            len(results) - len(failed),
+            len(failed),
+            elapsed,
+            sum(result.seconds for result in results),
+        ),
+        file=file,
+    )
+
+
+def output_template(args) -> str:
+    """
+    Returns the output filename template for a multi-input invocation, exiting with an error
+    if the command line doesn't specify one.
+    """
+    if args.output_dir is not None:
+        return os.path.join(args.output_dir, "{name}.{ext}")
+    elif args.output is not None and "{name}" in args.output:
+        return args.output
+
+    print(
+        "Rendering multiple inputs needs --output-dir or an --output template containing {name}",
+        file=sys.stderr,
+    )
+    sys.exit(1)
+
+
+def do_batch(args) -> None:
+    paths = expand_paths(args.path)
+    if len(paths) == 0:
+        print("No input files found", file=sys.stderr)
+        sys.exit(1)
+
+    template = output_template(args)
+    jobs = [(path, output_path(template, path, args.format)) for path in paths]
+    outputs = [output for _, output in jobs]
+    if len(set(outputs)) != len(outputs):
+        print("Several inputs would be written to the same output file", file=sys.stderr)
+        sys.exit(1)
+
+    for output in outputs:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    start = time.perf_counter()
+    cache = RenderCache.from_args(args)
+    results = render_batch(args.processor, jobs, args.format, args.workers, cache)
+    # evicting after every render would scan the cache once per input
+    if cache is not None:
+        cache.evict()
+    print_summary(results, time.perf_counter() - start)
+
+    if any(result.error is not None for result in results):
+        sys.exit(1)
@@ -1,16 +1,33 @@
 from __future__ import annotations
 from typing import Collection
 
-from .config import singleton
-
-config = singleton.get_config()
+from .config import get_config
+from .helpers import locality_endpoint, typed_config
 
 import envoyproto.envoy.config.core.v3 as core
 from envoyproto.envoy.config.bootstrap.v3 import bootstrap
+from envoyproto.envoy.extensions.upstreams.http.v3 import http_protocol_options
 
 import envoyproto.envoy.config.cluster.v3 as cluster
 import envoyproto.envoy.config.listener.v3 as listener
 
+import google.protobuf.duration_pb2
+
+XDS_CLUSTER_NAME = "xds_cluster"
+
+
+def _admin() -> bootstrap.Admin:
+    config = get_config()
+    return bootstrap.Admin(
+        access_log=[],
+        address=core.address.Address(
+            socket_address=core.address.SocketAddress(
+                address="127.0.0.1",
+                port_value=int(config["envoy"]["admin_port"]),
+            ),
+        ),
+    )
+
 
 def generate_bootstrap(
     listeners: Collection[listener.listener.Listener], clusters: Collection[cluster.cluster.Cluster]
@@ -20,16 +37,78 @@ def generate_bootstrap(
     for a zero-knowledge edge proxy.
     """
     return bootstrap.Bootstrap(
-        admin=bootstrap.Admin(
-            access_log=[],
-            address=core.address.Address(
-                socket_address=core.address.SocketAddress(
-                    address="127.0.0.1",
-                    port_value=int(config["envoy"]["admin_port"]),
-                ),
-            ),
-        ),
+        admin=_admin(),
         static_resources=bootstrap.Bootstrap.StaticResources(
             listeners=listeners, clusters=clusters
         ),
     )
+
+
+def generate_filesystem_bootstrap(
+    lds_config: core.config_source.ConfigSource, cds_config: core.config_source.ConfigSource
+) -> bootstrap.Bootstrap:
+    """
+    Generates an envoy toplevel config which loads its listeners and clusters from the
+    given (file based) config sources.
+    """
+    return bootstrap.Bootstrap(
+        admin=_admin(),
+        dynamic_resources=bootstrap.Bootstrap.DynamicResources(
+            cds_config=cds_config,
+            lds_config=lds_config,
+        ),
+    )
+
+
+def generate_dynamic_bootstrap(
+    xds_host: str, xds_port: int, node_id: str, node_cluster: str, delta: bool = True
+) -> bootstrap.Bootstrap:
+    """
+    Generates an envoy toplevel config which fetches its listeners and clusters over ADS
+    from ``envoy-confgen serve`` listening on the given address.
+    """
+    ads_source = core.config_source.ConfigSource(
+        ads=core.config_source.AggregatedConfigSource(),
+        resource_api_version=core.config_source.ApiVersion.V3,
+    )
+    xds_cluster = cluster.cluster.Cluster(
+        name=XDS_CLUSTER_NAME,
+        connect_timeout=google.protobuf.duration_pb2.Duration(seconds=5),
+        type=cluster.cluster.Cluster.DiscoveryType.STATIC,
+        typed_extension_protocol_options={
+            "envoy.extensions.upstreams.http.v3.HttpProtocolOptions": typed_config(
+                http_protocol_options.HttpProtocolOptions(
+                    explicit_http_config=http_protocol_options.HttpProtocolOptions.ExplicitHttpConfig(
+                        http2_protocol_options=core.protocol.Http2ProtocolOptions(),
+                    ),
+                ),
+            ),
+        },
+    )
+    xds_cluster.load_assignment.cluster_name = XDS_CLUSTER_NAME
+    xds_cluster.load_assignment.endpoints.append(locality_endpoint(xds_host, xds_port))
+
+    return bootstrap.Bootstrap(
+        node=core.base.Node(id=node_id, cluster=node_cluster),
+        admin=_admin(),
+        dynamic_resources=bootstrap.Bootstrap.DynamicResources(
+            ads_config=core.config_source.ApiConfigSource(
+                api_type=(
+                    core.config_source.ApiConfigSource.ApiType.DELTA_GRPC
+                    if delta
+                    else core.config_source.ApiConfigSource.ApiType.GRPC
+                ),
+                transport_api_version=core.config_source.ApiVersion.V3,
+                grpc_services=[
+                    core.grpc_service.GrpcService(
+                        envoy_grpc=core.grpc_service.GrpcService.EnvoyGrpc(
+                            cluster_name=XDS_CLUSTER_NAME,
+                        ),
+                    ),
+                ],
+            ),
+            cds_config=ads_source,
+            lds_config=ads_source,
+        ),
+        static_resources=bootstrap.Bootstrap.StaticResources(clusters=[xds_cluster]),
+    )
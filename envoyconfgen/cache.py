@@ -0,0 +1,124 @@
+"""
+Content-addressed cache of rendered outputs.
+
+Entries are keyed on everything that determines a render's result: the input file's bytes,
+the processor (its registered name, class and the version of the distribution providing it),
+the output format, the effective ``[envoy]`` configuration and the package version. A hit is
+copied to the output without parsing the input or building any protobuf messages. The cache
+is bounded in size; the least recently used entries are evicted first, once per run.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+from typing import IO, Iterator, Optional
+
+from . import __version__, registry
+from .config import get_config
+from .fileio import atomic_open
+
+logger = logging.getLogger(__name__)
+
+entry_suffix = ".render"
+
+
+class RenderCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_args(cls, args) -> Optional[RenderCache]:
+        """
+        Build the render cache selected by the command line and the ``[cache]``
+        configuration section, if any.
+        """
+        if args.no_cache:
+            return None
+
+        config = get_config()
+        directory = args.cache_dir or config["cache"]["dir"]
+        if not directory:
+            return None
+
+        max_size = args.cache_size if args.cache_size is not None else config["cache"]["max_size"]
+        return cls(directory, int(max_size) * 2**20)
+
+    def key(self, processor_name: str, contents: bytes, output_format: str) -> str:
+        digest = hashlib.sha256()
+        # processors registered by other distributions change with their version
+        spec = registry.get(processor_name)
+        for part in (
+            __version__,
+            processor_name,
+            spec.target,
+            registry.provider_version(processor_name),
+            output_format,
+        ):
+            digest.update(part.encode("utf-8") + b"\0")
+
+        for name, value in sorted(get_config().items("envoy")):
+            digest.update(f"{name}={value}".encode("utf-8") + b"\0")
+
+        digest.update(contents)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + entry_suffix)
+
+    def copy_to(self, key: str, stream: IO[bytes]) -> bool:
+        """
+        Copy a cached render to a stream. Returns False on a cache miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fp:
+                shutil.copyfileobj(fp, stream)
+        except FileNotFoundError:
+            return False
+
+        # the modification time doubles as the last use for LRU eviction
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+
+        return True
+
+    @contextlib.contextmanager
+    def store(self, key: str) -> Iterator[IO[bytes]]:
+        """
+        Open a cache entry for writing. The entry only becomes visible once the block exits
+        without an exception.
+        """
+        with atomic_open(self.path(key)) as fp:
+            yield fp
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in its size limit.
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(entry_suffix):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            logger.debug("Evicting cache entry %s" % (path))
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
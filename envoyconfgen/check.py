@@ -0,0 +1,208 @@
+"""
+Check mode: validate inputs without building anything.
+
+Every input is checked against its processor's schema (see :mod:`.schema`), then, unless its
+top-level keys are wrong, by the processor's own validation, which looks for problems across
+backends such as overlapping patterns or port collisions. Problems, and the warnings the
+processor would log when rendering, are reported with their line where their position is
+known; the processor's problems about a value the schema already found wrong are left out.
+Only problems fail the check. Inputs are checked across a pool of worker processes, and no
+protobuf module is ever loaded.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import functools
+import sys
+import time
+import traceback
+from typing import IO, Iterable, NamedTuple, Optional
+
+import yaml
+
+from . import processors, registry, yamlio
+from .batch import expand_paths
+from .schema import LocatedError, T_path, format_path, problems
+
+T_located = list[tuple[Optional[int], str]]
+
+
+class CheckResult(NamedTuple):
+    path: str
+    problems: list[str]
+    warnings: list[str]
+
+
+def node_line(root: yaml.Node, path: T_path) -> int:
+    """
+    The line of the value at ``path`` in a composed YAML document, or of the deepest part of
+    the path which exists. Mapping entries are located by their key.
+    """
+    node = root
+    line = root.start_mark.line
+    for key in path:
+        if isinstance(node, yaml.MappingNode):
+            for key_node, value_node in node.value:
+                if isinstance(key_node, yaml.ScalarNode) and key_node.value == str(key):
+                    node = value_node
+                    line = key_node.start_mark.line
+                    break
+            else:
+                break
+        elif isinstance(node, yaml.SequenceNode) and isinstance(key, int):
+            if key >= len(node.value):
+                break
+            node = node.value[key]
+            line = node.start_mark.line
+        else:
+            break
+
+    return line + 1
+
+
+def check_contents(
+    processor: processors.AbstractProcessor, raw_contents: bytes
+) -> tuple[T_located, T_located]:
+    """
+    The problems and the warnings of an input, with their line if known.
+    """
+    try:
+        contents = yamlio.safe_load(raw_contents)
+    except yaml.MarkedYAMLError as e:
+        mark = e.problem_mark or e.context_mark
+        return [(None if mark is None else mark.line + 1, f"invalid YAML: {e.problem}")], []
+    except yaml.YAMLError as e:
+        return [(None, f"invalid YAML: {e}")], []
+
+    found = problems(processor.schema(contents), contents)
+
+    # the processor's own checks also run when some entries have problems, to find those
+    # between the others. They would only repeat problems with the top-level keys.
+    errors, warnings = [], []
+    if all(len(problem.path) > 1 for problem in found):
+        try:
+            errors, warnings = processor.check_yaml(contents)
+        except Exception:
+            # tripped up by an entry whose problems are reported already
+            if len(found) == 0:
+                raise
+
+    # a processor's problem is left out if the schema found a problem with the same value,
+    # one it contains or one containing it, which it would only repeat
+    errors, warnings = [
+        [
+            error
+            for error in messages
+            if not isinstance(error, LocatedError)
+            or not any(_overlaps(problem.path, error.path) for problem in found)
+        ]
+        for messages in (errors, warnings)
+    ]
+    if len(found) == 0 and len(errors) == 0 and len(warnings) == 0:
+        return [], []
+
+    # the positions are only needed, and only parsed, for inputs with problems or warnings
+    root = yaml.compose(raw_contents, Loader=yamlio.SafeLoader)
+    located = [
+        (
+            problem.path,
+            f"{format_path(problem.path)}: {problem.message}" if problem.path else problem.message,
+        )
+        for problem in found
+    ]
+    return _locate(root, located, errors), _locate(root, [], warnings)
+
+
+def _locate(
+    root: Optional[yaml.Node], located: list[tuple[T_path, str]], messages: list[str]
+) -> T_located:
+    """
+    The lines of located messages, sorted, followed by the processor's messages which have no
+    position.
+    """
+    located = located + [
+        (message.path, str(message)) for message in messages if isinstance(message, LocatedError)
+    ]
+    return sorted(
+        [(None if root is None else node_line(root, path), message) for path, message in located],
+        key=lambda problem: problem[0] or 0,
+    ) + [(None, message) for message in messages if not isinstance(message, LocatedError)]
+
+
+def _overlaps(path: T_path, other: T_path) -> bool:
+    """
+    Whether one of two paths contains the other.
+    """
+    return path[: len(other)] == other or other[: len(path)] == path
+
+
+def check_file(processor_name: str, path: str) -> CheckResult:
+    try:
+        with open(path, "rb") as fp:
+            raw_contents = fp.read()
+        found, warnings = check_contents(registry.load(processor_name)(), raw_contents)
+    except OSError as e:
+        return CheckResult(path, [f"{path}: {e.strerror}"], [])
+    except Exception:
+        return CheckResult(path, [f"{path}: {traceback.format_exc().rstrip()}"], [])
+
+    def format_message(line: Optional[int], message: str) -> str:
+        return f"{path}: {message}" if line is None else f"{path}:{line}: {message}"
+
+    return CheckResult(
+        path,
+        [format_message(line, message) for line, message in found],
+        [format_message(line, f"warning: {message}") for line, message in warnings],
+    )
+
+
+def check_batch(processor_name: str, paths: Iterable[str], workers: int = 1) -> list[CheckResult]:
+    """
+    Check inputs, in parallel if ``workers`` is greater than 1. Results are returned in input
+    order.
+    """
+    paths = list(paths)
+    check = functools.partial(check_file, processor_name)
+    if workers <= 1 or len(paths) <= 1:
+        return [check(path) for path in paths]
+
+    # inputs are usually quick to check, so they are handed to the workers in chunks
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(check, paths, chunksize=max(1, len(paths) // (workers * 4))))
+
+
+def print_results(
+    results: list[CheckResult],
+    elapsed: float,
+    file: IO[str] = sys.stdout,
+    summary_file: IO[str] = sys.stderr,
+) -> None:
+    for result in results:
+        for problem in result.problems + result.warnings:
+            print(problem, file=file)
+
+    print(
+        "%d inputs checked, %d with problems, %d with warnings in %.3fs"
+        % (
+            len(results),
+            sum(len(result.problems) > 0 for result in results),
+            sum(len(result.warnings) > 0 for result in results),
+            elapsed,
+        ),
+        file=summary_file,
+    )
+
+
+def do_check(args) -> None:
+    paths = expand_paths(args.path)
+    if len(paths) == 0:
+        print("No input files found", file=sys.stderr)
+        sys.exit(1)
+
+    start = time.perf_counter()
+    results = check_batch(args.processor, paths, args.workers)
+    print_results(results, time.perf_counter() - start)
+
+    if any(len(result.problems) > 0 for result in results):
+        sys.exit(1)
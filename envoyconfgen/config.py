@@ -4,21 +4,46 @@ import logging
 import logging.handlers
 import sys
 
+from .structs import cluster_types, dns_lookup_families
 
 logger = logging.getLogger(__name__)
 
 
+_singleton = None
+
+
+def get_singleton():
+    """
+    Returns the application configuration, loading it (and setting up logging) on first use.
+    """
+    global _singleton
+    if _singleton is None:
+        _singleton = Config()
+
+    return _singleton
+
+
 def get_config():
-    return singleton.get_config()
+    return get_singleton().get_config()
+
+
+def __getattr__(name):
+    # `singleton` used to be created when this module was imported; it is now created on
+    # first access so that importing the package has no side effects.
+    if name == "singleton":
+        return get_singleton()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class ManagedLogger:
     def __init__(self):
         self.cli_handler = logging.StreamHandler(sys.stderr)
-        self.syslog_handler = logging.handlers.SysLogHandler()
+        # until the configuration is loaded, only show problems
+        self.cli_handler.setLevel(logging.WARNING)
+        self.syslog_handler = None
         self.file_handler = None
         logging.getLogger().addHandler(self.cli_handler)
-        logging.getLogger().addHandler(self.syslog_handler)
         logging.getLogger().setLevel(logging.DEBUG)
 
     def parse_level(self, level_str):
@@ -35,8 +60,18 @@ class ManagedLogger:
         )
         self.cli_handler.setFormatter(cli_formatter)
 
+        if self.syslog_handler is None:
+            # the handler opens a socket as soon as it is created, so it is only created once
+            # logging is configured
+            self.syslog_handler = logging.handlers.SysLogHandler()
+            logging.getLogger().addHandler(self.syslog_handler)
         self.syslog_handler.setLevel(self.parse_level(config["logging"]["syslog_level"]))
 
+        if self.file_handler is not None:
+            logging.getLogger().removeHandler(self.file_handler)
+            self.file_handler.close()
+            self.file_handler = None
+
         try:
             self.file_handler = logging.FileHandler(config["logging"]["file_target"])
             self.file_handler.setLevel(self.parse_level(config["logging"]["file_level"]))
@@ -63,6 +98,18 @@ class Config:
         "envoy": {
             "access_log": "/dev/stdout",
             "admin_port": 9901,
+            # defaults for the backends' cluster settings, see structs.ClusterOptions
+            "cluster_type": "auto",
+            "dns_lookup_family": "auto",
+            # in seconds; empty for envoy's default
+            "dns_refresh_rate": "",
+            "respect_dns_ttl": "false",
+        },
+        "cache": {
+            # directory of the render cache; empty to disable caching
+            "dir": "",
+            # size limit of the render cache in MiB
+            "max_size": 256,
         },
     }
 
@@ -80,30 +127,32 @@ class Config:
         self.managed_logger = ManagedLogger()
         self.loaded_config = configparser.RawConfigParser()
         self.loaded_config.read_dict(self.default_config)
-        # Do an initial logging config to set up our formatter. On the first
-        # pass, this won't load the configuration from a file.
-        self.configure_logging()
 
         path = self.read_config_from_file()
 
+        # logging is configured once the configuration files have been read
+        self.configure_logging()
+        self.validate()
+
         if path is not None:
             logger.info("Successfully loaded the configuration from %s" % (path))
 
-        self.configure_logging()
-
-    def read_config_from_file(self):
+    def read_config_from_file(self, parser=None):
         for path in self.search_paths:
             if os.path.isfile(path):
-                self.force_load_file(path)
+                self.force_load_file(path, parser)
+
+    def force_load_file(self, path, parser=None):
+        if parser is None:
+            parser = self.loaded_config
 
-    def force_load_file(self, path):
         if not os.path.isfile(path):
             logger.error("Cannot read config file: %s" % (path))
 
         try:
             logger.debug("Trying to open config path: %s" % (path))
             with open(path, "r") as fp:
-                self.loaded_config.read_file(fp)
+                parser.read_file(fp)
 
             return path
         except (PermissionError, FileNotFoundError) as e:
@@ -111,11 +160,59 @@ class Config:
                 "Unable to open config: %s: %s: %s" % (path, e.__class__.__name__, repr(e))
             )
 
+    def reload(self):
+        """
+        Re-read the configuration files. They are parsed and validated into a new parser
+        first; if that raises, the current configuration is left untouched. Otherwise the
+        parser is updated in place, so references previously obtained through
+        :func:`get_config` see the new values.
+        """
+        parser = configparser.RawConfigParser()
+        parser.read_dict(self.default_config)
+        self.read_config_from_file(parser)
+        self.validate(parser)
+        for option in ("cli_level", "syslog_level", "file_level"):
+            self.managed_logger.parse_level(parser["logging"][option])
+
+        for section in self.loaded_config.sections():
+            self.loaded_config.remove_section(section)
+
+        self.loaded_config.read_dict({name: dict(parser[name]) for name in parser.sections()})
+        self.configure_logging()
+
     def configure_logging(self):
         self.managed_logger.load_config(self.loaded_config)
 
-    def get_config(self):
-        return self.loaded_config
+    def validate(self, parser=None):
+        """
+        Check the ``[envoy]`` defaults of the backends' cluster settings, which would otherwise
+        only fail once a cluster is built. Checks the loaded configuration unless another
+        ``parser`` is given.
+        """
+        if parser is None:
+            parser = self.loaded_config
+
+        envoy = parser["envoy"]
+        if envoy["cluster_type"] not in cluster_types:
+            raise ValueError("[envoy] cluster_type must be one of %s" % (", ".join(cluster_types)))
+
+        if envoy["dns_lookup_family"] not in dns_lookup_families:
+            raise ValueError(
+                "[envoy] dns_lookup_family must be one of %s" % (", ".join(dns_lookup_families))
+            )
 
+        if envoy["dns_refresh_rate"]:
+            try:
+                refresh_rate = envoy.getfloat("dns_refresh_rate")
+            except ValueError:
+                refresh_rate = 0
+            if not refresh_rate > 0:
+                raise ValueError("[envoy] dns_refresh_rate must be a positive number of seconds")
 
-singleton = Config()
+        try:
+            envoy.getboolean("respect_dns_ttl")
+        except ValueError:
+            raise ValueError("[envoy] respect_dns_ttl must be true or false")
+
+    def get_config(self):
+        return self.loaded_config
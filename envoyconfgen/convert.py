@@ -1,25 +1,43 @@
 from __future__ import annotations
 
-import json
+import concurrent.futures
+import contextlib
 import sys
-from typing import Any, Tuple
-import yaml
+from typing import IO, TYPE_CHECKING, Any, Optional
 
-import google.protobuf.json_format
+from . import profiling, registry, yamlio
+from .cache import RenderCache
+from .fileio import atomic_open
 
-from .bootstrap import generate_bootstrap
-from . import processors
-from .structs import SNIProxyListener, SNIProxyVirtualHost, proxy_protocol_str_to_enum
+if TYPE_CHECKING:
+    from envoyproto.envoy.config.bootstrap.v3 import bootstrap
 
-from envoyproto.envoy.config.bootstrap.v3 import bootstrap
+    from .processors import AbstractProcessor, T_static_resources
 
 
-def process_yaml(processor: AbstractProcessor, yaml_path: str) -> bootstrap.Bootstrap:
-    with open(yaml_path, "r") as fp:
-        contents = yaml.safe_load(fp)
+class InvalidInputError(RuntimeError):
+    """
+    Raised when an input file does not pass the processor's validation. The message lists
+    every problem that was found.
+    """
+
+
+def load_yaml(yaml_path: str, raw_contents: Optional[bytes] = None) -> dict[str, Any]:
+    if raw_contents is None:
+        with profiling.stage("read"), open(yaml_path, "rb") as fp:
+            raw_contents = fp.read()
+
+    with profiling.stage("load"):
+        contents = yamlio.safe_load(raw_contents)
+    profiling.note("yaml_loader", yamlio.backend)
 
     assert isinstance(contents, dict)
-    errors = processor.validate_yaml(contents)
+    return contents
+
+
+def validate_contents(processor: AbstractProcessor, yaml_path: str, contents: Any) -> None:
+    with profiling.stage("validate"):
+        errors = processor.validate_yaml(contents)
     if len(errors) > 0:
         errstr = (
             f'Could not parse YAML file "{yaml_path}".\n'
@@ -27,30 +45,199 @@ def process_yaml(processor: AbstractProcessor, yaml_path: str) -> bootstrap.Boot
             + "".join(f"  - {e}\n" for e in errors)
         )
 
-        print(errstr, file=sys.stderr)
-        raise RuntimeError("Failed to parse YAML input")
+        raise InvalidInputError(errstr)
 
-    listeners, clusters = processor.process_yaml(contents)
-    return generate_bootstrap(listeners, clusters)
 
+def build_resources(
+    processor: AbstractProcessor, yaml_path: str, raw_contents: Optional[bytes] = None
+) -> T_static_resources:
+    """
+    Validate an input file and build its listeners and clusters.
+    """
+    contents = load_yaml(yaml_path, raw_contents)
+    validate_contents(processor, yaml_path, contents)
+    with profiling.stage("build"):
+        listeners, clusters = processor.process_yaml(contents)
 
-def do_translate(args):
-    processor = getattr(processors, args.processor)
+    profiling.count_resources(listeners, clusters)
+    return listeners, clusters
+
+
+def process_yaml(
+    processor: AbstractProcessor, yaml_path: str, raw_contents: Optional[bytes] = None
+) -> bootstrap.Bootstrap:
+    from .bootstrap import generate_bootstrap
 
-    config_root = process_yaml(processor(), args.path)
+    listeners, clusters = build_resources(processor, yaml_path, raw_contents)
+    with profiling.stage("bootstrap"):
+        return generate_bootstrap(listeners, clusters)
+
+
+def _render_contents(
+    processor: AbstractProcessor,
+    yaml_path: str,
+    raw_contents: bytes,
+    stream: IO[bytes],
+    output_format: str,
+    jobs: int = 1,
+) -> None:
+    from . import serialize
+    from .bootstrap import generate_bootstrap
+    from .config import get_config
+
+    contents = load_yaml(yaml_path, raw_contents)
+    validate_contents(processor, yaml_path, contents)
+
+    # every string of the resources comes from the input, the configuration or the builders'
+    # constants; this has to be checked before the conversion consumes the input
+    printable = serialize.printable_values(contents) and serialize.printable_values(
+        {name: dict(section) for name, section in get_config().items()}
+    )
+
+    # NOTE: the resources are built one at a time while they are written, straight from the
+    # protobuf tree, de-namespacing the type URLs of packed Any messages on the way. see
+    # :ref:`.serialize`. the profile splits the time into building the resources and the rest
+    with profiling.stage("build+write", rest="write"), contextlib.ExitStack() as stack:
+        executor = None
+        if jobs > 1:
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=jobs))
+            # a few batches per worker even out their load
+            with profiling.part("build"):
+                resources = processor.batched_resources(contents, jobs * 4)
+            profiling.note("build", "in %d worker processes, counted as write" % (jobs))
+        else:
+            with profiling.part("build"):
+                resources = processor.stream_resources(contents)
+
+        serialize.write_streamed(
+            generate_bootstrap([], []),
+            {
+                "static_resources.listeners": profiling.timed(
+                    profiling.counted_listeners(resources.listeners), "build"
+                ),
+                "static_resources.clusters": profiling.timed(
+                    profiling.counted_clusters(resources.clusters), "build"
+                ),
+            },
+            stream,
+            output_format,
+            printable,
+            executor,
+        )
+
+
+def render(
+    processor: AbstractProcessor,
+    yaml_path: str,
+    stream: IO[bytes],
+    output_format: str = "yaml",
+    cache: Optional[RenderCache] = None,
+    raw_contents: Optional[bytes] = None,
+    jobs: int = 1,
+    processor_name: Optional[str] = None,
+) -> None:
+    """
+    Render an input to ``stream``. ``raw_contents`` are used instead of reading ``yaml_path``
+    when given; the path is then only used in messages. With more than one of ``jobs``, the
+    resources are built and serialized by that many worker processes where the processor
+    supports it. A ``cache`` needs the ``processor_name`` the processor was loaded under from
+    the registry, which its entries are keyed on; evicting its old entries is up to the caller.
+    """
+    if raw_contents is None:
+        with profiling.stage("read"), open(yaml_path, "rb") as fp:
+            raw_contents = fp.read()
+
+    if cache is None:
+        _render_contents(processor, yaml_path, raw_contents, stream, output_format, jobs)
+        return
+
+    if processor_name is None:
+        raise ValueError("rendering with a cache needs the name of the processor")
+
+    key = cache.key(processor_name, raw_contents, output_format)
+    with profiling.stage("cache"):
+        hit = cache.copy_to(key, stream)
+    if hit:
+        return
+
+    with cache.store(key) as fp:
+        _render_contents(processor, yaml_path, raw_contents, fp, output_format, jobs)
+
+    cache.copy_to(key, stream)
+
+
+def render_dynamic(
+    processor: AbstractProcessor,
+    yaml_path: str,
+    stream: IO[bytes],
+    directory: str,
+    output_format: str = "yaml",
+) -> None:
+    """
+    Write the listeners, clusters and routes of an input to LDS, CDS and RDS files in
+    ``directory``, and the bootstrap loading them to ``stream``.
+    """
+    from . import serialize
+    from .dynamic import write_dynamic_resources
+
+    listeners, clusters = build_resources(processor, yaml_path)
+    with profiling.stage("serialize"):
+        serialize.write(
+            write_dynamic_resources(listeners, clusters, directory, output_format),
+            stream,
+            output_format,
+        )
+
+
+def do_translate(args):
+    processor = registry.load(args.processor)
+    path = args.path[0]
+    render_cache = RenderCache.from_args(args)
 
-    # XXX(fuhry@2022-04-18) both of the things done here are pretty awful, but (1) google
-    # native protobuf doesn't support yaml so we need json as an intermediate format, and
-    # (2) de-namespacing has to be done at this level because the json_format module
-    # deserializes google.protobuf.Any messages and writes them as json.
-    result_str = google.protobuf.json_format.MessageToJson(
-        config_root, sort_keys=True, preserving_proto_field_name=True
-    ).replace("type.googleapis.com/envoyproto.", "type.googleapis.com/")
+    profiler = None
+    if args.profile is not None:
+        profiler = profiling.Profiler(args.profile_build)
+        profiling.activate(profiler)
 
-    result_str = yaml.dump(json.loads(result_str))
+    try:
+        if args.dynamic_dir is not None:
+            if args.output is not None:
+                with atomic_open(args.output) as fp:
+                    render_dynamic(processor(), path, fp, args.dynamic_dir, args.format)
+            else:
+                sys.stdout.flush()
+                render_dynamic(processor(), path, sys.stdout.buffer, args.dynamic_dir, args.format)
+                sys.stdout.buffer.flush()
+        elif args.output is not None:
+            with atomic_open(args.output) as fp:
+                render(
+                    processor(),
+                    path,
+                    fp,
+                    args.format,
+                    render_cache,
+                    jobs=args.jobs,
+                    processor_name=args.processor,
+                )
+        else:
+            sys.stdout.flush()
+            render(
+                processor(),
+                path,
+                sys.stdout.buffer,
+                args.format,
+                render_cache,
+                jobs=args.jobs,
+                processor_name=args.processor,
+            )
+            sys.stdout.buffer.flush()
 
-    if args.output is not None:
-        with open(args.output, "w") as fp:
-            fp.write(result_str)
-    else:
-        sys.stdout.write(result_str)
+        if render_cache is not None:
+            render_cache.evict()
+    except InvalidInputError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiling.activate(None)
+            profiler.report(args.profile)
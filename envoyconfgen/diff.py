@@ -0,0 +1,260 @@
+"""
+Structural diff between a previously generated config and the one an input renders to now.
+
+Both configs are brought into their JSON form and split into resources matched by name:
+listeners, clusters, virtual hosts (taken out of their listener's route configuration) and
+the rest of the bootstrap. Resources are compared by hash, so only the ones that actually
+changed are walked to find the changed field paths.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sys
+from typing import IO, Any, Iterator, NamedTuple
+
+import yaml
+
+from . import registry, yamlio
+from .convert import InvalidInputError, process_yaml
+from .fileio import atomic_open
+
+T_resources = dict[tuple[str, str], Any]
+
+# a field which is only present on one side of a change
+_UNSET = object()
+
+
+class Change(NamedTuple):
+    status: str
+    kind: str
+    name: str
+    fields: list[tuple[str, Any, Any]]
+
+
+def load_config(path: str) -> dict[str, Any]:
+    """
+    Load a config written in any of the output formats, in its JSON form.
+    """
+    with open(path, "rb") as fp:
+        contents = fp.read()
+
+    extension = os.path.splitext(path)[1]
+    if extension == ".json":
+        # YAML 1.1 would load floats like 1e-05 as strings
+        result = json.loads(contents)
+        if not isinstance(result, dict):
+            raise ValueError(f"{path} does not contain a config")
+        return result
+    elif extension != ".pb":
+        try:
+            result = yamlio.safe_load(contents)
+        except (yaml.YAMLError, UnicodeDecodeError):
+            if extension in (".yaml", ".yml"):
+                raise
+            result = None
+
+        if isinstance(result, dict) or extension in (".yaml", ".yml"):
+            if not isinstance(result, dict):
+                raise ValueError(f"{path} does not contain a config")
+            return result
+
+    from envoyproto.envoy.config.bootstrap.v3 import bootstrap
+
+    import google.protobuf.message
+
+    from .serialize import to_plain
+
+    try:
+        return to_plain(bootstrap.Bootstrap.FromString(contents))
+    except google.protobuf.message.DecodeError as e:
+        raise ValueError(f"{path} is not a YAML, JSON or binary protobuf config: {e}") from e
+
+
+def _extract_virtual_hosts(value: Any, found: list[Any]) -> Any:
+    """
+    Copy of a listener in which every list of virtual hosts is replaced with their names.
+    """
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if key == "virtual_hosts" and isinstance(item, list):
+                found.extend(item)
+                result[key] = [vhost.get("name", "") for vhost in item]
+            else:
+                result[key] = _extract_virtual_hosts(item, found)
+        return result
+    elif isinstance(value, list):
+        return [_extract_virtual_hosts(item, found) for item in value]
+
+    return value
+
+
+def _add(resources: T_resources, kind: str, name: str, value: Any) -> None:
+    key = (kind, name)
+    suffix = 1
+    while key in resources:
+        suffix += 1
+        key = (kind, f"{name}#{suffix}")
+    resources[key] = value
+
+
+def config_resources(config: dict[str, Any]) -> T_resources:
+    """
+    Split the JSON form of a bootstrap into its resources, keyed by kind and name.
+    """
+    result: T_resources = {}
+    rest = dict(config)
+    static_resources = dict(rest.pop("static_resources", {}))
+
+    for listener in static_resources.pop("listeners", []):
+        vhosts: list[Any] = []
+        listener = _extract_virtual_hosts(listener, vhosts)
+        name = listener.get("name", "")
+        _add(result, "listener", name, listener)
+        for vhost in vhosts:
+            _add(result, "virtual_host", f"{name}/{vhost.get('name', '')}", vhost)
+
+    for cluster in static_resources.pop("clusters", []):
+        _add(result, "cluster", cluster.get("name", ""), cluster)
+
+    if len(static_resources) > 0:
+        rest["static_resources"] = static_resources
+    result[("bootstrap", "")] = rest
+
+    return result
+
+
+def resource_hash(value: Any) -> bytes:
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).digest()
+
+
+def _named(items: list[Any]) -> bool:
+    names = [item.get("name") if isinstance(item, dict) else None for item in items]
+    return None not in names and len(set(names)) == len(names)
+
+
+def _scalars(items: list[Any]) -> bool:
+    return not any(isinstance(item, (dict, list)) for item in items)
+
+
+def field_changes(old: Any, new: Any, path: str = "") -> Iterator[tuple[str, Any, Any]]:
+    """
+    Yields ``(field path, old value, new value)`` for every difference between two values.
+    List items are matched by name when they all have a distinct one. Items of lists of
+    scalars are reported as added or removed (``path[]``), unless only their order changed.
+    Other lists are compared by index.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(old.keys() | new.keys()):
+            sub_path = f"{path}.{key}" if path else key
+            old_value = old.get(key, _UNSET)
+            new_value = new.get(key, _UNSET)
+            if old_value != new_value:
+                yield from field_changes(old_value, new_value, sub_path)
+    elif isinstance(old, list) and isinstance(new, list):
+        if _named(old) and _named(new):
+            old_items = {item["name"]: item for item in old}
+            new_items = {item["name"]: item for item in new}
+            keys = list(old_items) + [name for name in new_items if name not in old_items]
+        elif _scalars(old) and _scalars(new) and sorted(map(repr, old)) != sorted(map(repr, new)):
+            for item in old:
+                if item not in new:
+                    yield f"{path}[]", item, _UNSET
+            for item in new:
+                if item not in old:
+                    yield f"{path}[]", _UNSET, item
+            return
+        else:
+            old_items = dict(enumerate(old))
+            new_items = dict(enumerate(new))
+            keys = list(range(max(len(old), len(new))))
+
+        for key in keys:
+            old_value = old_items.get(key, _UNSET)
+            new_value = new_items.get(key, _UNSET)
+            if old_value != new_value:
+                yield from field_changes(old_value, new_value, f"{path}[{key}]")
+    else:
+        yield path, old, new
+
+
+def diff_configs(old: dict[str, Any], new: dict[str, Any]) -> list[Change]:
+    old_resources = config_resources(old)
+    new_resources = config_resources(new)
+
+    changes = []
+    for key, value in new_resources.items():
+        if key not in old_resources:
+            changes.append(Change("+", *key, []))
+        elif resource_hash(old_resources[key]) != resource_hash(value):
+            changes.append(Change("~", *key, list(field_changes(old_resources[key], value))))
+
+    for key in old_resources:
+        if key not in new_resources:
+            changes.append(Change("-", *key, []))
+
+    return changes
+
+
+def _format_value(value: Any, limit: int = 80) -> str:
+    if value is _UNSET:
+        return "(unset)"
+
+    result = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    if len(result) > limit:
+        result = result[: limit - 3] + "..."
+    return result
+
+
+def print_changes(changes: list[Change], file: IO[str]) -> None:
+    counts = {"+": 0, "-": 0, "~": 0}
+    for change in changes:
+        counts[change.status] += 1
+        print(f"{change.status} {change.kind} {change.name}".rstrip(), file=file)
+        for path, old, new in change.fields:
+            print(f"    {path}: {_format_value(old)} -> {_format_value(new)}", file=file)
+
+    print("%d added, %d removed, %d modified" % (counts["+"], counts["-"], counts["~"]), file=file)
+
+
+def do_diff(args) -> None:
+    """
+    Print the differences between ``--diff-against`` and the config the input renders to.
+    Exits 0 if there are none, 1 if there are and 2 on errors - like diff(1).
+    """
+    from .serialize import to_plain, write
+
+    # any failure has to exit 2: 1 would tell the caller that the config changed
+    try:
+        processor = registry.load(args.processor)()
+        config = process_yaml(processor, args.path[0])
+        current = to_plain(config)
+    except InvalidInputError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    except Exception as e:
+        print(f"Could not render {args.path[0]}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        previous = load_config(args.diff_against)
+        changes = diff_configs(previous, current)
+    except Exception as e:
+        print(f"Could not load {args.diff_against}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    print_changes(changes, sys.stdout)
+
+    if args.output is not None and len(changes) > 0:
+        try:
+            with atomic_open(args.output) as fp:
+                write(config, fp, args.format)
+        except Exception as e:
+            print(f"Could not write {args.output}: {e}", file=sys.stderr)
+            sys.exit(2)
+
+    sys.exit(1 if len(changes) > 0 else 0)
@@ -0,0 +1,166 @@
+"""
+Filesystem-based dynamic configuration: listeners, clusters and route configurations are
+written to separate LDS, CDS and RDS files next to a bootstrap which points envoy at them.
+
+Envoy watches the directory and applies a replaced file in place, without a hot restart.
+Files are replaced atomically, and only when their contents change, in an order that never
+leaves a resource referring to one envoy does not know about yet: clusters, then routes,
+then listeners.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import logging
+import os
+from typing import Collection, NamedTuple
+
+import envoyproto.envoy.config.cluster.v3 as cluster
+import envoyproto.envoy.config.core.v3 as core
+import envoyproto.envoy.config.listener.v3 as listener
+import envoyproto.envoy.config.route.v3 as route
+from envoyproto.envoy.config.bootstrap.v3 import bootstrap
+from envoyproto.envoy.extensions.filters.network.http_connection_manager.v3 import (
+    http_connection_manager as hcm,
+)
+from envoyproto.envoy.service.discovery.v3 import discovery
+
+import google.protobuf.message
+
+from .bootstrap import generate_filesystem_bootstrap
+from .fileio import atomic_open
+from .helpers import typed_config
+from .serialize import unpack_any, write
+from .watch import read_file
+
+logger = logging.getLogger(__name__)
+
+HTTP_CONNECTION_MANAGER = "envoy.filters.network.http_connection_manager"
+
+
+class ResourceFiles(NamedTuple):
+    lds: str
+    cds: str
+    rds: str
+
+
+def resource_files(directory: str, output_format: str) -> ResourceFiles:
+    directory = os.path.abspath(directory)
+    return ResourceFiles(
+        *(os.path.join(directory, f"{kind}.{output_format}") for kind in ResourceFiles._fields)
+    )
+
+
+def path_config_source(path: str) -> core.config_source.ConfigSource:
+    """
+    Config source reading a file, reloaded when it is renamed into its directory.
+    """
+    return core.config_source.ConfigSource(
+        path_config_source=core.config_source.PathConfigSource(
+            path=path,
+            watched_directory=core.base.WatchedDirectory(path=os.path.dirname(path)),
+        ),
+        resource_api_version=core.config_source.ApiVersion.V3,
+    )
+
+
+def split_routes(
+    listeners: Collection[listener.listener.Listener], rds_path: str
+) -> tuple[list[listener.listener.Listener], list[route.route.RouteConfiguration]]:
+    """
+    Move the route configurations embedded in HTTP connection managers out of the listeners.
+    The connection managers fetch them over RDS from ``rds_path`` instead.
+
+    Identical route configurations with the same name are shared. Different ones using a
+    name already taken are prefixed with the name of their listener, and numbered if that
+    name is taken as well.
+    """
+    routes: dict[str, route.route.RouteConfiguration] = {}
+    result = []
+    for original in listeners:
+        copy = listener.listener.Listener()
+        copy.CopyFrom(original)
+        for filter_chain in copy.filter_chains:
+            for network_filter in filter_chain.filters:
+                if network_filter.name != HTTP_CONNECTION_MANAGER:
+                    continue
+
+                manager = unpack_any(network_filter.typed_config)
+                if not manager.HasField("route_config"):
+                    continue
+
+                # route_config and rds are alternatives, so keep a copy of the routes
+                route_config = route.route.RouteConfiguration()
+                route_config.CopyFrom(manager.route_config)
+                if route_config.name in routes and routes[route_config.name] != route_config:
+                    base = f"{copy.name}_{route_config.name}"
+                    route_config.name = base
+                    counter = 1
+                    while route_config.name in routes and routes[route_config.name] != route_config:
+                        counter += 1
+                        route_config.name = f"{base}_{counter}"
+                routes.setdefault(route_config.name, route_config)
+
+                manager.rds.CopyFrom(
+                    hcm.Rds(
+                        config_source=path_config_source(rds_path),
+                        route_config_name=route_config.name,
+                    )
+                )
+                network_filter.typed_config.CopyFrom(typed_config(manager))
+        result.append(copy)
+
+    return result, list(routes.values())
+
+
+def discovery_response(
+    resources: Collection[google.protobuf.message.Message],
+) -> discovery.DiscoveryResponse:
+    packed = [typed_config(resource) for resource in resources]
+    digest = hashlib.sha256()
+    for resource in packed:
+        digest.update(resource.value)
+
+    return discovery.DiscoveryResponse(version_info=digest.hexdigest()[:16], resources=packed)
+
+
+def replace_file(path: str, message: google.protobuf.message.Message, output_format: str) -> bool:
+    """
+    Atomically replace a file with the serialized message, unless it already contains it.
+    Returns whether the file was replaced.
+    """
+    buffer = io.BytesIO()
+    write(message, buffer, output_format)
+    contents = buffer.getvalue()
+    if read_file(path) == contents:
+        return False
+
+    with atomic_open(path) as fp:
+        fp.write(contents)
+
+    logger.info("Wrote %s" % (path))
+    return True
+
+
+def write_dynamic_resources(
+    listeners: Collection[listener.listener.Listener],
+    clusters: Collection[cluster.cluster.Cluster],
+    directory: str,
+    output_format: str = "yaml",
+) -> bootstrap.Bootstrap:
+    """
+    Write the LDS, CDS and RDS files into ``directory``, and return the bootstrap loading
+    them.
+    """
+    files = resource_files(directory, output_format)
+    os.makedirs(os.path.dirname(files.lds), exist_ok=True)
+
+    listeners, routes = split_routes(listeners, files.rds)
+    replace_file(files.cds, discovery_response(clusters), output_format)
+    replace_file(files.rds, discovery_response(routes), output_format)
+    replace_file(files.lds, discovery_response(listeners), output_format)
+
+    return generate_filesystem_bootstrap(
+        path_config_source(files.lds), path_config_source(files.cds)
+    )
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import contextlib
+import os
+import tempfile
+from typing import IO, Iterator
+
+# the formats implemented by :ref:`.serialize`, which is only imported when a config is
+# actually rendered
+output_formats = ("yaml", "json", "pb")
+
+
+@contextlib.contextmanager
+def atomic_open(path: str) -> Iterator[IO[bytes]]:
+    """
+    Open a file for binary writing such that readers only ever see its old or its complete
+    new contents: data is written to a temporary file in the same directory, which is
+    renamed over ``path`` once the block exits without an exception.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory, prefix=".%s." % (os.path.basename(path)), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            yield fp
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        # mkstemp creates files that only the owner can read
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0o666 & ~umask)
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
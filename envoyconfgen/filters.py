@@ -12,10 +12,15 @@ from envoyproto.envoy.extensions.transport_sockets.proxy_protocol.v3 import (
 from envoyproto.envoy.extensions.transport_sockets.raw_buffer.v3 import raw_buffer
 from envoyproto.envoy.extensions.filters.network.tcp_proxy.v3 import tcp_proxy
 from envoyproto.envoy.extensions.filters.listener.tls_inspector.v3 import tls_inspector
+from envoyproto.envoy.extensions.filters.listener.proxy_protocol.v3 import (
+    proxy_protocol as listener_proxy_protocol,
+)
 
-from .helpers import file_access_log, typed_config
+from .config import get_config
+from .helpers import clone, file_access_log, interned, typed_config
 
 
+@interned
 def tls_inspector_listener_filter() -> listener.listener_components.ListenerFilter:
     return listener.listener_components.ListenerFilter(
         name="envoy.filters.listener.tls_inspector",
@@ -23,6 +28,25 @@ def tls_inspector_listener_filter() -> listener.listener_components.ListenerFilt
     )
 
 
+@interned
+def proxy_protocol_listener_filter() -> listener.listener_components.ListenerFilter:
+    """
+    Takes the downstream address from a PROXY protocol header, v1 or v2. It has to come
+    before any filter reading from the connection, like the TLS inspector.
+    """
+    return listener.listener_components.ListenerFilter(
+        name="envoy.filters.listener.proxy_protocol",
+        typed_config=typed_config(listener_proxy_protocol.ProxyProtocol()),
+    )
+
+
+@interned
+def router_http_filter() -> hcm.HttpFilter:
+    return hcm.HttpFilter(
+        name="envoy.filters.http.router", typed_config=typed_config(router.Router())
+    )
+
+
 def http_connection_manager_filter(
     route_config: route.route.RouteConfiguration,
 ) -> listener.listener_components.Filter:
@@ -35,9 +59,7 @@ def http_connection_manager_filter(
                     file_access_log(),
                 ],
                 http_filters=[
-                    hcm.HttpFilter(
-                        name="envoy.filters.http.router", typed_config=typed_config(router.Router())
-                    ),
+                    router_http_filter(),
                 ],
                 route_config=route_config,
             ),
@@ -45,21 +67,35 @@ def http_connection_manager_filter(
     )
 
 
+@interned
+def _tcp_proxy_template(access_log_path: str) -> tcp_proxy.TcpProxy:
+    return tcp_proxy.TcpProxy(
+        stat_prefix="ingress_https",
+        access_log=[
+            file_access_log(access_log_path),
+        ],
+    )
+
+
 def tcp_proxy_listener_filter(cluster_name: str) -> listener.listener_components.Filter:
+    tcp_proxy_config = clone(_tcp_proxy_template(get_config()["envoy"]["access_log"]))
+    tcp_proxy_config.cluster = cluster_name
+
     return listener.listener_components.Filter(
         name="envoy.filters.network.tcp_proxy",
-        typed_config=typed_config(
-            tcp_proxy.TcpProxy(
-                stat_prefix="ingress_https",
-                access_log=[
-                    file_access_log(),
-                ],
-                cluster=cluster_name,
-            ),
-        ),
+        typed_config=typed_config(tcp_proxy_config),
+    )
+
+
+@interned
+def raw_buffer_transport_socket() -> core.base.TransportSocket:
+    return core.base.TransportSocket(
+        name="envoy.transport_sockets.raw_buffer",
+        typed_config=typed_config(raw_buffer.RawBuffer()),
     )
 
 
+@interned
 def proxy_protocol_transport_socket(
     version: core.proxy_protocol.ProxyProtocolConfig.Version,
 ) -> core.base.TransportSocket:
@@ -73,10 +109,7 @@ def proxy_protocol_transport_socket(
                 config=core.proxy_protocol.ProxyProtocolConfig(
                     version=version,
                 ),
-                transport_socket=core.base.TransportSocket(
-                    name="envoy.transport_sockets.raw_buffer",
-                    typed_config=typed_config(raw_buffer.RawBuffer()),
-                ),
+                transport_socket=raw_buffer_transport_socket(),
             ),
         ),
     )
@@ -1,32 +1,154 @@
+import functools
 import re
+from typing import Callable, Optional, TypeVar
 
 import google.protobuf.any_pb2
 import google.protobuf.message
 import google.protobuf.duration_pb2
 
 import envoyproto.envoy.config.accesslog.v3 as accesslog
+import envoyproto.envoy.config.cluster.v3 as cluster
+import envoyproto.envoy.config.core.v3 as core
+import envoyproto.envoy.config.endpoint.v3 as endpoint
 from envoyproto.envoy.extensions.access_loggers.file.v3 import file as fal
 
-from .config import singleton
+from .config import get_config
+from .structs import ClusterOptions, is_ip_literal
 
-config = singleton.get_config()
+T_message = TypeVar("T_message", bound=google.protobuf.message.Message)
 
 
+_unclean_vhost_name_re = re.compile("[^a-z0-9]+")
+
+
+@functools.lru_cache(maxsize=65536)
 def clean_vhost_name(host: str) -> str:
-    return re.sub("[^a-z0-9]+", "_", host)
+    return _unclean_vhost_name_re.sub("_", host)
 
 
 def typed_config(message: google.protobuf.message.Message) -> google.protobuf.any_pb2.Any:
     msg = google.protobuf.any_pb2.Any()
     msg.Pack(message)
     # NOTE(fuhry@2022-04-18): the de-namespacing is currently done at a later stage
-    # in :ref:`.convert.do_translate`.
+    # in :ref:`.serialize`.
     # msg.type_url = 'type.googleapis.com/' + msg.type_url.removeprefix('type.googleapis.com/envoyproto.')
     return msg
 
 
-def file_access_log() -> accesslog.accesslog.AccessLog:
+def interned(func: Callable[..., T_message]) -> Callable[..., T_message]:
+    """
+    Memoize a factory of immutable messages, so that messages (and packed Anys in
+    particular) which are identical for every backend are only built and serialized once.
+
+    The returned messages are shared and MUST NOT be modified. Assigning them to a field of
+    another message copies them, so it is safe to use them while building other messages.
+    Arguments must be hashable.
+    """
+    return functools.cache(func)
+
+
+def clone(template: T_message) -> T_message:
+    """
+    Returns a mutable copy of a template message, typically one built by an
+    :func:`interned` factory.
+    """
+    result = type(template)()
+    result.CopyFrom(template)
+    return result
+
+
+@interned
+def _file_access_log(path: str) -> accesslog.accesslog.AccessLog:
     return accesslog.accesslog.AccessLog(
         name="envoy.access_loggers.file",
-        typed_config=typed_config(fal.FileAccessLog(path=config["envoy"]["access_log"])),
+        typed_config=typed_config(fal.FileAccessLog(path=path)),
+    )
+
+
+def file_access_log(path: Optional[str] = None) -> accesslog.accesslog.AccessLog:
+    """
+    Access log writing to ``path``, or to the configured access log if omitted.
+    """
+    # interned by path so that reloading the configuration takes effect
+    return _file_access_log(path if path is not None else get_config()["envoy"]["access_log"])
+
+
+@interned
+def cluster_template(
+    cluster_type: str = "logical_dns",
+    dns_lookup_family: str = "auto",
+    dns_refresh_rate: Optional[float] = None,
+    respect_dns_ttl: bool = False,
+) -> cluster.cluster.Cluster:
+    """
+    The settings shared by every cluster we generate; :func:`clone` it and fill in the name,
+    endpoints and transport socket. The DNS settings are ignored for static clusters.
+    """
+    result = cluster.cluster.Cluster(
+        connect_timeout=google.protobuf.duration_pb2.Duration(seconds=5),
+        type=cluster.cluster.Cluster.DiscoveryType.Value(cluster_type.upper()),
     )
+    if cluster_type != "static":
+        result.dns_lookup_family = cluster.cluster.Cluster.DnsLookupFamily.Value(
+            dns_lookup_family.upper()
+        )
+        if dns_refresh_rate is not None:
+            result.dns_refresh_rate.FromNanoseconds(int(dns_refresh_rate * 1e9))
+        if respect_dns_ttl:
+            result.respect_dns_ttl = True
+
+    return result
+
+
+def upstream_cluster_template(host: str, options: ClusterOptions) -> cluster.cluster.Cluster:
+    """
+    The cluster template for an upstream at ``host``, with the backend's options falling back
+    to the ``[envoy]`` configuration. Clusters for IP addresses are static unless a type is
+    chosen explicitly. A configured default of static only applies to IP addresses, host
+    names get logical_dns clusters instead.
+    """
+    config = get_config()["envoy"]
+    cluster_type = options.type or config.get("cluster_type", "auto")
+    if cluster_type == "auto" or (options.type is None and cluster_type == "static"):
+        cluster_type = "static" if is_ip_literal(host) else "logical_dns"
+
+    dns_refresh_rate = options.dns_refresh_rate
+    if dns_refresh_rate is None and config.get("dns_refresh_rate", ""):
+        dns_refresh_rate = config.getfloat("dns_refresh_rate")
+
+    respect_dns_ttl = options.respect_dns_ttl
+    if respect_dns_ttl is None:
+        respect_dns_ttl = config.getboolean("respect_dns_ttl", False)
+
+    return cluster_template(
+        cluster_type,
+        options.dns_lookup_family or config.get("dns_lookup_family", "auto"),
+        dns_refresh_rate,
+        respect_dns_ttl,
+    )
+
+
+@interned
+def _locality_endpoint_template() -> endpoint.endpoint_components.LocalityLbEndpoints:
+    return endpoint.endpoint_components.LocalityLbEndpoints(
+        lb_endpoints=[
+            endpoint.endpoint_components.LbEndpoint(
+                endpoint=endpoint.endpoint_components.Endpoint(
+                    address=core.address.Address(
+                        socket_address=core.address.SocketAddress(),
+                    ),
+                ),
+            ),
+        ],
+    )
+
+
+def locality_endpoint(host: str, port: int) -> endpoint.endpoint_components.LocalityLbEndpoints:
+    """
+    Locality with a single endpoint at ``host:port``.
+    """
+    result = clone(_locality_endpoint_template())
+    socket_address = result.lb_endpoints[0].endpoint.address.socket_address
+    socket_address.address = host
+    socket_address.port_value = port
+    return result
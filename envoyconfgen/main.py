@@ -1,34 +1,469 @@
+import os
 import sys
+import socket
 import argparse
 
-from envoyconfgen.convert import do_translate
-from envoyconfgen import processors
+from envoyconfgen.fileio import output_formats
+from envoyconfgen import registry
 
+# the modes are imported once one is picked, so that the render server's client starts quickly
 
-def main():
-    ap = argparse.ArgumentParser()
 
-    all_processors = list(processors.all())
+def add_processor_argument(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument(
+        "-p",
+        "--processor",
+        action="store",
+        help=(
+            "Which processor to use to transform the input YAML: %s, or a processor"
+            " registered in the configuration or by an installed package, see"
+            " --list-processors" % (", ".join(registry.builtin))
+        ),
+        default=registry.default,
+    )
+    ap.add_argument(
+        "--list-processors",
+        action=ListProcessorsAction,
+        help="List the registered processors and exit",
+    )
+
+
+def check_processor(ap: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    try:
+        registry.get(args.processor)
+    except registry.UnknownProcessorError as e:
+        ap.error(str(e))
+
+
+class ListProcessorsAction(argparse.Action):
+    def __init__(self, option_strings, dest, help=None):
+        super().__init__(option_strings, dest, nargs=0, default=argparse.SUPPRESS, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        for name, spec in registry.specs().items():
+            print(f"{name}: {spec.description}" if spec.description else name)
+            if len(spec.schema) > 0:
+                print("    keys: " + ", ".join(key for key, _ in spec.schema))
+        parser.exit()
+
+
+def serve_main(argv: list[str]) -> None:
+    ap = argparse.ArgumentParser(
+        prog="envoy-confgen serve",
+        description=(
+            "Serve the listeners and clusters generated from an input file to envoy over the"
+            " xDS Aggregated Discovery Service, updating them when the input changes"
+        ),
+    )
+    ap.add_argument(
+        "--listen",
+        action="store",
+        default="127.0.0.1:18000",
+        help="Address to serve gRPC on, as host:port",
+    )
+    ap.add_argument(
+        "--interval",
+        action="store",
+        type=float,
+        default=1.0,
+        help="How often to check the input and configuration files for changes, in seconds",
+    )
+    ap.add_argument(
+        "--bootstrap",
+        action="store",
+        help="Also write an envoy bootstrap config which fetches its resources from this server",
+    )
+    ap.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        help="Format of the --bootstrap file",
+        choices=output_formats,
+        default="yaml",
+    )
+    ap.add_argument(
+        "--node-id",
+        action="store",
+        default=socket.gethostname(),
+        help="Node id written to the --bootstrap file, defaults to the host name",
+    )
+    ap.add_argument(
+        "--node-cluster",
+        action="store",
+        default="envoy-confgen",
+        help="Node cluster written to the --bootstrap file",
+    )
+    ap.add_argument(
+        "--sotw",
+        action="store_true",
+        help="Make the --bootstrap file use state-of-the-world instead of delta xDS",
+    )
+    add_processor_argument(ap)
+    ap.add_argument("path", action="store", help="The listener map file to serve")
+    args = ap.parse_args(argv)
+    check_processor(ap, args)
+
+    # only serve mode needs grpc and the discovery service protos
+    from envoyconfgen.xds import do_serve
 
+    do_serve(args)
+
+
+def add_socket_argument(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument(
+        "--socket",
+        action="store",
+        default=os.environ.get("ENVOY_CONFGEN_SOCKET"),
+        required="ENVOY_CONFGEN_SOCKET" not in os.environ,
+        help="Path of the render server's Unix socket, defaults to $ENVOY_CONFGEN_SOCKET",
+    )
+
+
+def server_main(argv: list[str]) -> None:
+    ap = argparse.ArgumentParser(
+        prog="envoy-confgen server",
+        description=(
+            "Render inputs sent by 'envoy-confgen client' over a Unix socket, keeping the"
+            " processors and the configuration loaded between renders"
+        ),
+    )
+    add_socket_argument(ap)
+    ap.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes rendering requests in parallel",
+    )
+    args = ap.parse_args(argv)
+
+    from envoyconfgen.render_server import do_server
+
+    do_server(args)
+
+
+def client_main(argv: list[str]) -> None:
+    ap = argparse.ArgumentParser(
+        prog="envoy-confgen client",
+        description="Render an input with a running 'envoy-confgen server'",
+    )
+    add_socket_argument(ap)
     ap.add_argument(
         "-o",
         "--output",
         action="store",
-        required=False,
         help="Output file to write to - defaults to stdout",
     )
+    ap.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        help="Output format: YAML, JSON or binary protobuf (envoy accepts all three)",
+        choices=output_formats,
+        default="yaml",
+    )
     ap.add_argument(
         "-p",
         "--processor",
         action="store",
-        help="Which processor to use to transform the input YAML",
-        choices=[p.__name__ for p in all_processors],
-        default=all_processors[0].__name__,
+        help="Which processor the server uses to transform the input YAML",
+        default=registry.default,
     )
     ap.add_argument("path", action="store", help="The listener map file to convert")
+    args = ap.parse_args(argv)
+
+    from envoyconfgen.render_client import do_client
+
+    do_client(args)
+
+
+def main():
+    if sys.argv[1:2] == ["serve"]:
+        serve_main(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ["server"]:
+        server_main(sys.argv[2:])
+        return
+
+    if sys.argv[1:2] == ["client"]:
+        client_main(sys.argv[2:])
+        return
+
+    ap = argparse.ArgumentParser(
+        epilog=(
+            "Run 'envoy-confgen serve --help' for serving the generated resources over xDS, and"
+            " 'envoy-confgen server --help' for rendering inputs sent over a Unix socket"
+        ),
+    )
+
+    ap.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        required=False,
+        help=(
+            "Output file to write to - defaults to stdout. When rendering several inputs, a"
+            " template in which {name} is replaced with the input's file name (without its"
+            " extension) and {ext} with the output format"
+        ),
+    )
+    ap.add_argument(
+        "--output-dir",
+        action="store",
+        required=False,
+        help="Render every input to {name}.{ext} in this directory",
+    )
+    ap.add_argument(
+        "--dynamic-dir",
+        action="store",
+        required=False,
+        help=(
+            "Write listeners, clusters and routes to LDS, CDS and RDS files in this directory,"
+            " and output a bootstrap which loads them. Envoy applies changes to these files"
+            " without a restart"
+        ),
+    )
+    ap.add_argument(
+        "--diff-against",
+        action="store",
+        required=False,
+        help=(
+            "Compare the generated config with a previous output (in any format) and print the"
+            " added, removed and modified resources. Exits 0 if nothing changed, 1 otherwise;"
+            " -o is only written when something changed"
+        ),
+    )
+    ap.add_argument(
+        "--shards",
+        action="store",
+        type=int,
+        help=(
+            "zkfp only: split the backends across this many configs using consistent hashing,"
+            " written to --output-dir or an --output template containing {shard}"
+        ),
+    )
+    ap.add_argument(
+        "--shard-key",
+        action="store",
+        help="With --shards, the backend key hashed to pick the shard of a backend (default: host)",
+    )
+    ap.add_argument(
+        "--shard-host",
+        action="store",
+        help=(
+            "With --shards, the address of a shard, used by --front-tier. {shard} is replaced"
+            " with its number (default: envoy-shard-{shard})"
+        ),
+    )
+    ap.add_argument(
+        "--front-tier",
+        action="store",
+        help=(
+            "With --shards, also write a config routing every backend's patterns to its shard."
+            " It sends the client's address to the shards with the PROXY protocol (v2), which"
+            " the shards' listeners then expect"
+        ),
+    )
+    ap.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes used when rendering or checking several inputs",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        default=1,
+        help=(
+            "Build and serialize the resources of a single input with this many worker"
+            " processes. The output is the same; zkfp only"
+        ),
+    )
+    ap.add_argument(
+        "--check",
+        action="store_true",
+        help=(
+            "Only validate the inputs, in depth and without building anything. Every problem"
+            " is printed with its line; exits 1 if any input has problems. Several inputs are"
+            " checked in parallel, see --workers"
+        ),
+    )
+    ap.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running, re-rendering inputs when they or the configuration files change",
+    )
+    ap.add_argument(
+        "--interval",
+        action="store",
+        type=float,
+        help="How often to check for changes in --watch mode, in seconds (default: 1)",
+    )
+    ap.add_argument(
+        "--on-change",
+        action="store",
+        help=(
+            "Shell command to run in --watch mode after outputs have changed. The changed"
+            " files are passed in the ENVOY_CONFGEN_CHANGED environment variable"
+        ),
+    )
+    ap.add_argument(
+        "--cache-dir",
+        action="store",
+        help=(
+            "Directory of the render cache, which skips inputs that rendered before with the"
+            " same configuration. Overrides the [cache] dir setting"
+        ),
+    )
+    ap.add_argument(
+        "--cache-size",
+        action="store",
+        type=int,
+        help="Size limit of the render cache in MiB. Overrides the [cache] max_size setting",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't use the render cache, even if one is configured",
+    )
+    ap.add_argument(
+        "--profile",
+        action="store",
+        nargs="?",
+        const="-",
+        metavar="PATH",
+        help=(
+            "Record the wall time, CPU time and peak RSS of every stage of the render, and"
+            " the number of generated resources. Printed to stderr, or written as JSON with"
+            " --profile=PATH"
+        ),
+    )
+    ap.add_argument(
+        "--profile-build",
+        action="store",
+        metavar="PATH",
+        help="With --profile, also write a cProfile dump of the build stage to this file",
+    )
+    ap.add_argument(
+        "-f",
+        "--format",
+        action="store",
+        help="Output format: YAML, JSON or binary protobuf (envoy accepts all three)",
+        choices=output_formats,
+        default="yaml",
+    )
+    add_processor_argument(ap)
+    ap.add_argument(
+        "path",
+        action="store",
+        nargs="+",
+        help="The listener map file(s) to convert, or directories of them",
+    )
     args = ap.parse_args(sys.argv[1:])
+    check_processor(ap, args)
+
+    if args.dynamic_dir is not None and (
+        args.watch
+        or len(args.path) > 1
+        or os.path.isdir(args.path[0])
+        or args.output_dir is not None
+        or args.shards is not None
+    ):
+        ap.error(
+            "--dynamic-dir renders a single input file, and can't be used with --watch,"
+            " --output-dir or --shards"
+        )
+
+    if args.diff_against is not None and (
+        args.watch
+        or len(args.path) > 1
+        or os.path.isdir(args.path[0])
+        or args.output_dir is not None
+        or args.dynamic_dir is not None
+        or args.shards is not None
+        or args.front_tier is not None
+    ):
+        ap.error(
+            "--diff-against compares a single input file, and can't be used with --watch,"
+            " several inputs, a directory, --output-dir, --dynamic-dir, --shards or --front-tier"
+        )
+
+    if args.shards is not None and (args.watch or len(args.path) > 1 or args.shards < 1):
+        ap.error("--shards needs a single input and a positive number of shards")
+
+    if not args.watch and (args.interval is not None or args.on_change is not None):
+        ap.error("--interval and --on-change need --watch")
+
+    if args.shards is None and (
+        args.shard_key is not None or args.shard_host is not None or args.front_tier is not None
+    ):
+        ap.error("--shard-key, --shard-host and --front-tier need --shards")
+
+    if (args.profile is not None or args.profile_build is not None) and (
+        args.profile is None
+        or args.watch
+        or len(args.path) > 1
+        or os.path.isdir(args.path[0])
+        or args.output_dir is not None
+        or args.diff_against is not None
+        or args.shards is not None
+    ):
+        ap.error("--profile renders a single input, and --profile-build needs --profile")
+
+    if args.jobs != 1 and (
+        args.jobs < 1
+        or args.watch
+        or len(args.path) > 1
+        or os.path.isdir(args.path[0])
+        or args.output_dir is not None
+        or args.dynamic_dir is not None
+        or args.diff_against is not None
+        or args.shards is not None
+        or args.check
+    ):
+        ap.error("--jobs renders a single input with a positive number of workers")
+
+    if args.check and (
+        args.watch
+        or args.output is not None
+        or args.output_dir is not None
+        or args.dynamic_dir is not None
+        or args.diff_against is not None
+        or args.shards is not None
+        or args.profile is not None
+    ):
+        ap.error("--check only validates its inputs, and can't be combined with outputs")
+
+    if args.check:
+        from envoyconfgen.check import do_check
+
+        do_check(args)
+    elif args.watch:
+        from envoyconfgen.watch import do_watch
+
+        do_watch(args)
+    elif args.diff_against is not None:
+        from envoyconfgen.diff import do_diff
+
+        do_diff(args)
+    elif args.shards is not None:
+        from envoyconfgen.zkfp.shard import do_shard
+
+        do_shard(args)
+    elif len(args.path) > 1 or os.path.isdir(args.path[0]) or args.output_dir is not None:
+        from envoyconfgen.batch import do_batch
+
+        do_batch(args)
+    else:
+        from envoyconfgen.convert import do_translate
 
-    do_translate(args)
+        do_translate(args)
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@ from os import access
 import sys
 import re
 
-from typing import Collection
+from typing import Collection, Optional
 
 import envoyproto.envoy.config.listener.v3 as listener
 import envoyproto.envoy.config.core.v3 as core
@@ -15,20 +15,27 @@ from envoyconfgen.filters import (
     tcp_proxy_listener_filter,
 )
 from envoyconfgen.helpers import typed_config, file_access_log
+from envoyconfgen.mtls_sidecar.patterns import (
+    CompiledPatterns,
+    compile_dns_patterns,
+    compile_spiffe_patterns,
+)
 from envoyconfgen.structs import MTLSSidecar
 from google.protobuf.wrappers_pb2 import BoolValue
 import google.protobuf.duration_pb2
 
 
-def mtls_sidecar_virtual_host(params: MTLSSidecar.Listener) -> route.route_components.VirtualHost:
+def mtls_sidecar_virtual_host(
+    params: MTLSSidecar.Listener, names: MTLSSidecar.Names = MTLSSidecar.Names()
+) -> route.route_components.VirtualHost:
     return route.route_components.VirtualHost(
-        name="mtls_sidecar_vhost",
+        name=names.virtual_host,
         domains=["*"],
         routes=[
             route.route_components.Route(
                 match=route.route_components.RouteMatch(prefix="/"),
                 route=route.route_components.RouteAction(
-                    cluster="mtls_sidecar_backend",
+                    cluster=names.cluster,
                     timeout=google.protobuf.duration_pb2.Duration(seconds=params.timeouts.route),
                 ),
             ),
@@ -36,57 +43,46 @@ def mtls_sidecar_virtual_host(params: MTLSSidecar.Listener) -> route.route_compo
     )
 
 
-def mtls_sidecar_root_routes(params: MTLSSidecar.Listener) -> route.route.RouteConfiguration:
+def mtls_sidecar_root_routes(
+    params: MTLSSidecar.Listener, names: MTLSSidecar.Names = MTLSSidecar.Names()
+) -> route.route.RouteConfiguration:
     return route.route.RouteConfiguration(
-        name="local_route",
-        virtual_hosts=[mtls_sidecar_virtual_host(params)],
+        name=names.routes,
+        virtual_hosts=[mtls_sidecar_virtual_host(params, names)],
     )
 
 
-def mtls_sidecar_dns_match(pattern: str) -> tls.common.SubjectAltNameMatcher:
-    return tls.common.SubjectAltNameMatcher(
-        san_type=tls.common.SubjectAltNameMatcher.DNS,
-        matcher=string.StringMatcher(
-            safe_regex=regex.RegexMatcher(
-                google_re2=regex.RegexMatcher.GoogleRE2(),
-                regex=(
-                    "^"
-                    + pattern.replace(".", "\\.")
-                    .replace("**", "[A-Za-z0-9_-]+(\\.[A-Za-z0-9_-]+){0,}")
-                    .replace("*", "[A-Za-z0-9_-]+")
-                    + "$"
-                ),
-            ),
+def mtls_sidecar_regex_matcher(pattern: str) -> string.StringMatcher:
+    return string.StringMatcher(
+        safe_regex=regex.RegexMatcher(
+            google_re2=regex.RegexMatcher.GoogleRE2(),
+            regex=pattern,
         ),
     )
 
 
-def mtls_sidecar_spiffe_match(
-    principal: MTLSSidecar.Listener.SPIFFEMatch,
-) -> tls.common.SubjectAltNameMatcher:
-    return tls.common.SubjectAltNameMatcher(
-        san_type=tls.common.SubjectAltNameMatcher.URI,
-        matcher=string.StringMatcher(
-            safe_regex=regex.RegexMatcher(
-                google_re2=regex.RegexMatcher.GoogleRE2(),
-                regex=(
-                    "^spiffe://"
-                    + principal.trust_domain.replace(".", "\\.")
-                    .replace("**", "[A-Za-z0-9_-]+(\\.[A-Za-z0-9_-]+){0,}")
-                    .replace("*", "[A-Za-z0-9_-]+")
-                    + "/"
-                    + principal.service.replace(".", "\\.")
-                    .replace("**", "[A-Za-z0-9_\\.-]+(\\/[A-Za-z0-9_-]+){0,}")
-                    .replace("*", "[A-Za-z0-9_\\.-]+")
-                    + "$"
-                ),
-            ),
-        ),
-    )
+def mtls_sidecar_san_matchers(
+    san_type: tls.common.SubjectAltNameMatcher.SanType, compiled: CompiledPatterns
+) -> list[tls.common.SubjectAltNameMatcher]:
+    return [
+        tls.common.SubjectAltNameMatcher(
+            san_type=san_type,
+            matcher=string.StringMatcher(exact=name),
+        )
+        for name in compiled.exact
+    ] + [
+        tls.common.SubjectAltNameMatcher(
+            san_type=san_type,
+            matcher=mtls_sidecar_regex_matcher(pattern),
+        )
+        for pattern in compiled.regexes
+    ]
 
 
-def mtls_sidecar_listener(params: MTLSSidecar.Listener) -> listener.listener.Listener:
-    transport_socket = core.base.TransportSocket(
+def mtls_sidecar_downstream_transport_socket(
+    params: MTLSSidecar.Listener,
+) -> core.base.TransportSocket:
+    return core.base.TransportSocket(
         name="envoy.transport_sockets.tls",
         typed_config=typed_config(
             tls.tls.DownstreamTlsContext(
@@ -94,11 +90,14 @@ def mtls_sidecar_listener(params: MTLSSidecar.Listener) -> listener.listener.Lis
                     validation_context=tls.common.CertificateValidationContext(
                         trusted_ca=core.base.DataSource(filename=params.ca_cert),
                         match_typed_subject_alt_names=(
-                            [mtls_sidecar_dns_match(pattern) for pattern in params.match_dns]
-                            + [
-                                mtls_sidecar_spiffe_match(principal)
-                                for principal in params.match_spiffe
-                            ]
+                            mtls_sidecar_san_matchers(
+                                tls.common.SubjectAltNameMatcher.DNS,
+                                compile_dns_patterns(params.match_dns),
+                            )
+                            + mtls_sidecar_san_matchers(
+                                tls.common.SubjectAltNameMatcher.URI,
+                                compile_spiffe_patterns(params.match_spiffe),
+                            )
                         ),
                     ),
                     tls_certificates=[
@@ -113,18 +112,27 @@ def mtls_sidecar_listener(params: MTLSSidecar.Listener) -> listener.listener.Lis
         ),
     )
 
+
+def mtls_sidecar_listener(
+    params: MTLSSidecar.Listener,
+    names: MTLSSidecar.Names = MTLSSidecar.Names(),
+    transport_socket: Optional[core.base.TransportSocket] = None,
+) -> listener.listener.Listener:
+    if transport_socket is None:
+        transport_socket = mtls_sidecar_downstream_transport_socket(params)
+
     network_filter: listener.listener_components.Filter | None = None
     if params.protocol is MTLSSidecar.Listener.UpstreamProtocol.HTTP:
         network_filter = http_connection_manager_filter(
-            route_config=mtls_sidecar_root_routes(params),
+            route_config=mtls_sidecar_root_routes(params, names),
         )
     elif params.protocol is MTLSSidecar.Listener.UpstreamProtocol.TCP:
-        network_filter = tcp_proxy_listener_filter(cluster_name="mtls_sidecar_backend")
+        network_filter = tcp_proxy_listener_filter(cluster_name=names.cluster)
 
-    assert network_filter is not None, (f"unhandled upstream protocol: {params.protocol}")
+    assert network_filter is not None, f"unhandled upstream protocol: {params.protocol}"
 
     return listener.listener.Listener(
-        name="mtls_sidecar_listener",
+        name=names.listener,
         address=core.address.Address(
             socket_address=core.address.SocketAddress(
                 address="::",
@@ -135,9 +143,30 @@ def mtls_sidecar_listener(params: MTLSSidecar.Listener) -> listener.listener.Lis
         filter_chains=[
             listener.listener_components.FilterChain(
                 transport_socket=transport_socket,
-                filters=[
-                    network_filter
-                ],
+                filters=[network_filter],
             ),
         ],
     )
+
+
+def mtls_sidecar_listeners(sidecars: Collection[MTLSSidecar]) -> list[listener.listener.Listener]:
+    """
+    The listeners of several sidecars. Listeners with the same certificate, key, CA and
+    patterns share their TLS context, whose patterns are only compiled once.
+    """
+    transport_sockets: dict[tuple, core.base.TransportSocket] = {}
+    result = []
+    for sidecar in sidecars:
+        params = sidecar.listener
+        key = (
+            params.ca_cert,
+            params.cert,
+            params.key,
+            tuple(params.match_dns or ()),
+            tuple(params.match_spiffe or ()),
+        )
+        if key not in transport_sockets:
+            transport_sockets[key] = mtls_sidecar_downstream_transport_socket(params)
+        result.append(mtls_sidecar_listener(params, sidecar.names, transport_sockets[key]))
+
+    return result
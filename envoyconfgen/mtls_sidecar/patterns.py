@@ -0,0 +1,195 @@
+"""
+Compiler for the ``match_dns`` and ``match_spiffe`` wildcards of the mTLS sidecar.
+
+Each pattern translates to an RE2 regex. Patterns without wildcards become ``exact`` matchers
+instead, and the regexes of the remaining patterns of a SAN type are merged into alternations
+factored on their common labels, so envoy evaluates a few regexes per handshake instead of one
+per pattern.
+
+A leading wildcard is not turned into a ``suffix`` matcher: ``*`` only matches a single label of
+``[A-Za-z0-9_-]`` characters, and a suffix would accept other names as well.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Iterable, NamedTuple, Optional
+
+from envoyconfgen.structs import MTLSSidecar
+
+DNS_LABEL = "[A-Za-z0-9_-]+"
+DNS_LABELS = "[A-Za-z0-9_-]+(\\.[A-Za-z0-9_-]+){0,}"
+SPIFFE_SEGMENT = "[A-Za-z0-9_\\.-]+"
+SPIFFE_SEGMENTS = "[A-Za-z0-9_\\.-]+(\\/[A-Za-z0-9_-]+){0,}"
+
+# envoy rejects regexes compiling to more than 100 RE2 instructions by default. the length of
+# these regexes is an upper bound of their program size, with some room for the anchors.
+MAX_REGEX_LENGTH = 90
+
+# patterns made of these characters can be split on their separators and factored; anything else
+# could have a meaning in a regex, and is kept in a regex of its own
+_factorable = re.compile(r"[A-Za-z0-9_.*/-]*")
+_separators = re.compile(r"([./])")
+
+
+class CompiledPatterns(NamedTuple):
+    exact: list[str]
+    regexes: list[str]
+
+
+def _wildcards(text: str, one: str, many: str) -> str:
+    return text.replace(".", "\\.").replace("**", many).replace("*", one)
+
+
+def dns_regex(pattern: str) -> str:
+    """
+    the regex matching the DNS names of a ``match_dns`` pattern
+    """
+    return "^" + _wildcards(pattern, DNS_LABEL, DNS_LABELS) + "$"
+
+
+def spiffe_regex(principal: MTLSSidecar.Listener.SPIFFEMatch) -> str:
+    """
+    the regex matching the SPIFFE IDs of a ``match_spiffe`` principal
+    """
+    return (
+        "^spiffe://"
+        + _wildcards(principal.trust_domain, DNS_LABEL, DNS_LABELS)
+        + "/"
+        + _wildcards(principal.service, SPIFFE_SEGMENT, SPIFFE_SEGMENTS)
+        + "$"
+    )
+
+
+def _tokens(text: str, one: str, many: str) -> list[str]:
+    """
+    Split a pattern into the regexes of its labels, each but the first starting with the
+    separator before it. Their concatenation is the regex of the whole pattern.
+    """
+    parts = _separators.split(text)
+    tokens = [_wildcards(parts[0], one, many)]
+    for separator, part in zip(parts[1::2], parts[2::2]):
+        tokens.append(_wildcards(separator, one, many) + _wildcards(part, one, many))
+
+    return tokens
+
+
+class _Node:
+    __slots__ = ("children", "terminal")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.terminal = False
+
+
+def _alternation(node: _Node, common_suffixes: bool) -> str:
+    branches = []
+    for token, child in node.children.items():
+        rest = _alternation(child, common_suffixes)
+        branches.append(rest + token if common_suffixes else token + rest)
+
+    if len(branches) == 0:
+        return ""
+    if len(branches) == 1 and not node.terminal:
+        return branches[0]
+
+    return "(?:%s)%s" % ("|".join(branches), "?" if node.terminal else "")
+
+
+def factored_regex(patterns: Iterable[list[str]], common_suffixes: bool) -> str:
+    """
+    A regex matching what any of the token lists matches, with their common prefixes (or
+    suffixes) written once.
+    """
+    root = _Node()
+    for tokens in patterns:
+        node = root
+        for token in reversed(tokens) if common_suffixes else tokens:
+            node = node.children.setdefault(token, _Node())
+        node.terminal = True
+
+    return "^" + _alternation(root, common_suffixes) + "$"
+
+
+def _merged_regexes(patterns: list[list[str]], common_suffixes: bool) -> list[str]:
+    # sorting puts the patterns sharing the most labels next to each other
+    order = (lambda tokens: tokens[::-1]) if common_suffixes else None
+    result = []
+    group: list[list[str]] = []
+    for tokens in sorted(patterns, key=order):
+        if len(group) > 0 and (
+            len(factored_regex(group + [tokens], common_suffixes)) > MAX_REGEX_LENGTH
+        ):
+            result.append(factored_regex(group, common_suffixes))
+            group = []
+        group.append(tokens)
+
+    if len(group) > 0:
+        result.append(factored_regex(group, common_suffixes))
+
+    return result
+
+
+def _compile(
+    patterns: Iterable[tuple[Optional[str], Optional[list[str]], str]], common_suffixes: bool
+) -> CompiledPatterns:
+    exact = []
+    factorable = []
+    regexes = []
+    for literal, tokens, regex in patterns:
+        if literal is not None:
+            exact.append(literal)
+        elif tokens is not None:
+            factorable.append(tokens)
+        else:
+            regexes.append(regex)
+
+    return CompiledPatterns(
+        exact=list(dict.fromkeys(exact)),
+        regexes=_merged_regexes(factorable, common_suffixes) + list(dict.fromkeys(regexes)),
+    )
+
+
+def compile_dns_patterns(patterns: Iterable[str]) -> CompiledPatterns:
+    """
+    The exact names and regexes accepting the same DNS SANs as the ``match_dns`` patterns.
+    DNS patterns are factored on their common suffixes.
+    """
+
+    def parse(pattern: str) -> tuple[Optional[str], Optional[list[str]], str]:
+        if _factorable.fullmatch(pattern) is None:
+            return None, None, dns_regex(pattern)
+        if "*" not in pattern:
+            return pattern, None, dns_regex(pattern)
+        return None, _tokens(pattern, DNS_LABEL, DNS_LABELS), dns_regex(pattern)
+
+    return _compile(map(parse, patterns), common_suffixes=True)
+
+
+def compile_spiffe_patterns(
+    principals: Iterable[MTLSSidecar.Listener.SPIFFEMatch],
+) -> CompiledPatterns:
+    """
+    The exact IDs and regexes accepting the same URI SANs as the ``match_spiffe`` principals.
+    SPIFFE IDs are factored on their common prefixes, the trust domain first.
+    """
+
+    def parse(
+        principal: MTLSSidecar.Listener.SPIFFEMatch,
+    ) -> tuple[Optional[str], Optional[list[str]], str]:
+        regex = spiffe_regex(principal)
+        if (
+            _factorable.fullmatch(principal.trust_domain) is None
+            or _factorable.fullmatch(principal.service) is None
+        ):
+            return None, None, regex
+        if "*" not in principal.trust_domain and "*" not in principal.service:
+            return f"spiffe://{principal.trust_domain}/{principal.service}", None, regex
+
+        tokens = _tokens(principal.trust_domain, DNS_LABEL, DNS_LABELS)
+        tokens[0] = "spiffe://" + tokens[0]
+        service = _tokens(principal.service, SPIFFE_SEGMENT, SPIFFE_SEGMENTS)
+        service[0] = "/" + service[0]
+        return None, tokens + service, regex
+
+    return _compile(map(parse, principals), common_suffixes=False)
@@ -1,20 +1,117 @@
 from __future__ import annotations
 from abc import abstractmethod
-from typing import Any, Iterable
-import sys, inspect
+from typing import TYPE_CHECKING, Any, Callable, Iterable, NamedTuple, Optional
+import logging, re
+
+from .structs import (
+    ClusterOptions,
+    MTLSSidecar,
+    SNIProxyListener,
+    SNIProxyVirtualHost,
+    Timeouts,
+    cluster_types,
+    dns_lookup_families,
+    is_ip_literal,
+    mtls_sidecar_schema,
+    mtls_sidecars_schema,
+    proxy_protocol_str_to_enum,
+    zkfp_schema,
+)
+from .schema import LocatedError, T_path
+
+# NOTE: the resource builders, and with them the envoy protobuf modules, are imported by the
+# processors' process_yaml methods so that only the selected processor's modules get loaded.
+if TYPE_CHECKING:
+    import envoyproto.envoy.config.cluster.v3 as cluster
+    import envoyproto.envoy.config.listener.v3 as listener
+
+
+T_static_resources = tuple[list["listener.listener.Listener"], list["cluster.cluster.Cluster"]]
+T_yaml = dict[str, Any]
 
-from .zkfp.cluster import sni_reverse_proxy_http_cluster, sni_reverse_proxy_https_cluster
-from .zkfp.listener import sni_reverse_proxy_listener
-from .mtls_sidecar.cluster import mtls_sidecar_cluster
-from .mtls_sidecar.listener import mtls_sidecar_listener
-from .structs import MTLSSidecar, SNIProxyListener, SNIProxyVirtualHost, Timeouts, proxy_protocol_str_to_enum
 
-import envoyproto.envoy.config.cluster.v3 as cluster
-import envoyproto.envoy.config.listener.v3 as listener
+class ResourceStream(NamedTuple):
+    """
+    Listeners and clusters built lazily, one at a time, as they are iterated. Each iterable
+    can be consumed once, in either order.
+    """
 
+    listeners: Iterable["listener.listener.Listener"]
+    clusters: Iterable["cluster.cluster.Cluster"]
 
-T_static_resources = tuple[list[listener.listener.Listener], list[cluster.cluster.Cluster]]
-T_yaml = dict[str, Any]
+
+logger = logging.getLogger(__name__)
+
+# resource names are derived from the names of mtls_sidecar's sidecars
+_sidecar_name_re = re.compile(r"[A-Za-z0-9_-]+")
+_loopback_hosts = frozenset(["127.0.0.1", "::1", "localhost"])
+
+# smaller batches of zkfp resources cost more to hand to a worker process than to build
+_min_batch_size = 500
+
+
+def cluster_options_errors(where: str, host: Any, options: Any, path: T_path) -> list[str]:
+    """
+    Validate the ``cluster`` settings of a backend, found at ``path`` in the input.
+    """
+    if options is None:
+        return []
+    if not isinstance(options, dict):
+        return [LocatedError(path, f'{where}: "cluster" must be a dictionary')]
+
+    errors = [
+        LocatedError(path + (key,), f'{where}: unknown cluster setting "{key}"')
+        for key in options
+        if key not in ClusterOptions._fields
+    ]
+    if options.get("type") not in (None,) + cluster_types:
+        errors.append(
+            LocatedError(
+                path + ("type",), f'{where}: cluster type must be one of {", ".join(cluster_types)}'
+            )
+        )
+    elif options.get("type") == "static" and not (isinstance(host, str) and is_ip_literal(host)):
+        errors.append(
+            LocatedError(
+                path + ("type",), f"{where}: static clusters need an IP address as the host"
+            )
+        )
+    if options.get("dns_lookup_family") not in (None,) + dns_lookup_families:
+        errors.append(
+            LocatedError(
+                path + ("dns_lookup_family",),
+                f'{where}: dns_lookup_family must be one of {", ".join(dns_lookup_families)}',
+            )
+        )
+    refresh_rate = options.get("dns_refresh_rate")
+    if refresh_rate is not None and (
+        isinstance(refresh_rate, bool)
+        or not isinstance(refresh_rate, (int, float))
+        or refresh_rate <= 0
+    ):
+        errors.append(
+            LocatedError(
+                path + ("dns_refresh_rate",),
+                f"{where}: dns_refresh_rate must be a positive number of seconds",
+            )
+        )
+    if options.get("respect_dns_ttl") not in (None, True, False):
+        errors.append(
+            LocatedError(
+                path + ("respect_dns_ttl",), f"{where}: respect_dns_ttl must be true or false"
+            )
+        )
+
+    return errors
+
+
+def cluster_options(options: Optional[dict[str, Any]]) -> ClusterOptions:
+    if options is None:
+        return ClusterOptions()
+
+    if options.get("dns_refresh_rate") is not None:
+        options = dict(options, dns_refresh_rate=float(options["dns_refresh_rate"]))
+    return ClusterOptions(**options)
 
 
 class AbstractProcessor:
@@ -41,10 +138,46 @@ class AbstractProcessor:
 
         return errors
 
+    def check_yaml(self, yaml: T_yaml) -> tuple[list[str], list[str]]:
+        """
+        The errors :meth:`validate_yaml` returns, and the warnings it logs. Defaults to no
+        warnings.
+        """
+        return self.validate_yaml(yaml), []
+
+    def schema(self, yaml: T_yaml) -> list[tuple[str, Any]]:
+        """
+        The required top-level keys of an input and the types of their values, which
+        :mod:`.schema` checks in depth. Defaults to :attr:`required_keys`.
+        """
+        return self.required_keys
+
     @abstractmethod
     def process_yaml(self, yaml: T_yaml) -> T_static_resources:
         raise NotImplementedError
 
+    def stream_resources(self, yaml: T_yaml) -> ResourceStream:
+        """
+        Like :meth:`process_yaml`, but builds the resources as they are consumed, so that
+        they can be written out without holding all of them in memory.
+        """
+        listeners, clusters = self.process_yaml(yaml)
+        return ResourceStream(iter(listeners), iter(clusters))
+
+    def batched_resources(self, yaml: T_yaml, batches: int) -> ResourceStream:
+        """
+        Like :meth:`stream_resources`, but runs of resources, or of the filter chains of a
+        listener, may be given as about ``batches`` :class:`~.serialize.Batch` items each, to
+        be built and serialized in parallel. Defaults to building everything here.
+        """
+        return self.stream_resources(yaml)
+
+    def preload(self) -> None:
+        """
+        Import the modules :meth:`process_yaml` imports when it is first called, for
+        long-running processes which render many inputs.
+        """
+
 
 class zkfp(AbstractProcessor):
     def _yaml_to_internal_structs(
@@ -53,7 +186,7 @@ class zkfp(AbstractProcessor):
         listeners = [SNIProxyListener(**l) for l in contents["listeners"]]
 
         def filter_mandatory_args(backend: dict[str, Any]):
-            for key in ["host", "patterns", "proxy_protocol"]:
+            for key in ["host", "patterns", "proxy_protocol", "cluster"]:
                 if key in backend:
                     del backend[key]
 
@@ -68,6 +201,7 @@ class zkfp(AbstractProcessor):
                     if "proxy_protocol" in backend and backend["proxy_protocol"] is not None
                     else None
                 ),
+                cluster=cluster_options(backend.get("cluster")),
                 **filter_mandatory_args(backend),
             )
             for backend in contents["backends"]
@@ -82,21 +216,182 @@ class zkfp(AbstractProcessor):
             ("backends", list),
         ]
 
-    def process_yaml(self, yaml: T_yaml) -> T_static_resources:
-        listeners, vhosts = self._yaml_to_internal_structs(yaml)
+    def schema(self, yaml: T_yaml) -> list[tuple[str, Any]]:
+        return zkfp_schema
 
-        envoy_listeners = [
-            sni_reverse_proxy_listener(l.protocol, l.address, l.port, vhosts) for l in listeners
-        ]
+    def validate_yaml(self, yaml: T_yaml) -> list[str]:
+        errors, warnings = self.check_yaml(yaml)
+        for warning in warnings:
+            logger.warning("%s", warning)
 
-        envoy_clusters = [sni_reverse_proxy_http_cluster(vhost) for vhost in vhosts] + [
-            sni_reverse_proxy_https_cluster(vhost) for vhost in vhosts
+        return errors
+
+    def check_yaml(self, yaml: T_yaml) -> tuple[list[str], list[str]]:
+        errors = super().validate_yaml(yaml)
+        if len(errors) > 0:
+            return errors, []
+
+        # the positions of the backends whose patterns can be indexed
+        indexed = []
+        for i, backend in enumerate(yaml["backends"]):
+            if not isinstance(backend, dict) or "host" not in backend:
+                errors.append(
+                    LocatedError(
+                        ("backends", i), f'backend #{i + 1} must be a dictionary with a "host" key'
+                    )
+                )
+            elif not isinstance(backend.get("patterns"), list) or any(
+                not isinstance(pattern, str) for pattern in backend["patterns"]
+            ):
+                errors.append(
+                    LocatedError(
+                        ("backends", i, "patterns"),
+                        f'backend #{i + 1} ("{backend["host"]}") needs a list of patterns',
+                    )
+                )
+            else:
+                indexed.append(i)
+                errors += cluster_options_errors(
+                    f'backend #{i + 1} ("{backend["host"]}")',
+                    backend["host"],
+                    backend.get("cluster"),
+                    ("backends", i, "cluster"),
+                )
+
+        from .zkfp.patterns import PatternIndex
+
+        # overlapping patterns are found before anything is built: duplicates would make
+        # envoy reject the config, the others are silently ignored by it. backends with
+        # problems of their own are left out, so that all problems are reported at once
+        index = PatternIndex()
+        for i in indexed:
+            index.add_backend(yaml["backends"][i]["patterns"])
+
+        problems = [
+            LocatedError(
+                ("backends", indexed[problem.backend], "patterns", problem.index),
+                str(
+                    problem._replace(
+                        backend=indexed[problem.backend],
+                        other_backend=indexed[problem.other_backend],
+                    )
+                ),
+            )
+            for problem in index.duplicates + index.shadowed + index.redundant
         ]
 
-        return envoy_listeners, envoy_clusters
+        return (
+            errors + problems[: len(index.duplicates)],
+            problems[len(index.duplicates) :],
+        )
+
+    def process_yaml(self, yaml: T_yaml) -> T_static_resources:
+        return self._build_resources(self._yaml_to_internal_structs(yaml))
+
+    def stream_resources(self, yaml: T_yaml) -> ResourceStream:
+        return self._stream_resources(self._yaml_to_internal_structs(yaml))
+
+    def batched_resources(self, yaml: T_yaml, batches: int) -> ResourceStream:
+        return self._batched_resources(self._yaml_to_internal_structs(yaml), batches)
+
+    def preload(self) -> None:
+        from .zkfp import cluster, listener, patterns  # noqa: F401
+
+    def _build_resources(
+        self, structs: tuple[list[SNIProxyListener], list[SNIProxyVirtualHost]]
+    ) -> T_static_resources:
+        listeners, clusters = self._stream_resources(structs)
+        return list(listeners), list(clusters)
+
+    def _stream_resources(
+        self, structs: tuple[list[SNIProxyListener], list[SNIProxyVirtualHost]]
+    ) -> ResourceStream:
+        from .zkfp.cluster import sni_reverse_proxy_cluster
+        from .zkfp.listener import listener_cluster_keys, sni_reverse_proxy_listener
+
+        listeners, vhosts = structs
+
+        # only clusters some listener can reach are generated, once per distinct upstream.
+        # the keys are collected up front; the clusters are only built when consumed
+        cluster_keys = dict.fromkeys(
+            key
+            for l in listeners
+            for key in listener_cluster_keys(l.protocol, vhosts, l.filter_chain_matcher)
+        )
+
+        return ResourceStream(
+            listeners=(
+                sni_reverse_proxy_listener(
+                    l.protocol,
+                    l.address,
+                    l.port,
+                    vhosts,
+                    filter_chain_matcher=l.filter_chain_matcher,
+                    accept_proxy_protocol=l.accept_proxy_protocol,
+                )
+                for l in listeners
+            ),
+            clusters=(sni_reverse_proxy_cluster(key) for key in cluster_keys),
+        )
+
+    def _batched_resources(
+        self, structs: tuple[list[SNIProxyListener], list[SNIProxyVirtualHost]], batches: int
+    ) -> ResourceStream:
+        from .serialize import Batch, Spliced
+        from .zkfp.cluster import sni_reverse_proxy_clusters
+        from .zkfp.listener import (
+            https_chain_matcher,
+            https_filter_chains,
+            https_listener,
+            listener_cluster_keys,
+            named_filter_chains,
+            sni_reverse_proxy_listeners,
+        )
+
+        listeners, vhosts = structs
+
+        def batched(build: Callable[[list[Any]], list[Any]], items: list[Any]) -> list[Batch]:
+            size = max(_min_batch_size, -(-len(items) // batches))
+            return [Batch(build, (items[i : i + size],)) for i in range(0, len(items), size)]
+
+        def build_listener(l: SNIProxyListener) -> Any:
+            # an http listener is a single message, built and serialized by one worker
+            if l.protocol != "https":
+                return Batch(sni_reverse_proxy_listeners, ([l], vhosts))
+
+            chain_matcher = None
+            if l.filter_chain_matcher:
+                chain_names, chain_matcher = https_chain_matcher(vhosts)
+                chains = batched(named_filter_chains, chain_names)
+            else:
+                chains = batched(https_filter_chains, vhosts)
+
+            return Spliced(
+                https_listener(l.address, l.port, [], chain_matcher, l.accept_proxy_protocol),
+                "filter_chains",
+                chains,
+            )
+
+        cluster_keys = list(
+            dict.fromkeys(
+                key
+                for l in listeners
+                for key in listener_cluster_keys(l.protocol, vhosts, l.filter_chain_matcher)
+            )
+        )
+
+        return ResourceStream(
+            listeners=(build_listener(l) for l in listeners),
+            clusters=batched(sni_reverse_proxy_clusters, cluster_keys),
+        )
 
 
 class mtls_sidecar(AbstractProcessor):
+    """
+    Either a single sidecar, with ``listener`` and ``backend`` keys, or a list of named ones
+    under ``sidecars``.
+    """
+
     @property
     def required_keys(self) -> list[tuple[str, type]]:
         return [
@@ -104,67 +399,213 @@ class mtls_sidecar(AbstractProcessor):
             ("backend", dict),
         ]
 
+    def schema(self, yaml: T_yaml) -> list[tuple[str, Any]]:
+        if isinstance(yaml, dict) and "sidecars" in yaml:
+            return mtls_sidecars_schema
+
+        return mtls_sidecar_schema
+
     def validate_yaml(self, yaml: T_yaml) -> list[str]:
+        if isinstance(yaml, dict) and "sidecars" in yaml:
+            return self._validate_sidecars(yaml)
+
         errors = super().validate_yaml(yaml)
         if len(errors) > 0:
             return errors
 
+        return self._sidecar_errors(None, (), yaml) + self._port_errors([("the sidecar", (), yaml)])
+
+    def _validate_sidecars(self, yaml: T_yaml) -> list[str]:
+        if "listener" in yaml or "backend" in yaml:
+            return ['YAML must have either a "sidecars" list or "listener" and "backend" keys']
+        if not isinstance(yaml["sidecars"], list) or len(yaml["sidecars"]) == 0:
+            return [LocatedError(("sidecars",), '"sidecars" must be a non-empty list')]
+
+        errors = []
+        sidecars = []
+        names = set()
+        for i, sidecar in enumerate(yaml["sidecars"]):
+            path = ("sidecars", i)
+            if not isinstance(sidecar, dict) or not isinstance(sidecar.get("name"), str):
+                errors.append(
+                    LocatedError(path, f'sidecar #{i + 1} must be a dictionary with a "name" key')
+                )
+                who = f"sidecar #{i + 1}"
+            else:
+                who = f'sidecar "{sidecar["name"]}"'
+                if _sidecar_name_re.fullmatch(sidecar["name"]) is None:
+                    errors.append(
+                        LocatedError(
+                            path + ("name",),
+                            f'sidecar #{i + 1}: name "{sidecar["name"]}" may only contain '
+                            + "letters, digits, underscores and dashes",
+                        )
+                    )
+                elif sidecar["name"] in names:
+                    errors.append(
+                        LocatedError(
+                            path + ("name",),
+                            f'sidecar #{i + 1}: duplicate name "{sidecar["name"]}"',
+                        )
+                    )
+                names.add(sidecar["name"])
+
+            # the ports are checked whatever is wrong with the name
+            if not isinstance(sidecar, dict):
+                continue
+            if not isinstance(sidecar.get("listener"), dict) or not isinstance(
+                sidecar.get("backend"), dict
+            ):
+                errors.append(LocatedError(path, f'{who} needs "listener" and "backend" keys'))
+            else:
+                errors += self._sidecar_errors(who, path, sidecar)
+                sidecars.append((who, path, sidecar))
+
+        return errors + self._port_errors(sidecars)
+
+    @staticmethod
+    def _sidecar_errors(who: Optional[str], path: T_path, sidecar: T_yaml) -> list[str]:
+        errors = []
+        where = "" if who is None else f"{who}: "
+
         match_keys = frozenset(["match_dns", "match_spiffe"])
         match_len = 0
         for key in match_keys:
-            if key in yaml["listener"] and isinstance(yaml["listener"][key], list):
-                match_len += len(yaml["listener"][key])
+            if key in sidecar["listener"] and isinstance(sidecar["listener"][key], list):
+                match_len += len(sidecar["listener"][key])
 
         if match_len < 1:
             errors.append(
-                'At least one matching criterion (keys "%s") must be specified in the listener.'
-                % ('", "'.join(match_keys))
+                LocatedError(
+                    path + ("listener",),
+                    where + 'At least one matching criterion (keys "%s") must be specified in the '
+                    "listener." % ('", "'.join(match_keys)),
+                )
+            )
+
+        errors += cluster_options_errors(
+            f"{where}backend",
+            sidecar["backend"].get("host", MTLSSidecar.Backend._field_defaults["host"]),
+            sidecar["backend"].get("cluster"),
+            path + ("backend", "cluster"),
+        )
+
+        return errors
+
+    @staticmethod
+    def _port_errors(sidecars: list[tuple[str, T_path, T_yaml]]) -> list[str]:
+        """
+        Check that no two sidecars listen on the same port, that none listens on envoy's admin
+        port and that no backend is another sidecar's (or its own) listener. ``sidecars`` has
+        how to refer to each sidecar and its path in the input next to it.
+        """
+        from .config import get_config
+
+        errors = []
+        # the index of the sidecar listening on each port, names may be repeated
+        listeners: dict[int, int] = {}
+        for i, (who, path, sidecar) in enumerate(sidecars):
+            port = sidecar["listener"].get("port")
+            if not isinstance(port, int):
+                continue
+
+            if port in listeners:
+                errors.append(
+                    LocatedError(
+                        path + ("listener", "port"),
+                        f"{sidecars[listeners[port]][0]} and {who} both listen on port {port}",
+                    )
+                )
+            else:
+                listeners[port] = i
+
+        admin_port = int(get_config()["envoy"]["admin_port"])
+        if admin_port in listeners:
+            who, path, _ = sidecars[listeners[admin_port]]
+            errors.append(
+                LocatedError(
+                    path + ("listener", "port"),
+                    f"{who} listens on port {admin_port}, which is envoy's admin port",
+                )
             )
 
+        # envoy listens on every address, so a loopback backend on a listener port would make it
+        # connect to itself
+        for i, (who, path, sidecar) in enumerate(sidecars):
+            host = sidecar["backend"].get("host", MTLSSidecar.Backend._field_defaults["host"])
+            port = sidecar["backend"].get("port")
+            if not isinstance(host, str) or not isinstance(port, int):
+                continue
+            if host not in _loopback_hosts or port not in listeners:
+                continue
+
+            if listeners[port] == i:
+                message = f"{who} has its backend on its own listener port {port}"
+            else:
+                message = (
+                    f"{who} has its backend on port {port}, where {sidecars[listeners[port]][0]} "
+                    + "listens"
+                )
+            errors.append(LocatedError(path + ("backend", "port"), message))
+
         return errors
 
-    def process_yaml(self, yaml: T_yaml) -> T_static_resources:
-        if "match_spiffe" in yaml["listener"]:
-            yaml["listener"]["match_spiffe"] = [
+    @staticmethod
+    def _sidecar_struct(name: Optional[str], sidecar: T_yaml) -> MTLSSidecar:
+        if "match_spiffe" in sidecar["listener"]:
+            sidecar["listener"]["match_spiffe"] = [
                 MTLSSidecar.Listener.SPIFFEMatch(**item)
-                for item in yaml["listener"]["match_spiffe"]
+                for item in sidecar["listener"]["match_spiffe"]
             ]
         else:
-            yaml["listener"]["match_spiffe"] = []
+            sidecar["listener"]["match_spiffe"] = []
 
-        if "timeouts" in yaml["listener"]:
-            yaml["listener"]["timeouts"] = Timeouts(**yaml["listener"]["timeouts"])
+        if "timeouts" in sidecar["listener"]:
+            sidecar["listener"]["timeouts"] = Timeouts(**sidecar["listener"]["timeouts"])
 
-        if "protocol" in yaml["listener"]:
-            yaml["listener"]["protocol"] = MTLSSidecar.Listener.UpstreamProtocol(
-                yaml["listener"]["protocol"]
+        if "protocol" in sidecar["listener"]:
+            sidecar["listener"]["protocol"] = MTLSSidecar.Listener.UpstreamProtocol(
+                sidecar["listener"]["protocol"]
             )
 
-        as_struct = MTLSSidecar(
-            backend=MTLSSidecar.Backend(**yaml["backend"]),
-            listener=MTLSSidecar.Listener(**yaml["listener"]),
+        sidecar["backend"]["cluster"] = cluster_options(sidecar["backend"].get("cluster"))
+
+        return MTLSSidecar(
+            backend=MTLSSidecar.Backend(**sidecar["backend"]),
+            listener=MTLSSidecar.Listener(**sidecar["listener"]),
+            name=name,
         )
 
-        envoy_clusters = [mtls_sidecar_cluster(as_struct.backend)]
-        envoy_listeners = [mtls_sidecar_listener(as_struct.listener)]
+    def _yaml_to_internal_structs(self, yaml: T_yaml) -> list[MTLSSidecar]:
+        if "sidecars" in yaml:
+            return [self._sidecar_struct(sidecar["name"], sidecar) for sidecar in yaml["sidecars"]]
 
-        return envoy_listeners, envoy_clusters
+        return [self._sidecar_struct(None, yaml)]
+
+    def process_yaml(self, yaml: T_yaml) -> T_static_resources:
+        return self._build_resources(self._yaml_to_internal_structs(yaml))
 
+    def preload(self) -> None:
+        from .mtls_sidecar import cluster, listener  # noqa: F401
 
-def is_a_processor(member: Any) -> bool:
-    if not isinstance(member, type):
-        return False
+    def _build_resources(self, sidecars: list[MTLSSidecar]) -> T_static_resources:
+        from .mtls_sidecar.cluster import mtls_sidecar_cluster
+        from .mtls_sidecar.listener import mtls_sidecar_listeners
 
-    if member.__module__ != __name__:
-        return False
+        envoy_clusters = [
+            mtls_sidecar_cluster(sidecar.backend, sidecar.names) for sidecar in sidecars
+        ]
+        envoy_listeners = mtls_sidecar_listeners(sidecars)
 
-    if member not in AbstractProcessor.__subclasses__():
-        return False
+        return envoy_listeners, envoy_clusters
 
-    return True
 
+def all() -> Iterable[type[AbstractProcessor]]:
+    """
+    Every registered processor class. This imports all of them; see :mod:`.registry` for
+    looking them up without importing them.
+    """
+    from .registry import specs
 
-def all() -> Iterable[AbstractProcessor]:
-    for _, member in inspect.getmembers(sys.modules[__name__]):
-        if is_a_processor(member):
-            yield member
+    for spec in specs().values():
+        yield spec.load()
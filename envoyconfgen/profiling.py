@@ -0,0 +1,341 @@
+"""
+Per-stage instrumentation of a render, enabled with ``--profile``.
+
+Every stage records its wall time, CPU time and the peak RSS of the process once it finished,
+and the build stage can run under cProfile. A stage which interleaves two steps, like building
+resources while they are written, can be split into parts: the time spent producing the items
+of an iterable, and the rest. Stages are only recorded while a profiler is
+active, so the instrumented code paths cost nothing otherwise.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import resource
+import sys
+import time
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Optional,
+    TypeVar,
+)
+
+if TYPE_CHECKING:
+    import envoyproto.envoy.config.cluster.v3 as cluster
+    import envoyproto.envoy.config.listener.v3 as listener
+
+
+T = TypeVar("T")
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of the process in bytes.
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports KiB, macOS bytes
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class Profiler:
+    # the stages building resources: on their own, or together with writing them out
+    build_stages = ("build", "build+write")
+
+    def __init__(self, cprofile_path: Optional[str] = None):
+        self.stages: list[dict[str, Any]] = []
+        self.resources = dict.fromkeys(
+            ("listeners", "clusters", "filter_chains", "virtual_hosts"), 0
+        )
+        self.notes: dict[str, str] = {}
+        self.cprofile_path = cprofile_path
+        self.cprofile_stage: Optional[str] = None
+        # [wall, cpu] seconds of the parts of the current stage, see timed()
+        self.parts: dict[str, list[float]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str, rest: Optional[str] = None) -> Iterator[None]:
+        """
+        Record a stage. If parts of it were timed with :meth:`timed`, they are recorded with
+        it, along with the remaining time as a part named ``rest``.
+        """
+        profile = None
+        if self.cprofile_path is not None and name in self.build_stages:
+            self.cprofile_stage = name
+            import cProfile
+
+            profile = cProfile.Profile()
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.cprofile_path)
+
+            result = {
+                "name": name,
+                "wall_seconds": time.perf_counter() - wall,
+                "cpu_seconds": time.process_time() - cpu,
+                "peak_rss_bytes": peak_rss(),
+            }
+            if self.parts:
+                parts = [
+                    {"name": part, "wall_seconds": part_wall, "cpu_seconds": part_cpu}
+                    for part, (part_wall, part_cpu) in self.parts.items()
+                ]
+                if rest is not None:
+                    parts.append(
+                        {
+                            "name": rest,
+                            "wall_seconds": result["wall_seconds"]
+                            - sum(part["wall_seconds"] for part in parts),
+                            "cpu_seconds": result["cpu_seconds"]
+                            - sum(part["cpu_seconds"] for part in parts),
+                        }
+                    )
+                result["parts"] = parts
+                self.parts = {}
+
+            self.stages.append(result)
+
+    @contextlib.contextmanager
+    def part(self, name: str) -> Iterator[None]:
+        """
+        Add the time spent in a block to a part of the current stage.
+        """
+        totals = self.parts.setdefault(name, [0.0, 0.0])
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            totals[0] += time.perf_counter() - wall
+            totals[1] += time.process_time() - cpu
+
+    def timed(self, items: Iterable[T], part: str) -> Iterator[T]:
+        """
+        Add the time spent producing the items of an iterable to a part of the current stage.
+        """
+        iterator = iter(items)
+        while True:
+            try:
+                with self.part(part):
+                    item = next(iterator)
+            except StopIteration:
+                return
+
+            yield item
+
+    def count_listener(self, envoy_listener: listener.listener.Listener) -> None:
+        self.resources["listeners"] += 1
+        for chain in envoy_listener.filter_chains:
+            self.count_filter_chain(chain)
+        if envoy_listener.HasField("default_filter_chain"):
+            self.count_filter_chain(envoy_listener.default_filter_chain)
+
+    def count_filter_chain(self, chain: listener.listener_components.FilterChain) -> None:
+        from .serialize import unpack_any
+
+        self.resources["filter_chains"] += 1
+        for network_filter in chain.filters:
+            config = unpack_any(network_filter.typed_config)
+            if "route_config" in config.DESCRIPTOR.fields_by_name:
+                self.resources["virtual_hosts"] += len(config.route_config.virtual_hosts)
+
+    def count_cluster(self, envoy_cluster: cluster.cluster.Cluster) -> None:
+        self.resources["clusters"] += 1
+
+    def count_items(self, field: str, items: Iterable[Any]) -> None:
+        """
+        Count the items of the ``listeners`` or ``clusters`` of the static resources, or of
+        the ``filter_chains`` of a listener.
+        """
+        count = {
+            "listeners": self.count_listener,
+            "clusters": self.count_cluster,
+            "filter_chains": self.count_filter_chain,
+        }[field]
+        for item in items:
+            count(item)
+
+    def count_rendered(self, resources: dict[str, int]) -> None:
+        """
+        Add the resources counted by a worker process.
+        """
+        for key, value in resources.items():
+            self.resources[key] += value
+
+    def count_resources(
+        self,
+        listeners: Collection[listener.listener.Listener],
+        clusters: Collection[cluster.cluster.Cluster],
+    ) -> None:
+        for envoy_listener in listeners:
+            self.count_listener(envoy_listener)
+        for envoy_cluster in clusters:
+            self.count_cluster(envoy_cluster)
+
+    def results(self) -> dict[str, Any]:
+        result: dict[str, Any] = {
+            "stages": self.stages,
+            "resources": self.resources,
+            "notes": self.notes,
+        }
+        if self.cprofile_stage is not None:
+            result["cprofile"] = {"stage": self.cprofile_stage, "path": self.cprofile_path}
+
+        return result
+
+    def print_summary(self, file: IO[str]) -> None:
+        print("%-12s %10s %10s %12s" % ("stage", "wall", "cpu", "peak rss"), file=file)
+        for stage in self.stages:
+            print(
+                "%-12s %9.4fs %9.4fs %8.1f MiB"
+                % (
+                    stage["name"],
+                    stage["wall_seconds"],
+                    stage["cpu_seconds"],
+                    stage["peak_rss_bytes"] / 2**20,
+                ),
+                file=file,
+            )
+            for part in stage.get("parts", ()):
+                print(
+                    "  %-10s %9.4fs %9.4fs"
+                    % (part["name"], part["wall_seconds"], part["cpu_seconds"]),
+                    file=file,
+                )
+
+        if any(self.resources.values()):
+            print(
+                "resources: %(listeners)d listeners, %(clusters)d clusters, %(filter_chains)d"
+                " filter chains, %(virtual_hosts)d virtual hosts" % self.resources,
+                file=file,
+            )
+        for key, value in self.notes.items():
+            print("%s: %s" % (key, value), file=file)
+        if self.cprofile_stage is not None:
+            print(
+                "cProfile of the %s stage: %s" % (self.cprofile_stage, self.cprofile_path),
+                file=file,
+            )
+
+    def report(self, destination: str) -> None:
+        """
+        Print the results to stderr if ``destination`` is "-", else write them as JSON.
+        """
+        if destination == "-":
+            self.print_summary(sys.stderr)
+            return
+
+        with open(destination, "w") as fp:
+            json.dump(self.results(), fp, indent=2)
+            fp.write("\n")
+
+
+_active: Optional[Profiler] = None
+
+
+def activate(profiler: Optional[Profiler]) -> None:
+    global _active
+    _active = profiler
+
+
+def stage(name: str, rest: Optional[str] = None) -> contextlib.AbstractContextManager:
+    """
+    Record a stage in the active profiler, if any.
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+
+    return _active.stage(name, rest)
+
+
+def part(name: str) -> contextlib.AbstractContextManager:
+    """
+    Time a block as a part of the current stage in the active profiler, if any.
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+
+    return _active.part(name)
+
+
+def timed(items: Iterable[T], part: str) -> Iterable[T]:
+    """
+    Time producing the items of an iterable as a part of the current stage in the active
+    profiler, if any.
+    """
+    if _active is None:
+        return items
+
+    return _active.timed(items, part)
+
+
+def count_resources(
+    listeners: Collection[listener.listener.Listener],
+    clusters: Collection[cluster.cluster.Cluster],
+) -> None:
+    if _active is not None:
+        _active.count_resources(listeners, clusters)
+
+
+def enabled() -> bool:
+    return _active is not None
+
+
+def count_rendered(resources: dict[str, int]) -> None:
+    if _active is not None:
+        _active.count_rendered(resources)
+
+
+def note(key: str, value: str) -> None:
+    """
+    Record how a stage was carried out, e.g. which implementation it used.
+    """
+    if _active is not None:
+        _active.notes[key] = value
+
+
+def counted_listeners(
+    listeners: Iterable[listener.listener.Listener],
+) -> Iterable[listener.listener.Listener]:
+    """
+    Count listeners in the active profiler, if any, as they are produced.
+    """
+    if _active is None:
+        return listeners
+
+    return _counted(listeners, _active.count_listener)
+
+
+def counted_clusters(
+    clusters: Iterable[cluster.cluster.Cluster],
+) -> Iterable[cluster.cluster.Cluster]:
+    if _active is None:
+        return clusters
+
+    return _counted(clusters, _active.count_cluster)
+
+
+def _counted(items: Iterable[T], count: Callable[[T], None]) -> Iterator[T]:
+    from .serialize import Batch, Spliced
+
+    for item in items:
+        # batches are counted by the workers building them, see count_rendered()
+        if isinstance(item, Spliced):
+            count(item.message)
+        elif not isinstance(item, Batch):
+            count(item)
+        yield item
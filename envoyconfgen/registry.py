@@ -0,0 +1,188 @@
+"""
+The processor registry.
+
+Processors are looked up by name without importing them: a :class:`ProcessorSpec` holds a
+processor's metadata and the import path of its class, which is only imported once the
+processor is selected. Besides the built-in processors, processors are registered
+
+* in the ``[processors]`` section of the configuration file, as ``name = module:attribute``
+* by installed packages, in the ``envoyconfgen.processors`` entry point group
+
+and either may point to a :class:`ProcessorSpec` or straight to an
+:class:`~.processors.AbstractProcessor` subclass. A spec keeps the processor's module, and the
+protobuf modules it uses, from being imported just to list it.
+
+Entry points are only scanned when a name isn't found otherwise, or when listing every
+processor: importing ``importlib.metadata`` alone takes tens of milliseconds.
+"""
+
+from __future__ import annotations
+
+import functools
+import importlib
+import logging
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from .structs import mtls_sidecar_schema, zkfp_schema
+
+if TYPE_CHECKING:
+    from .processors import AbstractProcessor
+
+ENTRY_POINT_GROUP = "envoyconfgen.processors"
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownProcessorError(LookupError):
+    pass
+
+
+class ProcessorSpec(NamedTuple):
+    name: str
+    # "module:attribute" of the processor class
+    target: str
+    description: str = ""
+    # the top-level keys of an input and the types of their values, as returned by the
+    # processor's schema()
+    schema: tuple[tuple[str, Any], ...] = ()
+
+    def load(self) -> type[AbstractProcessor]:
+        """
+        Import the processor class.
+        """
+        from .processors import AbstractProcessor
+
+        result = _import(self.target)
+        if not (isinstance(result, type) and issubclass(result, AbstractProcessor)):
+            raise TypeError(f'processor "{self.name}": {self.target} is not a processor class')
+
+        return result
+
+
+builtin: dict[str, ProcessorSpec] = {
+    spec.name: spec
+    for spec in (
+        ProcessorSpec(
+            name="mtls_sidecar",
+            target="envoyconfgen.processors:mtls_sidecar",
+            description="mTLS-enforcing sidecar in front of one or more local services",
+            schema=tuple(mtls_sidecar_schema),
+        ),
+        ProcessorSpec(
+            name="zkfp",
+            target="envoyconfgen.processors:zkfp",
+            description="Zero-knowledge frontend proxy routing TLS and HTTP by host name",
+            schema=tuple(zkfp_schema),
+        ),
+    )
+}
+
+# used when no processor is given on the command line
+default = "mtls_sidecar"
+
+
+def _import(target: str) -> Any:
+    module, _, attribute = target.partition(":")
+    return functools.reduce(getattr, attribute.split("."), importlib.import_module(module))
+
+
+def _as_spec(name: str, registered: Any) -> ProcessorSpec:
+    if isinstance(registered, ProcessorSpec):
+        return registered._replace(name=name)
+
+    # a processor class: its metadata is all that can be had without more conventions
+    description = (registered.__doc__ or "").strip().split("\n", 1)[0]
+    return ProcessorSpec(
+        name=name,
+        target=f"{registered.__module__}:{registered.__qualname__}",
+        description=description,
+    )
+
+
+def _configured() -> dict[str, str]:
+    from .config import get_config
+
+    config = get_config()
+    if not config.has_section("processors"):
+        return {}
+
+    return dict(config.items("processors"))
+
+
+@functools.cache
+def _entry_points() -> dict[str, Any]:
+    import importlib.metadata
+
+    return {
+        entry_point.name: entry_point
+        for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP)
+    }
+
+
+def get(name: str) -> ProcessorSpec:
+    """
+    The spec of the processor registered as ``name``. Built-in processors take precedence over
+    configured ones, which take precedence over entry points.
+    """
+    if name in builtin:
+        return builtin[name]
+
+    configured = _configured()
+    if name in configured:
+        return _as_spec(name, _import(configured[name]))
+
+    entry_points = _entry_points()
+    if name in entry_points:
+        return _as_spec(name, entry_points[name].load())
+
+    raise UnknownProcessorError(f'unknown processor "{name}", choose from: {", ".join(specs())}')
+
+
+def load(name: str) -> type[AbstractProcessor]:
+    """
+    The class of the processor registered as ``name``.
+    """
+    return get(name).load()
+
+
+@functools.cache
+def provider_version(name: str) -> str:
+    """
+    The distributions, with their versions, that the processor registered as ``name`` comes
+    from, or an empty string for the built-in processors.
+    """
+    if name in builtin:
+        return ""
+
+    import importlib.metadata
+
+    entry_point = None if name in _configured() else _entry_points().get(name)
+    dist = getattr(entry_point, "dist", None)
+    if dist is not None:
+        return f"{dist.name}=={dist.version}"
+
+    top_level = get(name).target.partition(":")[0].split(".")[0]
+    return ",".join(
+        f"{dist_name}=={importlib.metadata.version(dist_name)}"
+        for dist_name in sorted(importlib.metadata.packages_distributions().get(top_level, []))
+    )
+
+
+def specs() -> dict[str, ProcessorSpec]:
+    """
+    Every registered processor, by name. This loads every spec, but no processor class
+    registered through a spec.
+    """
+    result = dict(builtin)
+    for registered in (_configured(), _entry_points()):
+        for name in sorted(registered):
+            if name in result:
+                logger.warning('processor "%s" is already registered, ignoring another one', name)
+                continue
+
+            try:
+                result[name] = get(name)
+            except Exception as e:
+                logger.warning('could not load processor "%s": %s', name, e)
+
+    return result
@@ -0,0 +1,112 @@
+"""
+Client of the render server (see :mod:`.render_server`), and the protocol between them.
+
+Every message, in both directions, is a JSON header followed by a body, each preceded by its
+length as a 32-bit big endian integer:
+
+* requests: ``{"processor": "zkfp", "format": "yaml", "name": "input.yml"}`` and the input
+* responses: ``{"status": "ok"}`` and the output, or ``{"status": "invalid"}`` (the input did
+  not validate) or ``{"status": "error"}`` with a ``message`` and an empty body
+
+A connection can carry any number of requests, one at a time. This module only uses the
+standard library, so that the client starts quickly.
+"""
+
+from __future__ import annotations
+
+import json
+import socket
+import struct
+import sys
+from typing import Any, Optional
+
+from .fileio import atomic_open
+
+_lengths = struct.Struct("!II")
+
+# headers are small; anything larger is not a client speaking this protocol
+MAX_HEADER_SIZE = 1 << 16
+MAX_BODY_SIZE = 1 << 30
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def send_message(sock: socket.socket, header: dict[str, Any], body: bytes = b"") -> None:
+    encoded = json.dumps(header).encode("utf-8")
+    sock.sendall(_lengths.pack(len(encoded), len(body)) + encoded)
+    sock.sendall(body)
+
+
+def _receive(sock: socket.socket, size: int) -> bytes:
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ProtocolError("connection closed in the middle of a message")
+        received += count
+
+    return bytes(buffer)
+
+
+def receive_message(sock: socket.socket) -> Optional[tuple[dict[str, Any], bytes]]:
+    """
+    The next message on a connection, or None if it was closed before one started.
+    """
+    first = sock.recv(_lengths.size)
+    if len(first) == 0:
+        return None
+
+    header_size, body_size = _lengths.unpack(first + _receive(sock, _lengths.size - len(first)))
+    if header_size > MAX_HEADER_SIZE or body_size > MAX_BODY_SIZE:
+        raise ProtocolError("message too large")
+
+    header = json.loads(_receive(sock, header_size))
+    if not isinstance(header, dict):
+        raise ProtocolError("the message header must be a JSON object")
+
+    return header, _receive(sock, body_size)
+
+
+def do_client(args) -> None:
+    """
+    Render an input with a render server, writing the output like a local render would.
+    """
+    try:
+        with open(args.path, "rb") as fp:
+            raw_contents = fp.read()
+    except OSError as e:
+        print(f'Could not read YAML file "{args.path}": {e}', file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(args.socket)
+            send_message(
+                sock,
+                {"processor": args.processor, "format": args.format, "name": args.path},
+                raw_contents,
+            )
+            message = receive_message(sock)
+    except (OSError, ValueError) as e:
+        print(f"Render server at {args.socket} failed: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if message is None:
+        print(f"Render server at {args.socket} closed the connection", file=sys.stderr)
+        sys.exit(2)
+
+    header, body = message
+    if header.get("status") != "ok":
+        print(header.get("message", "the render failed").rstrip(), file=sys.stderr)
+        sys.exit(1)
+
+    if args.output is not None:
+        with atomic_open(args.output) as fp:
+            fp.write(body)
+    else:
+        sys.stdout.buffer.write(body)
+        sys.stdout.buffer.flush()
@@ -0,0 +1,171 @@
+"""
+Render server: renders inputs sent over a Unix socket by a process which keeps the processors,
+the protobuf modules and the configuration loaded, for tools which would otherwise start
+envoy-confgen for every input.
+
+The server forks its workers once everything is loaded; each of them accepts connections on
+the shared socket, so requests are rendered in parallel. See :mod:`.render_client` for the
+protocol.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import signal
+import socket
+import stat
+import sys
+import traceback
+from typing import Any
+
+from . import registry
+from .convert import InvalidInputError, render
+from .fileio import output_formats
+from .render_client import receive_message, send_message
+
+logger = logging.getLogger(__name__)
+
+# connections idle for longer than this are closed, so that they don't hold on to a worker
+IDLE_TIMEOUT = 60.0
+
+
+def render_request(header: dict[str, Any], body: bytes) -> tuple[dict[str, Any], bytes]:
+    """
+    The response to a render request.
+    """
+    name = str(header.get("name", "<input>"))
+    output_format = header.get("format", "yaml")
+    if output_format not in output_formats:
+        return {"status": "error", "message": f"unknown output format {output_format!r}"}, b""
+
+    try:
+        processor = registry.load(str(header.get("processor", registry.default)))
+        stream = io.BytesIO()
+        render(processor(), name, stream, output_format, raw_contents=body)
+    except InvalidInputError as e:
+        return {"status": "invalid", "message": str(e)}, b""
+    except registry.UnknownProcessorError as e:
+        return {"status": "error", "message": str(e)}, b""
+    except Exception:
+        logger.exception("Failed to render %s", name)
+        return {"status": "error", "message": traceback.format_exc()}, b""
+
+    return {"status": "ok"}, stream.getvalue()
+
+
+def handle_connection(conn: socket.socket) -> None:
+    with conn:
+        conn.settimeout(IDLE_TIMEOUT)
+        while True:
+            message = receive_message(conn)
+            if message is None:
+                return
+
+            send_message(conn, *render_request(*message))
+
+
+def _accept_loop(listener: socket.socket) -> None:
+    while True:
+        conn, _ = listener.accept()
+        try:
+            handle_connection(conn)
+        except (OSError, ValueError) as e:
+            logger.warning("Dropped a connection: %s", e)
+
+
+def preload() -> None:
+    """
+    Load the configuration and everything rendering imports, so that the workers share it
+    and no request pays for it.
+    """
+    from . import bootstrap, serialize  # noqa: F401
+    from .config import get_singleton
+
+    get_singleton()
+    for name, spec in registry.specs().items():
+        try:
+            spec.load()().preload()
+        except Exception:
+            logger.exception('Could not load processor "%s"', name)
+
+
+def bind(path: str) -> socket.socket:
+    """
+    Listen on a Unix socket, replacing a stale socket file left by a server which is gone.
+    """
+    if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+        else:
+            raise OSError(f"a server is already listening on {path}")
+        finally:
+            probe.close()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    return listener
+
+
+def _fork_worker(listener: socket.socket) -> int:
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # the workers are stopped by the server, and exit without running its cleanup
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        _accept_loop(listener)
+    except Exception:
+        logger.exception("Worker %d failed", os.getpid())
+    finally:
+        os._exit(1)
+
+
+def serve(listener: socket.socket, workers: int) -> None:
+    """
+    Render requests with ``workers`` forked processes until interrupted, replacing workers
+    which die.
+    """
+    if workers <= 1:
+        _accept_loop(listener)
+        return
+
+    pids = {_fork_worker(listener) for _ in range(workers)}
+    try:
+        while True:
+            pid, status = os.wait()
+            pids.discard(pid)
+            logger.warning("Worker %d exited with status %d, restarting it", pid, status)
+            pids.add(_fork_worker(listener))
+    finally:
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+
+def do_server(args) -> None:
+    preload()
+    try:
+        listener = bind(args.socket)
+    except OSError as e:
+        print(f"Could not listen on {args.socket}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    # SIGTERM stops the server like ^C, cleaning up the workers and the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    logger.info("Rendering on %s with %d workers", args.socket, args.workers)
+    try:
+        serve(listener, args.workers)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.unlink(args.socket)
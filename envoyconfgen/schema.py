@@ -0,0 +1,179 @@
+"""
+Schema validation of processor inputs.
+
+The schema is derived from the NamedTuples of :mod:`.structs` the inputs are converted to:
+every key of a mapping must be one of the struct's fields, fields without a default are
+required, and values must match the fields' annotations. Problems are reported with the path
+of the offending value, so that a mistake is found before anything is built. Nothing here
+imports protobuf modules.
+"""
+
+from __future__ import annotations
+
+import enum
+import functools
+import typing
+from typing import Any, Iterator, NamedTuple, Union
+
+from .structs import (
+    ClusterOptions,
+    ProxyProtocolVersion,
+    SNIProxyListener,
+    cluster_types,
+    dns_lookup_families,
+    proxy_protocol_str_to_enum,
+)
+
+T_path = tuple[Union[str, int], ...]
+
+# fields which only accept some of the values of their type
+_choices: dict[tuple[type, str], tuple[str, ...]] = {
+    (ClusterOptions, "type"): cluster_types,
+    (ClusterOptions, "dns_lookup_family"): dns_lookup_families,
+    (SNIProxyListener, "protocol"): ("http", "https"),
+}
+
+# enums which inputs spell differently from their values
+_enum_inputs: dict[type, tuple[str, ...]] = {
+    ProxyProtocolVersion: tuple(proxy_protocol_str_to_enum),
+}
+
+_descriptions = {
+    bool: "true or false",
+    int: "an integer",
+    float: "a number",
+    str: "a string",
+    list: "a list",
+    dict: "a mapping",
+    type(None): "null",
+}
+
+
+class Problem(NamedTuple):
+    path: T_path
+    message: str
+
+
+class LocatedError(str):
+    """
+    A problem found by a processor's own validation which also knows the path of the value
+    it is about, so that check mode can report its line. It is a plain message otherwise.
+    """
+
+    path: T_path
+
+    def __new__(cls, path: T_path, message: str) -> LocatedError:
+        self = super().__new__(cls, message)
+        self.path = path
+        return self
+
+    def __getnewargs__(self) -> tuple[T_path, str]:
+        return self.path, str(self)
+
+
+def format_path(path: T_path) -> str:
+    """
+    ``backends[3].cluster.type`` for ``("backends", 3, "cluster", "type")``, and an empty
+    string for the top level.
+    """
+    result = ""
+    for key in path:
+        result += f"[{key}]" if isinstance(key, int) else (f".{key}" if result else str(key))
+
+    return result
+
+
+def _is_struct(expected: Any) -> bool:
+    return (
+        isinstance(expected, type) and issubclass(expected, tuple) and hasattr(expected, "_fields")
+    )
+
+
+@functools.cache
+def _fields(struct: type) -> dict[str, Any]:
+    return typing.get_type_hints(struct)
+
+
+def _describe(value: Any) -> str:
+    return _descriptions.get(type(value), type(value).__name__)
+
+
+def _check(expected: Any, value: Any, path: T_path, field: str = "") -> Iterator[Problem]:
+    origin = typing.get_origin(expected)
+
+    if origin is Union:
+        options = typing.get_args(expected)
+        if value is None and type(None) in options:
+            return
+        # structs only use Optional[...]
+        (expected,) = [option for option in options if option is not type(None)]
+        yield from _check(expected, value, path, field)
+    elif origin is list:
+        if not isinstance(value, list):
+            yield Problem(path, f"must be a list, not {_describe(value)}")
+            return
+        (item_type,) = typing.get_args(expected)
+        for i, item in enumerate(value):
+            yield from _check(item_type, item, path + (i,))
+    elif _is_struct(expected):
+        yield from _check_struct(expected, value, path)
+    elif isinstance(expected, type) and issubclass(expected, enum.Enum):
+        accepted = _enum_inputs.get(expected) or tuple(member.value for member in expected)
+        if value not in accepted or isinstance(value, bool):
+            yield Problem(path, "must be one of %s" % ", ".join(map(str, accepted)))
+    elif expected is bool:
+        if not isinstance(value, bool):
+            yield Problem(path, f"must be true or false, not {_describe(value)}")
+    elif expected is int or expected is float:
+        if isinstance(value, bool) or not isinstance(
+            value, (int, float) if expected is float else int
+        ):
+            yield Problem(path, f"must be {_descriptions[expected]}, not {_describe(value)}")
+        elif field.endswith("port") and not 1 <= value <= 65535:
+            yield Problem(path, "must be a port number between 1 and 65535")
+    elif expected is str:
+        if not isinstance(value, str):
+            yield Problem(path, f"must be a string, not {_describe(value)}")
+
+
+def _check_struct(struct: type, value: Any, path: T_path) -> Iterator[Problem]:
+    if not isinstance(value, dict):
+        yield Problem(path, f"must be a mapping, not {_describe(value)}")
+        return
+
+    fields = _fields(struct)
+    for key in value:
+        if key not in fields:
+            yield Problem(path + (key,), f'unknown key "{key}"')
+
+    for field, expected in fields.items():
+        if field not in value:
+            if field not in struct._field_defaults:
+                yield Problem(path, f'missing key "{field}"')
+            continue
+
+        choices = _choices.get((struct, field))
+        if choices is not None and value[field] is not None:
+            if value[field] not in choices:
+                yield Problem(path + (field,), "must be one of %s" % ", ".join(choices))
+            continue
+
+        yield from _check(expected, value[field], path + (field,), field)
+
+
+def problems(schema: list[tuple[str, Any]], contents: Any) -> list[Problem]:
+    """
+    Check a processor's input against its schema, a list of required top-level keys and the
+    types of their values. Other top-level keys are ignored.
+    """
+    if not isinstance(contents, dict):
+        return [Problem((), "YAML must be a dictionary at the top level")]
+
+    result = []
+    for key, expected in schema:
+        if key not in contents:
+            result.append(Problem((), f'missing key "{key}"'))
+        else:
+            result.extend(_check(expected, contents[key], (key,), key))
+
+    return result
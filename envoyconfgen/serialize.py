@@ -0,0 +1,1031 @@
+"""
+Serialization of generated envoy configuration.
+
+The protobuf message tree is walked directly instead of round-tripping through
+:func:`google.protobuf.json_format.MessageToJson`, ``json.loads`` and ``yaml.dump``. The
+walk follows the same conventions as ``MessageToJson`` (proto field names, sorted keys,
+64-bit integers as strings, well-known types in their JSON form, packed ``Any`` messages
+expanded inline), so the output is identical to what that round trip produces.
+"""
+
+from __future__ import annotations
+
+import base64
+import concurrent.futures
+import functools
+import io
+import itertools
+import json
+import math
+import secrets
+from operator import itemgetter
+from typing import IO, Any, Callable, Iterable, Iterator, NamedTuple, Optional, Union
+
+import yaml
+
+import google.protobuf.any_pb2
+import google.protobuf.json_format
+import google.protobuf.message
+from google.protobuf import descriptor, symbol_database
+from google.protobuf.internal import type_checkers
+
+from . import profiling, yamlio
+
+TYPE_URL_PREFIX = "type.googleapis.com/"
+
+# envoyproto-python places envoy's protobuf packages in this namespace, which envoy itself
+# knows nothing about. it has to be stripped from the type URL of every packed Any.
+PROTO_NAMESPACE = "envoyproto."
+
+_ANY_FULL_NAME = "google.protobuf.Any"
+
+_WIRETYPE_LENGTH_DELIMITED = 2
+
+_YAML_MAP_TAG = "tag:yaml.org,2002:map"
+_YAML_SEQ_TAG = "tag:yaml.org,2002:seq"
+
+# well-known types that have a special JSON representation, see
+# google.protobuf.json_format._WKTJSONMETHODS
+_WELL_KNOWN_TYPES = frozenset(
+    [
+        "google.protobuf.Duration",
+        "google.protobuf.FieldMask",
+        "google.protobuf.ListValue",
+        "google.protobuf.Struct",
+        "google.protobuf.Timestamp",
+        "google.protobuf.Value",
+    ]
+)
+
+_INT64_TYPES = frozenset(
+    [
+        descriptor.FieldDescriptor.CPPTYPE_INT64,
+        descriptor.FieldDescriptor.CPPTYPE_UINT64,
+    ]
+)
+
+_FLOAT_TYPES = frozenset(
+    [
+        descriptor.FieldDescriptor.CPPTYPE_FLOAT,
+        descriptor.FieldDescriptor.CPPTYPE_DOUBLE,
+    ]
+)
+
+_to_shortest_float: Callable[[float], float] = getattr(type_checkers, "ToShortestFloat", float)
+
+
+def denamespace_type_url(type_url: str) -> str:
+    """
+    Strip the envoyproto namespace from an ``Any`` type URL.
+    """
+    prefix = TYPE_URL_PREFIX + PROTO_NAMESPACE
+    if type_url.startswith(prefix):
+        return TYPE_URL_PREFIX + type_url[len(prefix) :]
+
+    return type_url
+
+
+@functools.cache
+def _message_class_for_type_url(type_url: str) -> type[google.protobuf.message.Message]:
+    type_name = type_url.split("/")[-1]
+    pool = symbol_database.Default().pool
+    try:
+        message_descriptor = pool.FindMessageTypeByName(type_name)
+    except KeyError:
+        # the type URL has already been de-namespaced
+        message_descriptor = pool.FindMessageTypeByName(PROTO_NAMESPACE + type_name)
+
+    try:
+        from google.protobuf.message_factory import GetMessageClass
+    except ImportError:
+        return symbol_database.Default().GetPrototype(message_descriptor)
+
+    return GetMessageClass(message_descriptor)
+
+
+def unpack_any(message: google.protobuf.message.Message) -> google.protobuf.message.Message:
+    """
+    Unpack a ``google.protobuf.Any`` into an instance of the message type it contains.
+    """
+    inner = _message_class_for_type_url(message.type_url)()
+    inner.ParseFromString(message.value)
+    return inner
+
+
+def _is_map_entry(field: descriptor.FieldDescriptor) -> bool:
+    return (
+        field.type == descriptor.FieldDescriptor.TYPE_MESSAGE
+        and field.message_type.has_options
+        and field.message_type.GetOptions().map_entry
+    )
+
+
+def _is_repeated(field: descriptor.FieldDescriptor) -> bool:
+    # FieldDescriptor.label was replaced by is_repeated in newer protobuf releases
+    try:
+        return field.is_repeated
+    except AttributeError:
+        return field.label == descriptor.FieldDescriptor.LABEL_REPEATED
+
+
+def _is_wrapper(message_descriptor: descriptor.Descriptor) -> bool:
+    return message_descriptor.file.name == "google/protobuf/wrappers.proto"
+
+
+def _field_key(field: descriptor.FieldDescriptor) -> str:
+    if field.is_extension:
+        return "[%s]" % (field.full_name)
+
+    return field.name
+
+
+def _scalar_value(field: descriptor.FieldDescriptor, value: Any) -> Any:
+    if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_MESSAGE:
+        full_name = value.DESCRIPTOR.full_name
+        if full_name in _WELL_KNOWN_TYPES or _is_wrapper(value.DESCRIPTOR):
+            return google.protobuf.json_format.MessageToDict(
+                value, preserving_proto_field_name=True
+            )
+        # regular messages (and Any) are expanded lazily by the writers
+        return value
+
+    if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_ENUM:
+        if field.enum_type.full_name == "google.protobuf.NullValue":
+            return None
+        enum_value = field.enum_type.values_by_number.get(value, None)
+        return enum_value.name if enum_value is not None else value
+
+    if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_STRING:
+        if field.type == descriptor.FieldDescriptor.TYPE_BYTES:
+            return base64.b64encode(value).decode("utf-8")
+        return value
+
+    if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_BOOL:
+        return bool(value)
+
+    if field.cpp_type in _INT64_TYPES:
+        return str(value)
+
+    if field.cpp_type in _FLOAT_TYPES:
+        if math.isinf(value):
+            return "-Infinity" if value < 0 else "Infinity"
+        if math.isnan(value):
+            return "NaN"
+        if field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_FLOAT:
+            return _to_shortest_float(value)
+
+    return value
+
+
+def _field_value(field: descriptor.FieldDescriptor, value: Any) -> Any:
+    if _is_map_entry(field):
+        value_field = field.message_type.fields_by_name["value"]
+        return {
+            ("true" if k else "false") if isinstance(k, bool) else str(k): _scalar_value(
+                value_field, value[k]
+            )
+            for k in value
+        }
+
+    if _is_repeated(field):
+        return [_scalar_value(field, v) for v in value]
+
+    return _scalar_value(field, value)
+
+
+def _any_items(message: google.protobuf.message.Message) -> list[tuple[str, Any]]:
+    if not message.ListFields():
+        return []
+
+    inner = unpack_any(message)
+    type_item = ("@type", denamespace_type_url(message.type_url))
+    full_name = inner.DESCRIPTOR.full_name
+    if _is_wrapper(inner.DESCRIPTOR) or full_name in _WELL_KNOWN_TYPES:
+        return [
+            type_item,
+            (
+                "value",
+                google.protobuf.json_format.MessageToDict(inner, preserving_proto_field_name=True),
+            ),
+        ]
+    elif full_name == _ANY_FULL_NAME:
+        return [type_item, ("value", inner)]
+
+    items = message_items(inner)
+    items.append(type_item)
+    items.sort(key=itemgetter(0))
+    return items
+
+
+def message_items(message: google.protobuf.message.Message) -> list[tuple[str, Any]]:
+    """
+    Returns the JSON-visible ``(key, value)`` pairs of a message, sorted by key.
+
+    Scalars are converted to their JSON-compatible python value; sub-messages are returned
+    as-is so that callers can expand them on demand without building a copy of the tree.
+    """
+    if message.DESCRIPTOR.full_name == _ANY_FULL_NAME:
+        return _any_items(message)
+
+    items = [
+        (_field_key(field), _field_value(field, value)) for field, value in message.ListFields()
+    ]
+    items.sort(key=itemgetter(0))
+    return items
+
+
+def to_plain(value: Any) -> Any:
+    """
+    Expands a message, or a value returned by :func:`message_items`, into the plain dicts,
+    lists and scalars of its JSON form.
+    """
+    if isinstance(value, google.protobuf.message.Message):
+        return {key: to_plain(item) for key, item in message_items(value)}
+    elif isinstance(value, dict):
+        return {key: to_plain(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [to_plain(item) for item in value]
+
+    return value
+
+
+class _Stream:
+    """
+    A repeated field whose items are produced by an iterator as it is written. Written like
+    a list, or left out like an empty repeated field if the iterator produces nothing.
+    """
+
+    __slots__ = ("iterator", "first")
+
+    _PENDING = object()
+    _END = object()
+
+    def __init__(self, items: Iterable[Any]):
+        self.iterator = iter(items)
+        self.first: Any = self._PENDING
+
+    def empty(self) -> bool:
+        # the first item is only produced once the field is about to be written
+        if self.first is self._PENDING:
+            self.first = next(self.iterator, self._END)
+        return self.first is self._END
+
+    def __iter__(self) -> Iterator[Any]:
+        if self.empty():
+            return iter(())
+        return itertools.chain((self.first,), self.iterator)
+
+
+def _split_streams(
+    streams: dict[str, Iterable[Any]],
+) -> dict[str, dict[str, _Stream]]:
+    result: dict[str, dict[str, _Stream]] = {}
+    for path, items in streams.items():
+        field, sub_field = path.split(".")
+        result.setdefault(field, {})[sub_field] = _Stream(items)
+    return result
+
+
+def _streamed_items(
+    message: google.protobuf.message.Message, streams: dict[str, Iterable[Any]]
+) -> dict[str, Any]:
+    """
+    The JSON-visible items of a message, with the repeated fields named in ``streams`` (as
+    ``field.sub_field``) taken from their iterables.
+    """
+    items: dict[str, Any] = dict(message_items(message))
+    for field, sub_streams in _split_streams(streams).items():
+        sub_message = items.get(field)
+        sub_items = dict(message_items(sub_message)) if sub_message is not None else {}
+        sub_items.update(sub_streams)
+        items[field] = sub_items
+
+    return items
+
+
+class Batch(NamedTuple):
+    """
+    A run of consecutive items of a streamed repeated field, built by ``build(*args)`` in a
+    worker process (see :func:`write_streamed`). ``build`` has to be a module-level function
+    returning at least one item.
+    """
+
+    build: Callable[..., list[google.protobuf.message.Message]]
+    args: tuple[Any, ...]
+
+
+class Spliced(NamedTuple):
+    """
+    An item of a streamed repeated field whose repeated field ``field`` is made of the
+    :class:`Batch` ``items`` instead of being set in ``message``.
+    """
+
+    message: google.protobuf.message.Message
+    field: str
+    items: list[Any]
+
+
+class Rendered(NamedTuple):
+    """
+    The items of a :class:`Batch`, serialized by a worker exactly like the writers would have
+    serialized them at their place in the output. ``resources`` counts them for the profiler.
+    """
+
+    data: bytes
+    resources: dict[str, int]
+
+
+def _spliced_items(spliced: Spliced) -> list[tuple[str, Any]]:
+    items = message_items(spliced.message)
+    if spliced.items:
+        items.append((spliced.field, spliced.items))
+        items.sort(key=itemgetter(0))
+    return items
+
+
+class _Splicer:
+    """
+    A binary stream which replaces the placeholders of :class:`Rendered` items in what is
+    written to it with their data. YAML emitters only take events, so rendered YAML is
+    spliced into their output instead.
+    """
+
+    placeholder_digits = 8
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+        # random, so that it can't be mistaken for anything in a config
+        self.token = "envoyconfgen-rendered-%s-" % secrets.token_hex(8)
+        self.encoded_token = self.token.encode("ascii")
+        self.rendered: list[Optional[bytes]] = []
+        self.pending = b""
+
+    def placeholder(self, data: bytes) -> str:
+        self.rendered.append(data)
+        return "%s%0*d" % (self.token, self.placeholder_digits, len(self.rendered) - 1)
+
+    def write(self, data: bytes) -> None:
+        pending = self.pending + data
+        start = pending.find(self.encoded_token)
+        while start >= 0:
+            end = start + len(self.encoded_token) + self.placeholder_digits
+            if end > len(pending):
+                break
+
+            index = int(pending[start + len(self.encoded_token) : end])
+            self.stream.write(pending[:start])
+            self.stream.write(self.rendered[index])
+            self.rendered[index] = None
+            pending = pending[end:]
+            start = pending.find(self.encoded_token)
+
+        # a placeholder can be split across writes
+        if start < 0:
+            start = max(0, len(pending) - len(self.encoded_token) + 1)
+        self.stream.write(pending[:start])
+        self.pending = pending[start:]
+
+    def finish(self) -> None:
+        self.stream.write(self.pending)
+        self.pending = b""
+
+
+class _YAMLWriter:
+    """
+    Emits the YAML events ``yaml.dump`` would produce for the JSON form of a message.
+    """
+
+    def __init__(self, dumper: yaml.Dumper, splicer: Optional[_Splicer] = None):
+        self.dumper = dumper
+        self.splicer = splicer
+        # mapping keys are drawn from a small set of field names, so their events are
+        # worth memoizing
+        self.key_events: dict[str, yaml.ScalarEvent] = {}
+
+    def scalar_event(self, value: Any) -> yaml.ScalarEvent:
+        node = self.dumper.represent_data(value)
+        detected_tag = self.dumper.resolve(yaml.ScalarNode, node.value, (True, False))
+        default_tag = self.dumper.resolve(yaml.ScalarNode, node.value, (False, True))
+        return yaml.ScalarEvent(
+            None,
+            node.tag,
+            (node.tag == detected_tag, node.tag == default_tag),
+            node.value,
+            style=node.style,
+        )
+
+    def key_event(self, key: str) -> yaml.ScalarEvent:
+        try:
+            return self.key_events[key]
+        except KeyError:
+            event = self.key_events[key] = self.scalar_event(key)
+            return event
+
+    def write_mapping(self, items: list[tuple[str, Any]]) -> None:
+        self.dumper.emit(yaml.MappingStartEvent(None, _YAML_MAP_TAG, True, flow_style=False))
+        for key, value in items:
+            if isinstance(value, _Stream) and value.empty():
+                continue
+            self.dumper.emit(self.key_event(key))
+            self.write(value)
+        self.dumper.emit(yaml.MappingEndEvent())
+
+    def write(self, value: Any) -> None:
+        if isinstance(value, google.protobuf.message.Message):
+            self.write_mapping(message_items(value))
+        elif isinstance(value, dict):
+            self.write_mapping(sorted(value.items(), key=itemgetter(0)))
+        elif isinstance(value, (list, _Stream)):
+            self.dumper.emit(yaml.SequenceStartEvent(None, _YAML_SEQ_TAG, True, flow_style=False))
+            for item in value:
+                self.write(item)
+            self.dumper.emit(yaml.SequenceEndEvent())
+        elif isinstance(value, Rendered):
+            assert self.splicer is not None
+            self.dumper.emit(self.scalar_event(self.splicer.placeholder(value.data)))
+        elif isinstance(value, Spliced):
+            self.write_mapping(_spliced_items(value))
+        else:
+            self.dumper.emit(self.scalar_event(value))
+
+
+def _printable(value: str) -> bool:
+    return value.isascii() and value.isprintable()
+
+
+def printable_values(value: Any) -> bool:
+    """
+    Whether every string in plain data (e.g. a parsed input) is printable ASCII.
+    """
+    if isinstance(value, str):
+        return _printable(value)
+    elif isinstance(value, dict):
+        return all(map(printable_values, value.keys())) and all(
+            map(printable_values, value.values())
+        )
+    elif isinstance(value, (list, tuple)):
+        return all(map(printable_values, value))
+
+    return True
+
+
+def _printable_strings_only(message: google.protobuf.message.Message) -> bool:
+    """
+    Whether every string in a message, including the ones in packed ``Any`` messages, is
+    printable ASCII.
+    """
+    if message.DESCRIPTOR.full_name == _ANY_FULL_NAME:
+        return not message.ListFields() or _printable_strings_only(unpack_any(message))
+
+    for field, value in message.ListFields():
+        if field.type == descriptor.FieldDescriptor.TYPE_STRING:
+            if not all(map(_printable, value if _is_repeated(field) else (value,))):
+                return False
+        elif _is_map_entry(field):
+            key_field, value_field = field.message_type.fields
+            if key_field.type == descriptor.FieldDescriptor.TYPE_STRING and not all(
+                map(_printable, value.keys())
+            ):
+                return False
+            if value_field.type == descriptor.FieldDescriptor.TYPE_STRING and not all(
+                map(_printable, value.values())
+            ):
+                return False
+            if value_field.type == descriptor.FieldDescriptor.TYPE_MESSAGE and not all(
+                map(_printable_strings_only, value.values())
+            ):
+                return False
+        elif field.type == descriptor.FieldDescriptor.TYPE_MESSAGE:
+            if not all(map(_printable_strings_only, value if _is_repeated(field) else (value,))):
+                return False
+
+    return True
+
+
+def yaml_dumper_class(message: google.protobuf.message.Message) -> type[yaml.Dumper]:
+    """
+    The fastest dumper writing a message the way ``yaml.dump`` does. libyaml folds long
+    double-quoted scalars containing escape sequences at other places than PyYAML, and
+    emits everything else identically, so it is only used for messages without them.
+    """
+    if yamlio.Dumper is yaml.Dumper or not _printable_strings_only(message):
+        return yaml.Dumper
+
+    return yamlio.Dumper
+
+
+def write_yaml(
+    message: google.protobuf.message.Message,
+    stream: IO[bytes],
+    dumper_class: Optional[type[yaml.Dumper]] = None,
+    splicer: Optional[_Splicer] = None,
+) -> None:
+    """
+    Write a message to a binary stream as UTF-8 YAML, with libyaml's emitter where possible.
+    """
+    if dumper_class is None:
+        dumper_class = yaml_dumper_class(message)
+        profiling.note("yaml_emitter", "libyaml" if dumper_class is yaml.CDumper else "python")
+
+    dumper = dumper_class(stream, encoding="utf-8")
+    try:
+        dumper.open()
+        dumper.emit(yaml.DocumentStartEvent())
+        _YAMLWriter(dumper, splicer).write(message)
+        dumper.emit(yaml.DocumentEndEvent())
+        dumper.close()
+    finally:
+        dumper.dispose()
+
+
+class _JSONWriter:
+    """
+    Writes the JSON form of a message formatted the way ``MessageToJson`` formats it (two
+    space indent, sorted keys, non-ASCII characters escaped).
+    """
+
+    # number of pieces that are accumulated before they are encoded and written out
+    chunk_pieces = 4096
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+        self.pieces: list[str] = []
+
+    def emit(self, piece: str) -> None:
+        self.pieces.append(piece)
+        if len(self.pieces) >= self.chunk_pieces:
+            self.flush()
+
+    def flush(self) -> None:
+        self.stream.write("".join(self.pieces).encode("utf-8"))
+        self.pieces = []
+
+    def write_mapping(self, items: list[tuple[str, Any]], level: int) -> None:
+        separator = "{\n" + "  " * (level + 1)
+        written = False
+        for key, value in items:
+            if isinstance(value, _Stream) and value.empty():
+                continue
+            self.emit(separator)
+            self.emit(json.dumps(key))
+            self.emit(": ")
+            self.write(value, level + 1)
+            separator = ",\n" + "  " * (level + 1)
+            written = True
+
+        if not written:
+            self.emit("{}")
+            return
+        self.emit("\n" + "  " * level + "}")
+
+    def write(self, value: Any, level: int = 0) -> None:
+        if isinstance(value, google.protobuf.message.Message):
+            self.write_mapping(message_items(value), level)
+        elif isinstance(value, dict):
+            self.write_mapping(sorted(value.items(), key=itemgetter(0)), level)
+        elif isinstance(value, (list, _Stream)):
+            if isinstance(value, list) and not value:
+                self.emit("[]")
+                return
+
+            separator = "[\n" + "  " * (level + 1)
+            for item in value:
+                self.emit(separator)
+                self.write(item, level + 1)
+                separator = ",\n" + "  " * (level + 1)
+            self.emit("\n" + "  " * level + "]")
+        elif isinstance(value, Rendered):
+            self.flush()
+            self.stream.write(value.data)
+        elif isinstance(value, Spliced):
+            self.write_mapping(_spliced_items(value), level)
+        else:
+            self.emit(json.dumps(value))
+
+
+def write_json(message: google.protobuf.message.Message, stream: IO[bytes]) -> None:
+    """
+    Write a message to a binary stream as UTF-8 JSON.
+    """
+    writer = _JSONWriter(stream)
+    writer.write(message)
+    writer.emit("\n")
+    writer.flush()
+
+
+def _varint(value: int) -> bytes:
+    result = bytearray()
+    while value > 0x7F:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _length_delimited(field_number: int, payload: bytes) -> bytes:
+    return (
+        _varint((field_number << 3) | _WIRETYPE_LENGTH_DELIMITED) + _varint(len(payload)) + payload
+    )
+
+
+@functools.cache
+def _may_contain_any(message_descriptor: descriptor.Descriptor) -> bool:
+    """
+    Whether a message of this type can have an ``Any`` anywhere in its tree.
+    """
+    seen = set()
+    pending = [message_descriptor]
+    while pending:
+        current = pending.pop()
+        if current.full_name == _ANY_FULL_NAME:
+            return True
+        if current.full_name in seen:
+            continue
+        seen.add(current.full_name)
+        pending.extend(
+            field.message_type for field in current.fields if field.message_type is not None
+        )
+
+    return False
+
+
+def _denamespace_in_place(message: google.protobuf.message.Message) -> None:
+    if message.DESCRIPTOR.full_name == _ANY_FULL_NAME:
+        if not message.type_url:
+            return
+        inner = unpack_any(message)
+        _denamespace_in_place(inner)
+        message.type_url = denamespace_type_url(message.type_url)
+        message.value = inner.SerializeToString(deterministic=True)
+        return
+
+    for field, value in message.ListFields():
+        if field.message_type is None or not _may_contain_any(field.message_type):
+            continue
+
+        if _is_map_entry(field):
+            value_field = field.message_type.fields_by_name["value"]
+            if value_field.message_type is not None:
+                for item in value.values():
+                    _denamespace_in_place(item)
+        elif _is_repeated(field):
+            for item in value:
+                _denamespace_in_place(item)
+        else:
+            _denamespace_in_place(value)
+
+
+def denamespaced(message: google.protobuf.message.Message) -> google.protobuf.message.Message:
+    """
+    Returns a copy of a message in which every packed ``Any`` (at any depth, including
+    inside other ``Any`` messages) carries a de-namespaced type URL, ready to be handed to
+    envoy in binary form.
+    """
+    result = type(message)()
+    result.CopyFrom(message)
+    if _may_contain_any(message.DESCRIPTOR):
+        _denamespace_in_place(result)
+    return result
+
+
+def pack(message: google.protobuf.message.Message) -> google.protobuf.any_pb2.Any:
+    """
+    Packs a de-namespaced copy of a message into an ``Any``, the way it is handed to envoy
+    as an xDS resource.
+    """
+    return google.protobuf.any_pb2.Any(
+        type_url=denamespace_type_url(TYPE_URL_PREFIX + message.DESCRIPTOR.full_name),
+        value=_encode(message),
+    )
+
+
+def _partial(
+    message: google.protobuf.message.Message, field: descriptor.FieldDescriptor, value: Any
+) -> google.protobuf.message.Message:
+    """
+    Returns a new message of the same type that only has ``field`` set.
+    """
+    result = type(message)()
+    if field.message_type is not None and _is_repeated(field):
+        getattr(result, field.name).MergeFrom(value)
+    elif _is_repeated(field):
+        getattr(result, field.name).extend(value)
+    elif field.message_type is not None:
+        getattr(result, field.name).CopyFrom(value)
+    else:
+        setattr(result, field.name, value)
+    return result
+
+
+def _encode(message: google.protobuf.message.Message) -> bytes:
+    return denamespaced(message).SerializeToString(deterministic=True)
+
+
+def _encode_spliced(spliced: Spliced) -> bytes:
+    # a message encodes to the concatenation of its fields, each encoded on its own, in
+    # the order of their numbers
+    message = spliced.message
+    spliced_field = message.DESCRIPTOR.fields_by_name[spliced.field]
+    fields: dict[descriptor.FieldDescriptor, Any] = dict(message.ListFields())
+    fields[spliced_field] = spliced.items
+
+    return b"".join(
+        (
+            b"".join(rendered.data for rendered in value)
+            if field is spliced_field
+            else _encode(_partial(message, field, value))
+        )
+        for field, value in sorted(fields.items(), key=lambda item: item[0].number)
+    )
+
+
+def _encode_item(item: Any) -> bytes:
+    if isinstance(item, Spliced):
+        return _encode_spliced(item)
+
+    return _encode(item)
+
+
+def _pb_sub_message_chunks(
+    field: descriptor.FieldDescriptor,
+    sub_fields: list[tuple[descriptor.FieldDescriptor, Any]],
+    value: Optional[google.protobuf.message.Message],
+) -> Iterator[bytes]:
+    if not sub_fields:
+        yield _length_delimited(field.number, b"")
+
+    for sub_field, sub_value in sub_fields:
+        if isinstance(sub_value, _Stream) or (
+            sub_field.message_type is not None
+            and _is_repeated(sub_field)
+            and not _is_map_entry(sub_field)
+        ):
+            for item in sub_value:
+                if isinstance(item, Rendered):
+                    yield item.data
+                    continue
+
+                yield _length_delimited(
+                    field.number, _length_delimited(sub_field.number, _encode_item(item))
+                )
+            continue
+
+        yield _length_delimited(field.number, _encode(_partial(value, sub_field, sub_value)))
+
+
+def _pb_chunks(
+    message: google.protobuf.message.Message, streams: Optional[dict[str, Iterable[Any]]] = None
+) -> Iterator[bytes]:
+    """
+    Encodes a message in pieces small enough to be written out one at a time.
+
+    Each top-level field is encoded on its own. Sub-messages of the root (e.g.
+    ``static_resources``) are split further, one element of their repeated fields at a
+    time: the protobuf wire format merges repeated occurrences of a singular message field,
+    so the concatenated pieces decode to the original message. The items of ``streams`` are
+    encoded as they are produced.
+    """
+    split_streams = _split_streams(streams or {})
+    fields = dict(message.ListFields())
+    for name in split_streams:
+        fields.setdefault(message.DESCRIPTOR.fields_by_name[name], None)
+
+    for field, value in sorted(fields.items(), key=lambda item: item[0].number):
+        if field.message_type is None or _is_repeated(field):
+            yield _encode(_partial(message, field, value))
+            continue
+
+        sub_fields = dict(value.ListFields() if value is not None else ())
+        for name, sub_stream in split_streams.get(field.name, {}).items():
+            sub_fields[field.message_type.fields_by_name[name]] = sub_stream
+
+        # empty streams are left out, like empty repeated fields
+        yield from _pb_sub_message_chunks(
+            field,
+            sorted(
+                (
+                    (sub_field, sub_value)
+                    for sub_field, sub_value in sub_fields.items()
+                    if not (isinstance(sub_value, _Stream) and sub_value.empty())
+                ),
+                key=lambda item: item[0].number,
+            ),
+            value,
+        )
+
+
+def write_pb(message: google.protobuf.message.Message, stream: IO[bytes]) -> None:
+    """
+    Write a message to a binary stream in the protobuf wire format.
+    """
+    for chunk in _pb_chunks(message):
+        stream.write(chunk)
+
+
+def _nested(path: tuple[Union[str, int], ...], items: list[Any]) -> Any:
+    value: Any = items
+    for key in reversed(path):
+        value = [value] if isinstance(key, int) else {key: value}
+    return value
+
+
+def _written_at(
+    path: tuple[Union[str, int], ...],
+    items: list[Any],
+    write: Callable[[Any, IO[bytes]], None],
+) -> bytes:
+    """
+    What ``write`` writes for ``items`` in a document which holds them at ``path``, where
+    integers stand for the item of a list. The items are written in mappings and one-item
+    lists nesting them like the output does, and cut out along a marker written the same way.
+    """
+    marker = "envoyconfgen-marker"
+    outline = io.BytesIO()
+    write(_nested(path, [marker]), outline)
+    outline_data = outline.getvalue()
+    start = outline_data.index(marker.encode("ascii"))
+    end = start + len(marker)
+    # JSON quotes the marker
+    if outline_data[start - 1 : start] == b'"':
+        start -= 1
+        end += 1
+
+    output = io.BytesIO()
+    write(_nested(path, items), output)
+    data = output.getvalue()
+    return data[start : len(data) - (len(outline_data) - end)]
+
+
+def _render_batch(
+    batch: Batch,
+    path: tuple[Union[str, int], ...],
+    wrap: tuple[int, ...],
+    output_format: str,
+    dumper_class: Optional[type[yaml.Dumper]],
+    count: bool,
+) -> Rendered:
+    """
+    Build a batch and serialize it for its place in the output: at ``path`` in YAML and
+    JSON, and inside the fields numbered ``wrap`` in protobuf.
+    """
+    items = batch.build(*batch.args)
+
+    resources: dict[str, int] = {}
+    if count:
+        profiler = profiling.Profiler()
+        profiler.count_items(str(path[-1]), items)
+        resources = profiler.resources
+
+    if output_format == "pb":
+        encoded = []
+        for item in items:
+            data = _encode(item)
+            for number in reversed(wrap):
+                data = _length_delimited(number, data)
+            encoded.append(data)
+        return Rendered(b"".join(encoded), resources)
+    elif output_format == "json":
+        return Rendered(_written_at(path, items, write_json), resources)
+    elif output_format == "yaml":
+        return Rendered(
+            _written_at(path, items, functools.partial(write_yaml, dumper_class=dumper_class)),
+            resources,
+        )
+
+    raise ValueError("Unknown output format: %s" % (output_format))
+
+
+def _submit_batches(
+    message: google.protobuf.message.Message,
+    streams: dict[str, Iterable[Any]],
+    output_format: str,
+    dumper_class: Optional[type[yaml.Dumper]],
+    executor: concurrent.futures.Executor,
+) -> dict[str, list[Any]]:
+    """
+    Consume the streams, handing every batch to the executor. The batches are replaced by
+    their futures.
+    """
+
+    def submit(
+        batch: Batch, path: tuple[Union[str, int], ...], wrap: tuple[int, ...]
+    ) -> concurrent.futures.Future:
+        return executor.submit(
+            _render_batch, batch, path, wrap, output_format, dumper_class, profiling.enabled()
+        )
+
+    result = {}
+    for name, items in streams.items():
+        field, sub_field = name.split(".")
+        field_descriptor = message.DESCRIPTOR.fields_by_name[field]
+        # stream items are written in both fields, see _pb_sub_message_chunks
+        wrap = (
+            field_descriptor.number,
+            field_descriptor.message_type.fields_by_name[sub_field].number,
+        )
+
+        submitted = []
+        for item in items:
+            if isinstance(item, Batch):
+                item = submit(item, (field, sub_field), wrap)
+            elif isinstance(item, Spliced):
+                item_wrap = (item.message.DESCRIPTOR.fields_by_name[item.field].number,)
+                item = item._replace(
+                    items=[
+                        submit(batch, (field, sub_field, 0, item.field), item_wrap)
+                        for batch in item.items
+                    ]
+                )
+            submitted.append(item)
+        result[name] = submitted
+
+    return result
+
+
+def _rendered(future: concurrent.futures.Future) -> Rendered:
+    rendered = future.result()
+    profiling.count_rendered(rendered.resources)
+    return rendered
+
+
+def _resolved(items: list[Any]) -> Iterator[Any]:
+    for index, item in enumerate(items):
+        # batches can be large, and are dropped once they are written
+        items[index] = None
+        if isinstance(item, concurrent.futures.Future):
+            yield _rendered(item)
+        elif isinstance(item, Spliced):
+            yield item._replace(items=[_rendered(future) for future in item.items])
+        else:
+            yield item
+
+
+def write_streamed(
+    message: google.protobuf.message.Message,
+    streams: dict[str, Iterable[Any]],
+    stream: IO[bytes],
+    output_format: str,
+    printable: bool = False,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> None:
+    """
+    Write a message like :func:`write`, with the repeated fields named in ``streams`` (as
+    ``field.sub_field``, e.g. ``static_resources.clusters``) taken from iterables which are
+    consumed while the output is written, so that only one of their items has to be in memory
+    at a time.
+
+    The strings of resources that were not built yet can't be checked for libyaml, so YAML is
+    only written with it if the caller vouches that they are ``printable`` ASCII.
+
+    With an ``executor``, the streams may also hold :class:`Batch` and :class:`Spliced` items.
+    The streams are consumed up front and every batch is built and serialized by the
+    executor's worker processes, in parallel with the rest; their results are written in
+    order. The output is the same as if every item had been built here.
+    """
+    dumper_class = None
+    if output_format == "yaml":
+        dumper_class = yaml_dumper_class(message) if printable else yaml.Dumper
+        profiling.note("yaml_emitter", "libyaml" if dumper_class is yaml.CDumper else "python")
+
+    if executor is not None:
+        streams = {
+            name: _resolved(items)
+            for name, items in _submit_batches(
+                message, streams, output_format, dumper_class, executor
+            ).items()
+        }
+
+    if output_format == "pb":
+        for chunk in _pb_chunks(message, streams):
+            stream.write(chunk)
+    elif output_format == "json":
+        write_json(_streamed_items(message, streams), stream)
+    elif output_format == "yaml":
+        if executor is None:
+            write_yaml(_streamed_items(message, streams), stream, dumper_class)
+            return
+
+        splicer = _Splicer(stream)
+        write_yaml(_streamed_items(message, streams), splicer, dumper_class, splicer)
+        splicer.finish()
+    else:
+        raise ValueError("Unknown output format: %s" % (output_format))
+
+
+FORMATS: dict[str, Callable[[google.protobuf.message.Message, IO[bytes]], None]] = {
+    "yaml": write_yaml,
+    "json": write_json,
+    "pb": write_pb,
+}
+
+
+def write(message: google.protobuf.message.Message, stream: IO[bytes], output_format: str) -> None:
+    """
+    Write a message to a binary stream in one of the :data:`FORMATS`.
+    """
+    try:
+        writer = FORMATS[output_format]
+    except KeyError:
+        raise ValueError("Unknown output format: %s" % (output_format))
+
+    writer(message, stream)
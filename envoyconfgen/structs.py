@@ -1,18 +1,60 @@
 from __future__ import annotations
 
 import enum
+import functools
+import ipaddress
 from typing import NamedTuple, Optional
 
-import envoyproto.envoy.config.core.v3 as core
-from envoyproto.envoy.config.core.v3.proxy_protocol_pb2 import ProxyProtocolConfig
+
+class ProxyProtocolVersion(enum.IntEnum):
+    """
+    Mirrors envoy's ``config.core.v3.ProxyProtocolConfig.Version``, so that the input
+    structures can be used without loading any protobuf modules.
+    """
+
+    V1 = 0
+    V2 = 1
+
+
+class ClusterOptions(NamedTuple):
+    """
+    Per-backend cluster settings; unset ones default to the ``[envoy]`` configuration.
+    ``type`` is one of ``cluster_types``, ``dns_lookup_family`` one of ``dns_lookup_families``
+    and ``dns_refresh_rate`` is in seconds.
+    """
+
+    type: Optional[str] = None
+    dns_lookup_family: Optional[str] = None
+    dns_refresh_rate: Optional[float] = None
+    respect_dns_ttl: Optional[bool] = None
+
+
+# "auto" picks static for IP addresses and logical_dns for host names
+cluster_types = ("auto", "static", "strict_dns", "logical_dns")
+dns_lookup_families = ("auto", "v4_only", "v6_only", "v4_preferred", "all")
+
+
+@functools.lru_cache(maxsize=65536)
+def is_ip_literal(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+
+    return True
+
 
 class Timeouts(NamedTuple):
     route: int = 120
 
+
 class SNIProxyListener(NamedTuple):
     protocol: str
     port: int
     address: str
+    filter_chain_matcher: bool = False
+    # expect a PROXY protocol header from downstream, e.g. a sharded front tier
+    accept_proxy_protocol: bool = False
 
 
 class SNIProxyVirtualHost(NamedTuple):
@@ -20,9 +62,8 @@ class SNIProxyVirtualHost(NamedTuple):
     patterns: list[str]
     http_port: int = 80
     https_port: int = 443
-    proxy_protocol: Optional[
-        "core.proxy_protocol.ProxyProtocolConfig.Version"
-    ] = core.proxy_protocol.ProxyProtocolConfig.V1
+    proxy_protocol: Optional[ProxyProtocolVersion] = ProxyProtocolVersion.V1
+    cluster: ClusterOptions = ClusterOptions()
 
 
 class MTLSSidecar(NamedTuple):
@@ -48,12 +89,51 @@ class MTLSSidecar(NamedTuple):
         port: int
         host: Optional[str] = "127.0.0.1"
         ca_cert: Optional[str] = None
+        cluster: ClusterOptions = ClusterOptions()
+
+    class Names(NamedTuple):
+        """
+        The names of a sidecar's resources; the defaults are those of an unnamed sidecar.
+        """
+
+        listener: str = "mtls_sidecar_listener"
+        cluster: str = "mtls_sidecar_backend"
+        routes: str = "local_route"
+        virtual_host: str = "mtls_sidecar_vhost"
 
     listener: Listener
     backend: Backend
+    # set for the entries of a "sidecars" list
+    name: Optional[str] = None
+
+    @property
+    def names(self) -> MTLSSidecar.Names:
+        if self.name is None:
+            return MTLSSidecar.Names()
+
+        prefix = f"mtls_sidecar_{self.name}"
+        return MTLSSidecar.Names(
+            listener=f"{prefix}_listener",
+            cluster=f"{prefix}_backend",
+            routes=f"{prefix}_routes",
+            virtual_host=f"{prefix}_vhost",
+        )
 
 
 proxy_protocol_str_to_enum = {
-    "v1": ProxyProtocolConfig.V1,
-    "v2": ProxyProtocolConfig.V2,
+    "v1": ProxyProtocolVersion.V1,
+    "v2": ProxyProtocolVersion.V2,
 }
+
+
+# the top-level keys of the processors' inputs and the types of their values, see
+# AbstractProcessor.schema. mtls_sidecar inputs may list several sidecars instead.
+zkfp_schema = [
+    ("listeners", list[SNIProxyListener]),
+    ("backends", list[SNIProxyVirtualHost]),
+]
+mtls_sidecar_schema = [
+    ("listener", MTLSSidecar.Listener),
+    ("backend", MTLSSidecar.Backend),
+]
+mtls_sidecars_schema = [("sidecars", list[MTLSSidecar])]
@@ -0,0 +1,190 @@
+"""
+Watch mode: keep rendering inputs whenever they, or the configuration files, change.
+
+Files are polled with ``os.stat``; a change in the ``[envoy]`` configuration re-renders
+everything, a change to an input only re-renders that input. Outputs are only replaced
+(atomically) when their contents actually change, and the optional hook command only runs
+after a pass that replaced at least one output.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import subprocess
+import sys
+import time
+from typing import Callable, Optional
+
+from . import registry
+from .cache import RenderCache
+from .batch import expand_paths, output_path, output_template
+from .config import Config, get_singleton
+from .convert import InvalidInputError, render
+from .fileio import atomic_open
+
+logger = logging.getLogger(__name__)
+
+T_stat = Optional[tuple[int, int, int]]
+
+
+def stat_signature(path: str) -> T_stat:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as fp:
+            return fp.read()
+    except FileNotFoundError:
+        return None
+
+
+class Watcher:
+    def __init__(
+        self,
+        processor_name: str,
+        paths: list[str],
+        output_func: Callable[[str], str],
+        output_format: str = "yaml",
+        on_change: Optional[str] = None,
+        interval: float = 1.0,
+        cache: Optional[RenderCache] = None,
+    ):
+        self.processor_name = processor_name
+        self.paths = paths
+        self.output_func = output_func
+        self.output_format = output_format
+        self.on_change = on_change
+        self.interval = interval
+        self.cache = cache
+        self.input_stats: dict[str, T_stat] = {}
+        self.config_stats: dict[str, T_stat] = {}
+
+    def render_one(self, path: str) -> bool:
+        """
+        Render one input, replacing its output if the result differs from what is on disk.
+        Returns whether the output was replaced.
+        """
+        output = self.output_func(path)
+        buffer = io.BytesIO()
+        try:
+            render(
+                registry.load(self.processor_name)(),
+                path,
+                buffer,
+                self.output_format,
+                self.cache,
+                processor_name=self.processor_name,
+            )
+        except InvalidInputError as e:
+            logger.error("%s", e)
+            return False
+        except Exception:
+            logger.exception("Failed to render %s, keeping the previous output", path)
+            return False
+
+        result = buffer.getvalue()
+        if read_file(output) == result:
+            logger.debug("%s: output %s is unchanged" % (path, output))
+            return False
+
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with atomic_open(output) as fp:
+            fp.write(result)
+
+        logger.info("%s: wrote %s" % (path, output))
+        return True
+
+    def poll_config(self) -> bool:
+        stats = {path: stat_signature(path) for path in Config.search_paths}
+        changed = stats != self.config_stats
+        self.config_stats = stats
+        return changed
+
+    def poll_inputs(self) -> list[str]:
+        stats = {path: stat_signature(path) for path in expand_paths(self.paths)}
+        changed = [
+            path
+            for path, stat in stats.items()
+            if stat is not None and self.input_stats.get(path, None) != stat
+        ]
+        self.input_stats = stats
+        return changed
+
+    def run_hook(self, outputs: list[str]) -> None:
+        if self.on_change is None:
+            return
+
+        logger.info("Running hook: %s" % (self.on_change))
+        result = subprocess.run(
+            self.on_change,
+            shell=True,
+            env=dict(os.environ, ENVOY_CONFGEN_CHANGED=" ".join(outputs)),
+        )
+        if result.returncode != 0:
+            logger.error("Hook exited with status %d: %s" % (result.returncode, self.on_change))
+
+    def poll(self) -> list[str]:
+        """
+        Run one polling pass. Returns the outputs that were replaced.
+        """
+        first_pass = len(self.config_stats) == 0
+        config_changed = self.poll_config()
+        changed_inputs = self.poll_inputs()
+
+        if config_changed and not first_pass:
+            try:
+                get_singleton().reload()
+            except ValueError as e:
+                logger.error("Invalid configuration, keeping the previous one: %s" % (e))
+            else:
+                logger.info("Configuration changed, re-rendering all inputs")
+                changed_inputs = list(self.input_stats)
+
+        outputs = [self.output_func(path) for path in changed_inputs if self.render_one(path)]
+        if self.cache is not None and len(changed_inputs) > 0:
+            self.cache.evict()
+
+        return outputs
+
+    def run(self) -> None:
+        while True:
+            outputs = self.poll()
+            if len(outputs) > 0:
+                self.run_hook(outputs)
+            time.sleep(self.interval)
+
+
+def do_watch(args) -> None:
+    # load the configuration, and with it the logging setup, before the first poll
+    get_singleton()
+
+    if len(args.path) > 1 or os.path.isdir(args.path[0]) or args.output_dir is not None:
+        template = output_template(args)
+        output_func = lambda path: output_path(template, path, args.format)
+    elif args.output is not None:
+        output_func = lambda path: args.output
+    else:
+        print("--watch needs an output file", file=sys.stderr)
+        sys.exit(1)
+
+    watcher = Watcher(
+        args.processor,
+        args.path,
+        output_func,
+        output_format=args.format,
+        on_change=args.on_change,
+        interval=args.interval if args.interval is not None else 1.0,
+        cache=RenderCache.from_args(args),
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,534 @@
+"""
+Serve mode: an xDS management server handing the generated listeners and clusters to envoy
+over the Aggregated Discovery Service, instead of writing out a static bootstrap.
+
+Both the state-of-the-world (``StreamAggregatedResources``) and the incremental
+(``DeltaAggregatedResources``) variants are implemented. Resources are versioned by the hash
+of their encoding, so when the input changes, delta streams only receive the resources that
+actually changed. Clusters are always sent before the listeners that use them, and removed
+after them, so that no listener ever refers to a cluster envoy does not know about.
+
+The gRPC service is registered with generic handlers, so only ``grpcio`` itself is needed
+(``pip install envoyconfgen[xds]``), not generated service stubs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import logging
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, NamedTuple, Optional
+
+from envoyproto.envoy.service.discovery.v3 import discovery
+
+import google.protobuf.any_pb2
+
+from . import registry
+from .config import Config, get_singleton
+from .convert import InvalidInputError, build_resources
+from .fileio import atomic_open
+from .serialize import TYPE_URL_PREFIX, pack, write
+from .watch import read_file, stat_signature
+
+if TYPE_CHECKING:
+    import grpc
+
+    from .processors import AbstractProcessor
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_TYPE = TYPE_URL_PREFIX + "envoy.config.cluster.v3.Cluster"
+LISTENER_TYPE = TYPE_URL_PREFIX + "envoy.config.listener.v3.Listener"
+# clusters are sent before the listeners referring to them
+RESOURCE_TYPES = (CLUSTER_TYPE, LISTENER_TYPE)
+
+ADS_SERVICE = "envoy.service.discovery.v3.AggregatedDiscoveryService"
+
+
+class Resource(NamedTuple):
+    version: str
+    resource: google.protobuf.any_pb2.Any
+
+
+T_resources = dict[str, dict[str, Resource]]
+
+
+def index_resources(messages: Iterable[Any]) -> dict[str, Resource]:
+    """
+    Pack named resources, versioned by the hash of their encoding.
+    """
+    result = {}
+    for message in messages:
+        packed = pack(message)
+        result[message.name] = Resource(hashlib.sha256(packed.value).hexdigest()[:16], packed)
+
+    return result
+
+
+def type_version(resources: dict[str, Resource]) -> str:
+    digest = hashlib.sha256()
+    for name in sorted(resources):
+        digest.update(f"{name}\0{resources[name].version}\0".encode("utf-8"))
+
+    return digest.hexdigest()[:16]
+
+
+class ResourceStore:
+    """
+    The current listeners and clusters, shared by every stream. Each stream registers a
+    queue, which is notified when the resources change.
+    """
+
+    # put into the queues of the streams when the resources change
+    CHANGED = object()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources: T_resources = {type_url: {} for type_url in RESOURCE_TYPES}
+        self.versions: dict[str, str] = {type_url: type_version({}) for type_url in RESOURCE_TYPES}
+        self.queues: set[queue.Queue] = set()
+
+    def update(self, listeners: Iterable[Any], clusters: Iterable[Any]) -> list[str]:
+        """
+        Replace the resources. Returns the type URLs which changed.
+        """
+        resources = {
+            CLUSTER_TYPE: index_resources(clusters),
+            LISTENER_TYPE: index_resources(listeners),
+        }
+        versions = {type_url: type_version(resources[type_url]) for type_url in RESOURCE_TYPES}
+
+        with self.lock:
+            changed = [t for t in RESOURCE_TYPES if versions[t] != self.versions[t]]
+            # the dicts are replaced, never modified, so streams can keep using a snapshot
+            self.resources = resources
+            self.versions = versions
+            if len(changed) > 0:
+                for q in self.queues:
+                    q.put(self.CHANGED)
+
+        return changed
+
+    def snapshot(self) -> tuple[T_resources, dict[str, str]]:
+        with self.lock:
+            return self.resources, self.versions
+
+    def subscribe(self, q: queue.Queue) -> None:
+        with self.lock:
+            self.queues.add(q)
+
+    def unsubscribe(self, q: queue.Queue) -> None:
+        with self.lock:
+            self.queues.discard(q)
+
+
+def _stream_events(
+    store: ResourceStore, requests: Iterator[Any], context: grpc.ServicerContext
+) -> Iterator[Any]:
+    """
+    Merge the requests of a stream with the change notifications of the store. Yields
+    requests, or ``ResourceStore.CHANGED``.
+    """
+    q: queue.Queue = queue.Queue()
+
+    def read_requests() -> None:
+        try:
+            for request in requests:
+                q.put(request)
+        except Exception:
+            # the stream was cancelled
+            pass
+        q.put(None)
+
+    store.subscribe(q)
+    context.add_callback(lambda: q.put(None))
+    threading.Thread(target=read_requests, daemon=True).start()
+    try:
+        while True:
+            event = q.get()
+            if event is None:
+                return
+            yield event
+    finally:
+        store.unsubscribe(q)
+
+
+def _log_request(request: Any, node_logged: list[bool]) -> None:
+    if not node_logged[0] and request.HasField("node"):
+        logger.info(
+            "Stream opened by node %s (cluster %s)" % (request.node.id, request.node.cluster)
+        )
+        node_logged[0] = True
+
+    if request.HasField("error_detail"):
+        logger.warning(
+            "Node rejected %s (nonce %s): %s"
+            % (request.type_url, request.response_nonce, request.error_detail.message)
+        )
+
+
+class _SotWStream:
+    """
+    State of a ``StreamAggregatedResources`` stream: the whole set of resources of a type
+    is sent whenever its version changes.
+    """
+
+    def __init__(self, store: ResourceStore):
+        self.store = store
+        self.nonces = itertools.count(1)
+        self.nonce: dict[str, str] = {}
+        # type URL -> requested names (empty for all), and the version and resources last sent
+        self.subscriptions: dict[str, list[str]] = {}
+        self.sent: dict[str, str] = {}
+        self.sent_resources: dict[str, dict[str, Resource]] = {}
+
+    def response(self, type_url: str, keep_removed: bool = False) -> Optional[Any]:
+        """
+        The response with the current resources, unless the node has them already. With
+        ``keep_removed``, the resources sent before which are gone now are sent again as well:
+        a state-of-the-world response removes everything it leaves out.
+        """
+        resources, versions = self.store.snapshot()
+        names = self.subscriptions[type_url]
+        selected = resources[type_url]
+        if len(names) > 0:
+            selected = {name: selected[name] for name in names if name in selected}
+
+        version = versions[type_url]
+        if keep_removed:
+            previous = self.sent_resources.get(type_url, {})
+            removed = {name: previous[name] for name in previous if name not in selected}
+            if len(removed) > 0:
+                selected = {**selected, **removed}
+                version = type_version(selected)
+
+        if self.sent.get(type_url, None) == version:
+            return None
+
+        self.sent[type_url] = version
+        self.sent_resources[type_url] = selected
+        self.nonce[type_url] = str(next(self.nonces))
+        return discovery.DiscoveryResponse(
+            version_info=version,
+            resources=[resource.resource for resource in selected.values()],
+            type_url=type_url,
+            nonce=self.nonce[type_url],
+        )
+
+    def handle(self, request: Any) -> Iterator[Any]:
+        type_url = request.type_url
+        if type_url not in RESOURCE_TYPES:
+            logger.debug("Ignoring request for unsupported type %s" % (type_url))
+            return
+
+        if request.response_nonce and request.response_nonce != self.nonce.get(type_url, None):
+            # a reply to an earlier response, superseded by one the node has yet to see
+            return
+
+        if request.HasField("error_detail"):
+            # don't send the rejected version again, wait for the next change
+            return
+
+        names = list(request.resource_names)
+        if names != self.subscriptions.get(type_url, None):
+            self.sent.pop(type_url, None)
+        self.subscriptions[type_url] = names
+
+        response = self.response(type_url)
+        if response is not None:
+            yield response
+
+    def changed(self) -> Iterator[Any]:
+        # the new clusters are added first, alongside the ones which are no longer used, then
+        # the listeners are updated, and finally the unused clusters are removed
+        steps = [(CLUSTER_TYPE, True), (LISTENER_TYPE, False), (CLUSTER_TYPE, False)]
+        for type_url, keep_removed in steps:
+            if type_url in self.subscriptions:
+                response = self.response(type_url, keep_removed)
+                if response is not None:
+                    yield response
+
+
+class _DeltaSubscription:
+    def __init__(self):
+        self.wildcard = False
+        self.names: set[str] = set()
+        # what the node has, by name
+        self.known: dict[str, str] = {}
+
+    def wanted(self, resources: dict[str, Resource]) -> Iterable[str]:
+        if self.wildcard:
+            return resources.keys()
+        return [name for name in self.names if name in resources]
+
+
+class _DeltaStream:
+    """
+    State of a ``DeltaAggregatedResources`` stream: only resources whose version differs
+    from the one the node has are sent.
+    """
+
+    def __init__(self, store: ResourceStore):
+        self.store = store
+        self.nonces = itertools.count(1)
+        self.subscriptions: dict[str, _DeltaSubscription] = {}
+
+    def response(
+        self, type_url: str, updates: bool = True, removals: bool = True, force: bool = False
+    ) -> Optional[Any]:
+        resources, versions = self.store.snapshot()
+        resources = resources[type_url]
+        subscription = self.subscriptions[type_url]
+
+        updated = []
+        if updates:
+            for name in subscription.wanted(resources):
+                if subscription.known.get(name, None) != resources[name].version:
+                    updated.append(
+                        discovery.Resource(
+                            name=name,
+                            version=resources[name].version,
+                            resource=resources[name].resource,
+                        )
+                    )
+                    subscription.known[name] = resources[name].version
+
+        removed = []
+        if removals:
+            wanted = set(subscription.wanted(resources))
+            removed = sorted(name for name in subscription.known if name not in wanted)
+            for name in removed:
+                del subscription.known[name]
+
+        if len(updated) == 0 and len(removed) == 0 and not force:
+            return None
+
+        return discovery.DeltaDiscoveryResponse(
+            system_version_info=versions[type_url],
+            resources=updated,
+            type_url=type_url,
+            removed_resources=removed,
+            nonce=str(next(self.nonces)),
+        )
+
+    def handle(self, request: Any) -> Iterator[Any]:
+        type_url = request.type_url
+        if type_url not in RESOURCE_TYPES:
+            logger.debug("Ignoring request for unsupported type %s" % (type_url))
+            return
+
+        if request.response_nonce:
+            # an ACK or NACK of an earlier response. a NACKed resource is left as it is,
+            # until it changes again.
+            if len(request.resource_names_subscribe) + len(request.resource_names_unsubscribe) == 0:
+                return
+
+        first = type_url not in self.subscriptions
+        subscription = self.subscriptions.setdefault(type_url, _DeltaSubscription())
+        if first:
+            subscription.known.update(request.initial_resource_versions)
+            # listeners and clusters are subscribed to as wildcards by envoy
+            subscription.wildcard = len(request.resource_names_subscribe) == 0
+
+        for name in request.resource_names_subscribe:
+            if name == "*":
+                subscription.wildcard = True
+            else:
+                subscription.names.add(name)
+
+        for name in request.resource_names_unsubscribe:
+            if name == "*":
+                subscription.wildcard = False
+            else:
+                subscription.names.discard(name)
+                subscription.known.pop(name, None)
+
+        # the first response is always sent, so that the node can finish initializing
+        response = self.response(type_url, force=first)
+        if response is not None:
+            yield response
+
+    def changed(self) -> Iterator[Any]:
+        # new and changed clusters first, then the listeners, and finally the removal of the
+        # clusters which are no longer used
+        steps = [
+            (CLUSTER_TYPE, True, False),
+            (LISTENER_TYPE, True, True),
+            (CLUSTER_TYPE, False, True),
+        ]
+        for type_url, updates, removals in steps:
+            if type_url in self.subscriptions:
+                response = self.response(type_url, updates, removals)
+                if response is not None:
+                    yield response
+
+
+class AggregatedDiscoveryService:
+    def __init__(self, store: ResourceStore):
+        self.store = store
+
+    def _run(self, stream: Any, requests: Iterator[Any], context: grpc.ServicerContext):
+        node_logged = [False]
+        for event in _stream_events(self.store, requests, context):
+            if event is ResourceStore.CHANGED:
+                yield from stream.changed()
+            else:
+                _log_request(event, node_logged)
+                yield from stream.handle(event)
+
+    def StreamAggregatedResources(self, requests, context):
+        return self._run(_SotWStream(self.store), requests, context)
+
+    def DeltaAggregatedResources(self, requests, context):
+        return self._run(_DeltaStream(self.store), requests, context)
+
+    def handler(self) -> grpc.GenericRpcHandler:
+        import grpc
+
+        return grpc.method_handlers_generic_handler(
+            ADS_SERVICE,
+            {
+                "StreamAggregatedResources": grpc.stream_stream_rpc_method_handler(
+                    self.StreamAggregatedResources,
+                    request_deserializer=discovery.DiscoveryRequest.FromString,
+                    response_serializer=discovery.DiscoveryResponse.SerializeToString,
+                ),
+                "DeltaAggregatedResources": grpc.stream_stream_rpc_method_handler(
+                    self.DeltaAggregatedResources,
+                    request_deserializer=discovery.DeltaDiscoveryRequest.FromString,
+                    response_serializer=discovery.DeltaDiscoveryResponse.SerializeToString,
+                ),
+            },
+        )
+
+
+def start_server(
+    store: ResourceStore, address: str, max_streams: int = 64
+) -> tuple[grpc.Server, int]:
+    """
+    Start serving ADS on ``address`` (``host:port``, port 0 picks a free one). Returns the
+    server and the port it listens on.
+    """
+    import grpc
+
+    # every stream occupies a worker for as long as it is open
+    server = grpc.server(
+        ThreadPoolExecutor(max_workers=max_streams), maximum_concurrent_rpcs=max_streams
+    )
+    server.add_generic_rpc_handlers((AggregatedDiscoveryService(store).handler(),))
+    port = server.add_insecure_port(address)
+    server.start()
+    return server, port
+
+
+class InputPoller:
+    """
+    Rebuilds the resources of an input whenever it, or a configuration file, changes.
+    """
+
+    def __init__(self, processor_name: str, path: str, store: ResourceStore):
+        self.processor_name = processor_name
+        self.path = path
+        self.store = store
+        self.stats: dict[str, Any] = {}
+
+    def build(self) -> None:
+        listeners, clusters = build_resources(
+            registry.load(self.processor_name)(), self.path, read_file(self.path)
+        )
+        changed = self.store.update(listeners, clusters)
+        logger.info(
+            "%s: %d listeners, %d clusters, changed: %s"
+            % (
+                self.path,
+                len(listeners),
+                len(clusters),
+                ", ".join(t.rsplit(".", 1)[-1] for t in changed) or "nothing",
+            )
+        )
+
+    def stat_files(self) -> dict[str, Any]:
+        return {path: stat_signature(path) for path in (self.path, *Config.search_paths)}
+
+    def poll(self) -> bool:
+        stats = self.stat_files()
+        if stats == self.stats:
+            return False
+
+        config_changed = len(self.stats) > 0 and any(
+            stats[path] != self.stats.get(path, None) for path in Config.search_paths
+        )
+        self.stats = stats
+        if config_changed:
+            logger.info("Configuration changed, reloading")
+            try:
+                get_singleton().reload()
+            except ValueError as e:
+                logger.error("Invalid configuration, keeping the previous one: %s" % (e))
+
+        try:
+            self.build()
+        except InvalidInputError as e:
+            logger.error("%s", e)
+        except Exception:
+            logger.exception("Failed to build %s, keeping the previous resources", self.path)
+
+        return True
+
+
+def _parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host.strip("[]"), int(port)
+
+
+def do_serve(args) -> None:
+    # load the configuration, and with it the logging setup, before anything else
+    get_singleton()
+
+    try:
+        import grpc  # noqa: F401
+    except ImportError:
+        print("serve mode needs grpcio: pip install envoyconfgen[xds]", file=sys.stderr)
+        sys.exit(1)
+
+    store = ResourceStore()
+    poller = InputPoller(args.processor, args.path, store)
+    try:
+        poller.stats = poller.stat_files()
+        poller.build()
+    except InvalidInputError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    server, port = start_server(store, args.listen)
+    logger.info("Serving ADS on %s (port %d)" % (args.listen, port))
+
+    if args.bootstrap is not None:
+        from .bootstrap import generate_dynamic_bootstrap
+
+        host, _ = _parse_address(args.listen)
+        if host in ("", "0.0.0.0", "::"):
+            host = "127.0.0.1"
+        with atomic_open(args.bootstrap) as fp:
+            write(
+                generate_dynamic_bootstrap(
+                    host, port, args.node_id, args.node_cluster, delta=not args.sotw
+                ),
+                fp,
+                args.format,
+            )
+        logger.info("Wrote bootstrap %s" % (args.bootstrap))
+
+    try:
+        while True:
+            time.sleep(args.interval)
+            poller.poll()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop(grace=1)
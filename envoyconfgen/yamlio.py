@@ -0,0 +1,33 @@
+"""
+The YAML parser and emitter used for inputs and outputs.
+
+libyaml's C implementations are an order of magnitude faster than PyYAML's pure Python ones
+and produce the same results, so they are used whenever PyYAML was built with libyaml.
+Setting ``ENVOY_CONFGEN_PURE_YAML`` forces the pure Python implementations.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Any, Union
+
+import yaml
+
+Dumper: type[yaml.Dumper]
+SafeLoader: type[yaml.SafeLoader]
+
+if yaml.__with_libyaml__ and not os.environ.get("ENVOY_CONFGEN_PURE_YAML"):
+    Dumper = yaml.CDumper
+    SafeLoader = yaml.CSafeLoader
+    backend = "libyaml"
+else:
+    Dumper = yaml.Dumper
+    SafeLoader = yaml.SafeLoader
+    backend = "python"
+
+
+def safe_load(stream: Union[bytes, str]) -> Any:
+    """
+    Like :func:`yaml.safe_load`, with the fastest available parser.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
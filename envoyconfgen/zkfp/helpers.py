@@ -1,10 +1,44 @@
+import hashlib
+from typing import NamedTuple, Optional
+
 from envoyconfgen.helpers import clean_vhost_name
-from envoyconfgen.structs import SNIProxyVirtualHost
+from envoyconfgen.structs import ClusterOptions, ProxyProtocolVersion, SNIProxyVirtualHost
+
+
+class ClusterKey(NamedTuple):
+    """
+    everything that distinguishes one upstream cluster from another - backends and listeners
+    reaching the same key share a cluster
+    """
+
+    host: str
+    port: int
+    proxy_protocol: Optional[ProxyProtocolVersion]
+    options: ClusterOptions = ClusterOptions()
+
+
+def cluster_name(key: ClusterKey) -> str:
+    name = "%s_%d" % (clean_vhost_name(key.host), key.port)
+    if key.proxy_protocol is not None:
+        name += "_proxy_%s" % (key.proxy_protocol.name.lower())
+    if key.options != ClusterOptions():
+        # backends with their own cluster settings can't share the cluster of the others
+        name += "_%s" % (hashlib.sha256(repr(tuple(key.options)).encode()).hexdigest()[:8])
+
+    return name
+
+
+def http_cluster_key(vhost: SNIProxyVirtualHost) -> ClusterKey:
+    return ClusterKey(vhost.host, vhost.http_port, vhost.proxy_protocol, vhost.cluster)
+
+
+def https_cluster_key(vhost: SNIProxyVirtualHost) -> ClusterKey:
+    return ClusterKey(vhost.host, vhost.https_port, vhost.proxy_protocol, vhost.cluster)
 
 
 def http_cluster_name(vhost: SNIProxyVirtualHost) -> str:
-    return "%s_%s_%d" % (clean_vhost_name(vhost.host), "http", vhost.http_port)
+    return cluster_name(http_cluster_key(vhost))
 
 
 def https_cluster_name(vhost: SNIProxyVirtualHost) -> str:
-    return "%s_%s_%d" % (clean_vhost_name(vhost.host), "https", vhost.https_port)
+    return cluster_name(https_cluster_key(vhost))
@@ -2,21 +2,34 @@ from os import access
 import sys
 import re
 
-from typing import Collection
+from typing import Collection, Iterator, Optional
 
 import envoyproto.envoy.config.listener.v3 as listener
 import envoyproto.envoy.config.core.v3 as core
 import envoyproto.envoy.config.route.v3 as route
+import envoyproto.xds.core.v3 as xds_core
+import envoyproto.xds.type.matcher.v3 as xds_matcher
+from envoyproto.envoy.extensions.matching.common_inputs.network.v3 import network_inputs
+
+import google.protobuf.wrappers_pb2
 
 from envoyconfgen.filters import (
     tls_inspector_listener_filter,
     http_connection_manager_filter,
+    proxy_protocol_listener_filter,
     tcp_proxy_listener_filter,
 )
-from envoyconfgen.helpers import typed_config, file_access_log
-from envoyconfgen.structs import SNIProxyVirtualHost
+from envoyconfgen.helpers import interned, typed_config, file_access_log
+from envoyconfgen.structs import SNIProxyListener, SNIProxyVirtualHost
 
-from .helpers import http_cluster_name, https_cluster_name
+from .helpers import (
+    ClusterKey,
+    http_cluster_key,
+    http_cluster_name,
+    https_cluster_key,
+    https_cluster_name,
+)
+from .patterns import normalize_pattern, wildcard_suffix
 
 
 def http_virtual_host(vhost: SNIProxyVirtualHost) -> route.route_components.VirtualHost:
@@ -41,17 +54,268 @@ def sni_proxy_http_routes(
         name="local_route", virtual_hosts=[http_virtual_host(vhost) for vhost in vhosts]
     )
 
+    # envoy rejects repeated virtual host names, which backends sharing a host and port (like
+    # the entries of a sharded front tier pointing at the same shard) would have
+    seen: dict[str, int] = {}
+    for virtual_host in rc.virtual_hosts:
+        name = virtual_host.name
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            virtual_host.name = f"{name}_{seen[name]}"
+
     return rc
 
 
+def _covering_suffixes(pattern: str) -> Iterator[str]:
+    """
+    the suffixes of every wildcard that matches all of the names matched by a pattern:
+    ".b.c", ".c" and "" for both "a.b.c" and "*.b.c"
+    """
+    index = pattern.find(".")
+    while index >= 0:
+        yield pattern[index:]
+        index = pattern.find(".", index + 1)
+    yield ""
+
+
+def resolve_server_names(
+    virtual_hosts: Collection[SNIProxyVirtualHost],
+) -> tuple[dict[str, int], dict[str, int]]:
+    """
+    map every literal and wildcard pattern to the index of the backend that wins it when
+    backends are tried in order.
+
+    a matcher picks the most specific pattern for a server name, so each pattern is mapped
+    to the first backend having either that pattern or a wildcard covering it. wildcards
+    nest, which makes that backend the same for every name the pattern matches. patterns
+    are normalized like the pattern index does when validating them.
+    """
+    first_wildcard: dict[str, int] = {}
+    for index, vhost in enumerate(virtual_hosts):
+        for pattern in vhost.patterns:
+            suffix = wildcard_suffix(normalize_pattern(pattern))
+            if suffix is not None:
+                first_wildcard.setdefault(suffix, index)
+
+    literals: dict[str, int] = {}
+    wildcards: dict[str, int] = {}
+    for index, vhost in enumerate(virtual_hosts):
+        for pattern in map(normalize_pattern, vhost.patterns):
+            winner = min(
+                [index]
+                + [first_wildcard[s] for s in _covering_suffixes(pattern) if s in first_wildcard]
+            )
+            if wildcard_suffix(pattern) is None:
+                literals.setdefault(pattern, winner)
+            else:
+                wildcards.setdefault(pattern, winner)
+
+    return literals, wildcards
+
+
+@interned
+def _server_name_input() -> xds_core.extension.TypedExtensionConfig:
+    return xds_core.extension.TypedExtensionConfig(
+        name="envoy.matching.inputs.server_name",
+        typed_config=typed_config(network_inputs.ServerNameInput()),
+    )
+
+
+@interned
+def _filter_chain_action(name: str) -> xds_matcher.matcher.Matcher.OnMatch:
+    return xds_matcher.matcher.Matcher.OnMatch(
+        action=xds_core.extension.TypedExtensionConfig(
+            name=name,
+            typed_config=typed_config(google.protobuf.wrappers_pb2.StringValue(value=name)),
+        ),
+    )
+
+
+def sni_filter_chain_matcher(
+    literals: dict[str, str], wildcards: dict[str, str]
+) -> Optional[xds_matcher.matcher.Matcher]:
+    """
+    build a matcher selecting filter chains by name: literal server names are looked up in
+    an exact match map, and the remaining names fall through to a domain matcher holding
+    the wildcards, grouped by filter chain.
+    """
+    result = None
+    if len(wildcards) > 0:
+        domains: dict[str, list[str]] = {}
+        for pattern, chain_name in wildcards.items():
+            domains.setdefault(chain_name, []).append(pattern)
+
+        result = xds_matcher.matcher.Matcher(
+            matcher_tree=xds_matcher.matcher.Matcher.MatcherTree(
+                input=_server_name_input(),
+                custom_match=xds_core.extension.TypedExtensionConfig(
+                    name="envoy.matching.custom_matchers.domain_matcher",
+                    typed_config=typed_config(
+                        xds_matcher.domain.ServerNameMatcher(
+                            domain_matchers=[
+                                xds_matcher.domain.ServerNameMatcher.DomainMatcher(
+                                    domains=patterns,
+                                    on_match=_filter_chain_action(chain_name),
+                                )
+                                for chain_name, patterns in domains.items()
+                            ],
+                        )
+                    ),
+                ),
+            ),
+        )
+
+    if len(literals) > 0:
+        exact = xds_matcher.matcher.Matcher(
+            matcher_tree=xds_matcher.matcher.Matcher.MatcherTree(
+                input=_server_name_input(),
+                exact_match_map=xds_matcher.matcher.Matcher.MatcherTree.MatchMap(
+                    map={
+                        name: _filter_chain_action(chain_name)
+                        for name, chain_name in literals.items()
+                    },
+                ),
+            ),
+        )
+        if result is not None:
+            exact.on_no_match.matcher.CopyFrom(result)
+        result = exact
+
+    return result
+
+
+def listener_cluster_keys(
+    protocol: str,
+    virtual_hosts: Collection[SNIProxyVirtualHost],
+    filter_chain_matcher: bool = False,
+) -> list[ClusterKey]:
+    """
+    the upstream clusters referenced by the routes or filter chains of a listener
+    """
+    if protocol == "http":
+        return [http_cluster_key(vhost) for vhost in virtual_hosts]
+
+    if protocol == "https":
+        if filter_chain_matcher:
+            vhosts = list(virtual_hosts)
+            literals, wildcards = resolve_server_names(vhosts)
+            return [
+                https_cluster_key(vhosts[index])
+                for index in sorted(set(literals.values()) | set(wildcards.values()))
+            ]
+
+        return [https_cluster_key(vhost) for vhost in virtual_hosts]
+
+    return []
+
+
+def https_filter_chain(vhost: SNIProxyVirtualHost) -> listener.listener_components.FilterChain:
+    return listener.listener_components.FilterChain(
+        filter_chain_match=listener.listener_components.FilterChainMatch(
+            server_names=[pattern for pattern in vhost.patterns],
+        ),
+        filters=[
+            tcp_proxy_listener_filter(https_cluster_name(vhost)),
+        ],
+    )
+
+
+def https_filter_chains(
+    virtual_hosts: Collection[SNIProxyVirtualHost],
+) -> list[listener.listener_components.FilterChain]:
+    """
+    one filter chain per backend, matching its patterns
+    """
+    return [https_filter_chain(vhost) for vhost in virtual_hosts]
+
+
+def named_filter_chains(
+    chain_names: Collection[str],
+) -> list[listener.listener_components.FilterChain]:
+    """
+    filter chains selected by a matcher, named after the cluster they proxy to
+    """
+    return [
+        listener.listener_components.FilterChain(
+            name=chain_name,
+            filters=[
+                tcp_proxy_listener_filter(chain_name),
+            ],
+        )
+        for chain_name in chain_names
+    ]
+
+
+def https_chain_matcher(
+    virtual_hosts: Collection[SNIProxyVirtualHost],
+) -> tuple[list[str], Optional[xds_matcher.matcher.Matcher]]:
+    """
+    the names of the filter chains an https listener selects with a matcher, and the matcher.
+    only backends winning at least one pattern get a chain.
+    """
+    vhosts = list(virtual_hosts)
+    literals, wildcards = resolve_server_names(vhosts)
+    chain_names = {
+        index: https_cluster_name(vhosts[index])
+        for index in sorted(set(literals.values()) | set(wildcards.values()))
+    }
+    # backends sharing an upstream cluster share its filter chain, too
+    return list(dict.fromkeys(chain_names.values())), sni_filter_chain_matcher(
+        {name: chain_names[index] for name, index in literals.items()},
+        {pattern: chain_names[index] for pattern, index in wildcards.items()},
+    )
+
+
+def https_listener(
+    address: str,
+    port: int,
+    filter_chains: list[listener.listener_components.FilterChain],
+    chain_matcher: Optional[xds_matcher.matcher.Matcher] = None,
+    accept_proxy_protocol: bool = False,
+) -> listener.listener.Listener:
+    return _listener(
+        "https",
+        address,
+        port,
+        [tls_inspector_listener_filter()],
+        filter_chains,
+        chain_matcher,
+        accept_proxy_protocol,
+    )
+
+
 def sni_reverse_proxy_listener(
     protocol: str,
     address: str = "::",
     port: int = 443,
     virtual_hosts: Collection[SNIProxyVirtualHost] = [],
+    filter_chain_matcher: bool = False,
+    accept_proxy_protocol: bool = False,
 ) -> listener.listener.Listener:
+    if protocol == "https":
+        # https listeners have to match much earlier in the negotiation process - the
+        # `server_name` field gets populated by the `tls_inspector` listener filter and
+        # is used here for matching.
+        # we use one filter chain per backend, with matching happening on simple wildcard
+        # patterns not unlike the `domains` property on virtual hosts
+        # order matters for these, as the first pattern matched is the chosen backend
+        if filter_chain_matcher:
+            # alternatively, named filter chains are selected by a matcher, which envoy
+            # resolves with map lookups and can update one chain at a time
+            chain_names, chain_matcher = https_chain_matcher(virtual_hosts)
+            return https_listener(
+                address,
+                port,
+                named_filter_chains(chain_names),
+                chain_matcher,
+                accept_proxy_protocol,
+            )
+
+        return https_listener(
+            address, port, https_filter_chains(virtual_hosts), None, accept_proxy_protocol
+        )
+
     filter_chains = []
-    listener_filters = []
     if protocol == "http":
         # http listeners get to do this the easy way using real virtual hosts
         filter_chains.append(
@@ -63,25 +327,38 @@ def sni_reverse_proxy_listener(
                 ],
             )
         )
-    elif protocol == "https":
-        # https listeners have to match much earlier in the negotiation process - the
-        # `server_name` field gets populated by the `tls_inspector` listener filter and
-        # is used here for matching.
-        # we use one filter chain per backend, with matching happening on simple wildcard
-        # patterns not unlike the `domains` property on virtual hosts
-        # order matters for these, as the first pattern matched is the chosen backend
-        for vhost in virtual_hosts:
-            filter_chains.append(
-                listener.listener_components.FilterChain(
-                    filter_chain_match=listener.listener_components.FilterChainMatch(
-                        server_names=[pattern for pattern in vhost.patterns],
-                    ),
-                    filters=[
-                        tcp_proxy_listener_filter(https_cluster_name(vhost)),
-                    ],
-                )
-            )
-        listener_filters.append(tls_inspector_listener_filter())
+
+    return _listener(protocol, address, port, [], filter_chains, None, accept_proxy_protocol)
+
+
+def sni_reverse_proxy_listeners(
+    listeners: Collection[SNIProxyListener],
+    virtual_hosts: Collection[SNIProxyVirtualHost],
+) -> list[listener.listener.Listener]:
+    return [
+        sni_reverse_proxy_listener(
+            l.protocol,
+            l.address,
+            l.port,
+            virtual_hosts,
+            filter_chain_matcher=l.filter_chain_matcher,
+            accept_proxy_protocol=l.accept_proxy_protocol,
+        )
+        for l in listeners
+    ]
+
+
+def _listener(
+    protocol: str,
+    address: str,
+    port: int,
+    listener_filters: list[listener.listener_components.ListenerFilter],
+    filter_chains: list[listener.listener_components.FilterChain],
+    chain_matcher: Optional[xds_matcher.matcher.Matcher] = None,
+    accept_proxy_protocol: bool = False,
+) -> listener.listener.Listener:
+    if accept_proxy_protocol:
+        listener_filters = [proxy_protocol_listener_filter()] + listener_filters
 
     return listener.listener.Listener(
         name=f"{protocol}_{port}",
@@ -94,4 +371,5 @@ def sni_reverse_proxy_listener(
         ),
         listener_filters=listener_filters,
         filter_chains=filter_chains,
+        filter_chain_matcher=chain_matcher,
     )
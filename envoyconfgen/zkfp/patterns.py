@@ -0,0 +1,127 @@
+"""
+Index of the hostname patterns of all zkfp backends.
+
+Patterns are stored in a trie keyed on the reversed labels of the name, so that the wildcards
+covering a pattern are found on the path to it. Inserting every pattern in backend order finds
+duplicates, shadowed and redundant patterns in time linear in the total number of labels.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, NamedTuple, Optional
+
+
+def wildcard_suffix(pattern: str) -> Optional[str]:
+    """
+    the suffix matched by a wildcard pattern ("" for a bare "*"), or None for a literal
+    server name
+    """
+    if pattern == "*":
+        return ""
+    if pattern.startswith("*."):
+        return pattern[1:]
+    return None
+
+
+def normalize_pattern(pattern: str) -> str:
+    """
+    server names are matched regardless of case, so patterns are compared lowercased
+    """
+    return pattern.lower()
+
+
+class PatternProblem(NamedTuple):
+    backend: int
+    pattern: str
+    # the position of the pattern in its backend's patterns
+    index: int
+    # the earlier backend making the pattern a duplicate, unreachable or redundant
+    other_backend: int
+    other_pattern: str
+    kind: str
+
+    def __str__(self) -> str:
+        if self.kind == "duplicate":
+            return (
+                f'pattern "{self.pattern}" of backend #{self.backend + 1} is already used by '
+                f"backend #{self.other_backend + 1}"
+            )
+        if self.kind == "shadowed":
+            return (
+                f'pattern "{self.pattern}" of backend #{self.backend + 1} is unreachable, '
+                f'"{self.other_pattern}" of backend #{self.other_backend + 1} matches first'
+            )
+        return (
+            f'pattern "{self.pattern}" of backend #{self.backend + 1} is redundant, it is '
+            f'covered by "{self.other_pattern}"'
+        )
+
+
+class _Node:
+    __slots__ = ("children", "literal", "wildcard")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # (backend, pattern) of the first literal name ending at this node, and of the first
+        # wildcard matching the subdomains of this node
+        self.literal: Optional[tuple[int, str]] = None
+        self.wildcard: Optional[tuple[int, str]] = None
+
+
+class PatternIndex:
+    """
+    Collects the patterns of backends added in order and the problems between them.
+
+    * duplicates - the same pattern on two backends. envoy rejects duplicate virtual host
+      domains, so these are errors.
+    * shadowed - a pattern covered by a wildcard of an earlier backend, which always wins.
+    * redundant - a pattern covered by a wildcard of its own backend, or listed twice.
+    """
+
+    def __init__(self):
+        self.root = _Node()
+        self.backends = 0
+        self.duplicates: list[PatternProblem] = []
+        self.shadowed: list[PatternProblem] = []
+        self.redundant: list[PatternProblem] = []
+
+    def add_backend(self, patterns: Iterable[str]) -> None:
+        backend = self.backends
+        self.backends += 1
+
+        # the order of a backend's own patterns does not matter, so insert its wildcards
+        # broadest first, followed by its literals, to find everything they make redundant
+        parsed = []
+        for index, pattern in enumerate(patterns):
+            name = normalize_pattern(pattern)
+            suffix = wildcard_suffix(name)
+            labels = (suffix if suffix is not None else "." + name).split(".")[1:]
+            parsed.append((suffix is None, len(labels), index, pattern, labels))
+
+        for is_literal, _, index, pattern, labels in sorted(parsed, key=lambda p: p[:2]):
+            self._insert(backend, pattern, index, labels[::-1], is_literal)
+
+    def _insert(
+        self, backend: int, pattern: str, index: int, labels: list[str], is_literal: bool
+    ) -> None:
+        # the earliest wildcard on the path matches every name this pattern can match
+        covering = None
+        node = self.root
+        for label in labels:
+            if node.wildcard is not None and (covering is None or node.wildcard < covering):
+                covering = node.wildcard
+            node = node.children.setdefault(label, _Node())
+
+        slot = "literal" if is_literal else "wildcard"
+        existing = getattr(node, slot)
+        if existing is None:
+            setattr(node, slot, (backend, pattern))
+
+        if existing is not None and existing[0] != backend:
+            self.duplicates.append(PatternProblem(backend, pattern, index, *existing, "duplicate"))
+        elif covering is not None and covering[0] != backend:
+            self.shadowed.append(PatternProblem(backend, pattern, index, *covering, "shadowed"))
+        elif existing is not None:
+            self.redundant.append(PatternProblem(backend, pattern, index, *existing, "redundant"))
+        elif covering is not None:
+            self.redundant.append(PatternProblem(backend, pattern, index, *covering, "redundant"))
@@ -0,0 +1,197 @@
+"""
+Sharding of a zkfp input across several envoy instances.
+
+Backends are assigned to shards with a consistent hash ring, so that changing the number of
+shards only moves about ``1/N`` of the backends, and adding or removing a backend doesn't
+move any other. Each shard is an ordinary zkfp input with the same listeners and a subset of
+the backends.
+
+The optional front tier is a zkfp input as well. It keeps one entry per backend, in the
+original order, pointing at the shard that serves it, so that its listeners pick the same
+backend for a name that the unsharded config would. Entries pointing at the same shard
+share a cluster, and their virtual hosts are numbered to keep their names apart. The front
+tier sends a PROXY protocol v2 header to the shards, whose listeners then accept it, so that
+the shards (and the backends behind them) still see the client's address.
+"""
+
+from __future__ import annotations
+
+import bisect
+import copy
+import hashlib
+import os
+import sys
+from typing import Any
+
+import yaml
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    A consistent hash ring with ``replicas`` points per shard.
+    """
+
+    def __init__(self, shards: int, replicas: int = 128):
+        points = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def shard(self, key: str) -> int:
+        index = bisect.bisect(self.points, _hash(key)) % len(self.points)
+        return self.shards[index]
+
+
+def shard_key(backend: dict[str, Any], key: str) -> str:
+    """
+    The value of a backend that is hashed to pick its shard. Lists (like ``patterns``) are
+    joined.
+    """
+    if key not in backend:
+        raise KeyError(f'backend "{backend.get("host", "")}" has no "{key}" to shard by')
+
+    value = backend[key]
+    if isinstance(value, list):
+        return ",".join(str(item) for item in value)
+
+    return str(value)
+
+
+def assign_shards(backends: list[dict[str, Any]], shards: int, key: str = "host") -> list[int]:
+    ring = HashRing(shards)
+    return [ring.shard(shard_key(backend, key)) for backend in backends]
+
+
+def _listeners(contents: dict[str, Any], accept_proxy_protocol: bool) -> list[dict[str, Any]]:
+    listeners = copy.deepcopy(contents["listeners"])
+    if accept_proxy_protocol:
+        for listener in listeners:
+            listener["accept_proxy_protocol"] = True
+
+    return listeners
+
+
+def shard_inputs(
+    contents: dict[str, Any],
+    assignments: list[int],
+    shards: int,
+    accept_proxy_protocol: bool = False,
+) -> list[dict[str, Any]]:
+    """
+    Split a zkfp input into one input per shard. Behind a front tier, the shards' listeners
+    have to ``accept_proxy_protocol``.
+    """
+    result = [
+        dict(contents, listeners=_listeners(contents, accept_proxy_protocol), backends=[])
+        for _ in range(shards)
+    ]
+    for backend, shard in zip(contents["backends"], assignments):
+        result[shard]["backends"].append(copy.deepcopy(backend))
+
+    return result
+
+
+def _listener_port(contents: dict[str, Any], protocol: str, default: int) -> int:
+    for listener in contents["listeners"]:
+        if listener.get("protocol") == protocol:
+            return listener["port"]
+
+    return default
+
+
+def front_tier_input(
+    contents: dict[str, Any], assignments: list[int], shard_hosts: list[str]
+) -> dict[str, Any]:
+    """
+    A zkfp input routing every backend's patterns to its shard, which listens on the same
+    ports as the listeners of the input. Connections to the shards start with a PROXY protocol
+    v2 header carrying the client's address.
+    """
+    http_port = _listener_port(contents, "http", 80)
+    https_port = _listener_port(contents, "https", 443)
+    return dict(
+        contents,
+        listeners=_listeners(contents, False),
+        backends=[
+            {
+                "host": shard_hosts[shard],
+                "patterns": list(backend["patterns"]),
+                "http_port": http_port,
+                "https_port": https_port,
+                "proxy_protocol": "v2",
+            }
+            for backend, shard in zip(contents["backends"], assignments)
+        ],
+    )
+
+
+def do_shard(args) -> None:
+    from envoyconfgen import processors
+    from envoyconfgen.batch import output_path
+    from envoyconfgen.bootstrap import generate_bootstrap
+    from envoyconfgen.convert import InvalidInputError, load_yaml, validate_contents
+    from envoyconfgen.fileio import atomic_open
+    from envoyconfgen.serialize import write
+
+    if args.processor != "zkfp":
+        print("--shards is only supported by the zkfp processor", file=sys.stderr)
+        sys.exit(1)
+
+    if args.output_dir is not None:
+        template = os.path.join(args.output_dir, "{name}-shard{shard}.{ext}")
+    elif args.output is not None and "{shard}" in args.output:
+        template = args.output
+    else:
+        print(
+            "--shards needs --output-dir or an --output template containing {shard}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    path = args.path[0]
+    processor = processors.zkfp()
+    try:
+        contents = load_yaml(path)
+        # the whole input is validated, so that overlaps between shards are found as well
+        validate_contents(processor, path, contents)
+        assignments = assign_shards(contents["backends"], args.shards, args.shard_key or "host")
+
+        shard_host = args.shard_host or "envoy-shard-{shard}"
+        shard_hosts = [shard_host.format(shard=shard) for shard in range(args.shards)]
+        front_tier = front_tier_input(contents, assignments, shard_hosts)
+        if args.front_tier is not None:
+            # checked before anything is written, --shard-host may not be a usable address
+            validate_contents(processor, args.front_tier, front_tier)
+    except (InvalidInputError, KeyError) as e:
+        print(e.args[0], file=sys.stderr)
+        sys.exit(1)
+    except (OSError, yaml.YAMLError) as e:
+        print(f'Could not read YAML file "{path}": {e}', file=sys.stderr)
+        sys.exit(1)
+
+    def write_config(resources, output: str) -> None:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with atomic_open(output) as fp:
+            write(generate_bootstrap(*resources), fp, args.format)
+
+    # the front tier sends the client's address to the shards
+    sharded = shard_inputs(contents, assignments, args.shards, args.front_tier is not None)
+    for shard, shard_contents in enumerate(sharded):
+        output = output_path(template, path, args.format, shard=shard)
+        write_config(processor.process_yaml(shard_contents), output)
+        print(
+            "shard %d (%s): %d backends -> %s"
+            % (shard, shard_hosts[shard], len(shard_contents["backends"]), output),
+            file=sys.stderr,
+        )
+
+    if args.front_tier is not None:
+        write_config(processor.process_yaml(front_tier), args.front_tier)
+        print("front tier -> %s" % (args.front_tier), file=sys.stderr)
@@ -1,17 +1,31 @@
 #!/usr/bin/env python3
 
+import os
+import re
+
 from setuptools import setup, find_packages
 
+# the version is also part of the render cache's keys, so it is only defined in the package,
+# which can't be imported before its dependencies are installed
+with open(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "envoyconfgen", "__init__.py")
+) as fp:
+    version = re.search(r'^__version__ = "([^"]+)"$', fp.read(), re.MULTILINE).group(1)
+
 setup(
     name="envoyconfgen",
-    version="0.2.0",
-    license='MIT',
-    packages=find_packages(),
-    scripts=['envoy-confgen'],
+    version=version,
+    license="MIT",
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
+    scripts=["envoy-confgen"],
     install_requires=[
-        'PyYAML>=5.0',
+        "PyYAML>=5.0",
     ],
-    author='Dan Fuhry',
-    author_email='dan@fuhry.com',
-    url='https://github.com/fuhry/envoy-confgen',
+    extras_require={
+        # envoy-confgen serve
+        "xds": ["grpcio>=1.40"],
+    },
+    author="Dan Fuhry",
+    author_email="dan@fuhry.com",
+    url="https://github.com/fuhry/envoy-confgen",
 )
@@ -0,0 +1,57 @@
+"""
+Rendering with several jobs writes the same bytes as rendering in one process.
+"""
+
+import io
+
+import pytest
+import yaml
+
+pytest.importorskip("envoyproto")
+
+from envoyconfgen import processors
+from envoyconfgen.convert import render
+from envoyconfgen.fileio import output_formats
+
+
+def zkfp_input(backends, filter_chain_matcher):
+    proxy_protocols = [None, "v1", "v2"]
+
+    return {
+        "listeners": [
+            {"protocol": "http", "port": 80, "address": "::"},
+            {
+                "protocol": "https",
+                "port": 443,
+                "address": "::",
+                "filter_chain_matcher": filter_chain_matcher,
+            },
+        ],
+        "backends": [
+            {
+                "host": f"backend{i % (backends // 2)}.example.net",
+                "proxy_protocol": proxy_protocols[i % len(proxy_protocols)],
+                "patterns": [f"*.site{i}.example.com", f"site{i}.example.com"],
+            }
+            for i in range(backends)
+        ],
+    }
+
+
+def rendered(raw, output_format, jobs):
+    stream = io.BytesIO()
+    render(processors.zkfp(), "<test>", stream, output_format, raw_contents=raw, jobs=jobs)
+    return stream.getvalue()
+
+
+@pytest.mark.parametrize("filter_chain_matcher", [False, True])
+@pytest.mark.parametrize("output_format", output_formats)
+def test_jobs_render_the_same(monkeypatch, output_format, filter_chain_matcher):
+    # small batches, so that the listeners' filter chains and the clusters are spread over
+    # several of them and the https listener is spliced together from their output
+    monkeypatch.setattr(processors, "_min_batch_size", 3)
+    raw = yaml.safe_dump(zkfp_input(40, filter_chain_matcher)).encode("utf-8")
+
+    expected = rendered(raw, output_format, 1)
+    assert rendered(raw, output_format, 3) == expected
+    assert rendered(raw, output_format, 8) == expected
@@ -0,0 +1,217 @@
+"""
+The compiled SAN matchers of mtls_sidecar accept exactly the names the per-pattern regexes do.
+"""
+
+import random
+import re
+
+import pytest
+
+from envoyconfgen.mtls_sidecar.patterns import (
+    MAX_REGEX_LENGTH,
+    compile_dns_patterns,
+    compile_spiffe_patterns,
+    dns_regex,
+    spiffe_regex,
+)
+from envoyconfgen.structs import MTLSSidecar
+
+SPIFFEMatch = MTLSSidecar.Listener.SPIFFEMatch
+
+LABELS = ["api", "db", "web", "us-east-1", "eu_west", "svc", "x1"]
+# valid regexes with a meaning of their own, which are never factored
+METACHARACTERS = ["a+", "b?", "(c|d)", "[0-9]", "e{2}", "f\\d"]
+
+
+# envoy matches with RE2, where "$" does not match before a trailing newline like it does in
+# Python: re.fullmatch behaves the same
+
+
+def accepts(compiled, name):
+    return name in compiled.exact or accepts_any(compiled.regexes, name)
+
+
+def accepts_any(regexes, name):
+    return any(re.fullmatch(regex, name) for regex in regexes)
+
+
+def random_label(rng):
+    return rng.choice(LABELS + ["".join(rng.choices("abcxyz019_-", k=rng.randint(1, 6)))])
+
+
+def random_dns_pattern(rng):
+    labels = []
+    for _ in range(rng.randint(1, 4)):
+        labels.append(
+            rng.choice(
+                [random_label(rng)] * 4 + ["*", "**", "pre*", rng.choice(METACHARACTERS) + "x"]
+            )
+        )
+    return ".".join(labels)
+
+
+def expand(pattern, rng, separator="."):
+    """
+    A name matched by a pattern, if its labels are plain.
+    """
+    result = []
+    for label in pattern.split(separator):
+        if label == "**":
+            result.append(separator.join(random_label(rng) for _ in range(rng.randint(1, 3))))
+        else:
+            result.append(label.replace("*", random_label(rng)))
+    return separator.join(result)
+
+
+def mutations(name, rng):
+    yield name + ".com"
+    yield "www." + name
+    yield name.upper()
+    yield name + "\n"
+    yield name.replace(".", "x", 1)
+    yield name.rsplit(".", 1)[0]
+    yield name[1:]
+    index = rng.randrange(len(name))
+    yield name[:index] + rng.choice("ab.-_*+") + name[index + 1 :]
+
+
+def dns_candidates(patterns, rng):
+    names = set()
+    for pattern in patterns:
+        name = expand(pattern, rng)
+        names.add(name)
+        names.update(mutations(name, rng))
+    return sorted(names)
+
+
+def check_dns(patterns, names):
+    compiled = compile_dns_patterns(patterns)
+    expected = [dns_regex(pattern) for pattern in patterns]
+    for name in names:
+        assert accepts(compiled, name) == accepts_any(expected, name), (patterns, name)
+    return compiled
+
+
+@pytest.mark.parametrize(
+    "patterns, matching, not_matching",
+    [
+        (["api.example.com"], ["api.example.com"], ["api.example.org", "xapi.example.com"]),
+        (
+            ["*.example.com"],
+            ["api.example.com"],
+            ["example.com", "a.b.example.com", ".example.com"],
+        ),
+        (["**.example.com"], ["a.example.com", "a.b.example.com"], ["example.com"]),
+        (["api.*.example.com"], ["api.eu.example.com"], ["api.example.com", "api.a.b.example.com"]),
+        (["api-*.example.com"], ["api-1.example.com"], ["api.example.com", "api-.example.com"]),
+        (["a+.example.com"], ["aaa.example.com"], ["a+.example.com", "b.example.com"]),
+        (["(a|b).example.com"], ["b.example.com"], ["(a|b).example.com", "c.example.com"]),
+        (
+            ["*.example.com", "*.example.org", "api.example.net"],
+            ["a.example.com", "b.example.org", "api.example.net"],
+            ["a.example.net", "example.org"],
+        ),
+    ],
+)
+def test_dns_examples(patterns, matching, not_matching):
+    compiled = check_dns(patterns, matching + not_matching)
+    assert all(accepts(compiled, name) for name in matching)
+    assert not any(accepts(compiled, name) for name in not_matching)
+
+
+def test_dns_literals_are_exact_matchers():
+    compiled = compile_dns_patterns(["a.example.com", "b.example.com", "a.example.com"])
+    assert compiled.exact == ["a.example.com", "b.example.com"]
+    assert compiled.regexes == []
+
+
+def test_dns_regexes_are_split_at_max_length():
+    rng = random.Random(16)
+    patterns = [f"*.{label}{i}.example.com" for i in range(40) for label in ("api", "web")]
+    compiled = check_dns(patterns, dns_candidates(patterns, rng))
+
+    assert len(compiled.regexes) > 1
+    assert all(len(regex) <= MAX_REGEX_LENGTH for regex in compiled.regexes)
+
+
+def test_dns_random_patterns():
+    rng = random.Random(1016)
+    for _ in range(300):
+        patterns = [random_dns_pattern(rng) for _ in range(rng.randint(1, 12))]
+        check_dns(patterns, dns_candidates(patterns, rng))
+
+
+def random_principal(rng):
+    trust_domain = rng.choice(["example.org", "*.example.org", "**", "prod.*", "td+"])
+    segments = [
+        rng.choice(
+            [random_label(rng)] * 3 + ["*", "**", "v*", "ns.name", rng.choice(METACHARACTERS)]
+        )
+        for _ in range(rng.randint(1, 3))
+    ]
+    return SPIFFEMatch(trust_domain=trust_domain, service="/".join(segments))
+
+
+def spiffe_candidates(principals, rng):
+    ids = set()
+    for principal in principals:
+        trust_domain = expand(principal.trust_domain, rng)
+        service = expand(principal.service, rng, separator="/")
+        spiffe_id = f"spiffe://{trust_domain}/{service}"
+        ids.add(spiffe_id)
+        ids.update(mutations(spiffe_id, rng))
+        ids.add(f"spiffe://{trust_domain}/{service}/extra")
+        ids.add(f"spiffe://{trust_domain}.x/{service}")
+    return sorted(ids)
+
+
+def check_spiffe(principals, ids):
+    compiled = compile_spiffe_patterns(principals)
+    expected = [spiffe_regex(principal) for principal in principals]
+    for spiffe_id in ids:
+        assert accepts(compiled, spiffe_id) == accepts_any(expected, spiffe_id), (
+            principals,
+            spiffe_id,
+        )
+    return compiled
+
+
+def test_spiffe_examples():
+    principals = [
+        SPIFFEMatch(trust_domain="example.org", service="ns/default/sa/api"),
+        SPIFFEMatch(trust_domain="example.org", service="ns/*/sa/web"),
+        SPIFFEMatch(trust_domain="*.example.org", service="**"),
+    ]
+    compiled = check_spiffe(
+        principals,
+        [
+            "spiffe://example.org/ns/default/sa/api",
+            "spiffe://example.org/ns/prod/sa/web",
+            "spiffe://example.org/ns/a/b/sa/web",
+            "spiffe://eu.example.org/any/path",
+            "spiffe://example.org/ns/default/sa/db",
+        ],
+    )
+    assert compiled.exact == ["spiffe://example.org/ns/default/sa/api"]
+    assert accepts(compiled, "spiffe://example.org/ns/prod/sa/web")
+    assert accepts(compiled, "spiffe://eu.example.org/any/path")
+    assert not accepts(compiled, "spiffe://example.org/ns/a/b/sa/web")
+    assert not accepts(compiled, "spiffe://example.org/ns/default/sa/db")
+
+
+def test_spiffe_regexes_are_split_at_max_length():
+    rng = random.Random(160)
+    principals = [
+        SPIFFEMatch(trust_domain="example.org", service=f"ns/team{i}/sa/*") for i in range(60)
+    ]
+    compiled = check_spiffe(principals, spiffe_candidates(principals, rng))
+
+    assert len(compiled.regexes) > 1
+    assert all(len(regex) <= MAX_REGEX_LENGTH for regex in compiled.regexes)
+
+
+def test_spiffe_random_principals():
+    rng = random.Random(2016)
+    for _ in range(300):
+        principals = [random_principal(rng) for _ in range(rng.randint(1, 10))]
+        check_spiffe(principals, spiffe_candidates(principals, rng))
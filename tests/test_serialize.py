@@ -0,0 +1,145 @@
+"""
+:func:`envoyconfgen.serialize.write` produces the same output as the round trip through
+``MessageToJson`` it replaces.
+"""
+
+import io
+import json
+import os
+
+import pytest
+import yaml
+
+pytest.importorskip("google.protobuf")
+
+import google.protobuf.any_pb2
+import google.protobuf.duration_pb2
+import google.protobuf.json_format
+import google.protobuf.source_context_pb2
+import google.protobuf.struct_pb2
+import google.protobuf.type_pb2
+
+from envoyconfgen import serialize
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+
+samples = [
+    ("zkfp", os.path.join(SAMPLES, "zkfp", "example.yml")),
+    ("mtls_sidecar", os.path.join(SAMPLES, "mtls_sidecar", "example.yml")),
+    ("mtls_sidecar", os.path.join(SAMPLES, "mtls_sidecar", "example_multi.yml")),
+]
+
+
+def legacy_json(message):
+    return google.protobuf.json_format.MessageToJson(
+        message, sort_keys=True, preserving_proto_field_name=True
+    ).replace("type.googleapis.com/envoyproto.", "type.googleapis.com/")
+
+
+def legacy(message, output_format):
+    """
+    The output of ``message`` the way it was written before :mod:`.serialize`.
+    """
+    if output_format == "yaml":
+        return yaml.dump(json.loads(legacy_json(message))).encode("utf-8")
+    elif output_format == "json":
+        return (legacy_json(message) + "\n").encode("utf-8")
+
+    return serialize.denamespaced(message).SerializeToString(deterministic=True)
+
+
+def written(message, output_format):
+    stream = io.BytesIO()
+    serialize.write(message, stream, output_format)
+    data = stream.getvalue()
+    if output_format == "pb":
+        # sub-messages of the root are written in pieces which protobuf merges, so the
+        # encoding is compared once it is parsed
+        return type(message).FromString(data).SerializeToString(deterministic=True)
+
+    return data
+
+
+def packed(message):
+    result = google.protobuf.any_pb2.Any()
+    result.Pack(message)
+    return result
+
+
+def well_known_message():
+    struct = google.protobuf.struct_pb2.Struct()
+    struct.update({"zone": "zürich", "weight": 1.5, "canary": True, "tags": [], "none": None})
+
+    return google.protobuf.type_pb2.Type(
+        name="café.example.com",
+        fields=[
+            google.protobuf.type_pb2.Field(name="plain", number=1),
+            google.protobuf.type_pb2.Field(
+                name="ünïcode",
+                number=2**31 - 1,
+                options=[
+                    google.protobuf.type_pb2.Option(
+                        name="timeout",
+                        value=packed(google.protobuf.duration_pb2.Duration(seconds=1, nanos=5)),
+                    ),
+                ],
+            ),
+        ],
+        # empty repeated fields are left out, empty sub-messages are not
+        oneofs=[],
+        options=[
+            google.protobuf.type_pb2.Option(name="struct", value=packed(struct)),
+            google.protobuf.type_pb2.Option(
+                name="nested",
+                value=packed(
+                    google.protobuf.type_pb2.Option(name="\U0001f600", value=packed(struct))
+                ),
+            ),
+        ],
+        source_context=google.protobuf.source_context_pb2.SourceContext(),
+    )
+
+
+@pytest.mark.parametrize("output_format", ["yaml", "json", "pb"])
+def test_well_known_types(output_format):
+    message = well_known_message()
+
+    assert written(message, output_format) == legacy(message, output_format)
+
+
+@pytest.fixture
+def envoy_messages():
+    pytest.importorskip("envoyproto")
+
+    import envoyproto.envoy.config.cluster.v3 as cluster
+    import envoyproto.envoy.config.core.v3 as core
+
+    from envoyconfgen import registry
+    from envoyconfgen.bootstrap import generate_bootstrap, generate_dynamic_bootstrap
+    from envoyconfgen.convert import process_yaml
+
+    metadata = core.base.Metadata()
+    metadata.filter_metadata["envoy.lb"].update({"zone": "zürich", "weight": 2})
+    clusters = [
+        cluster.cluster.Cluster(
+            name="café.example.com",
+            connect_timeout=google.protobuf.duration_pb2.Duration(seconds=1, nanos=250000000),
+            metadata=metadata,
+        ),
+        # set, but without any endpoints
+        cluster.cluster.Cluster(
+            name="empty", load_assignment={"cluster_name": "empty", "endpoints": []}
+        ),
+    ]
+
+    return [process_yaml(registry.load(name)(), path) for name, path in samples] + [
+        generate_bootstrap([], clusters),
+        # maps of packed Anys, an empty access log list and a non-ASCII node
+        generate_dynamic_bootstrap("127.0.0.1", 18000, "nöde-1", "edge", delta=True),
+    ]
+
+
+@pytest.mark.parametrize("output_format", ["yaml", "json", "pb"])
+def test_envoy_messages(envoy_messages, output_format):
+    for message in envoy_messages:
+        assert written(message, output_format) == legacy(message, output_format)
@@ -0,0 +1,278 @@
+"""
+Serve mode, driven by an in-process gRPC client over both ADS variants.
+"""
+
+import queue
+
+import pytest
+
+grpc = pytest.importorskip("grpc")
+pytest.importorskip("envoyproto")
+
+import envoyproto.envoy.config.cluster.v3 as cluster
+import envoyproto.envoy.config.core.v3 as core
+import envoyproto.envoy.config.listener.v3 as listener
+from envoyproto.envoy.extensions.filters.network.tcp_proxy.v3 import tcp_proxy
+from envoyproto.envoy.service.discovery.v3 import discovery
+
+from envoyconfgen.helpers import typed_config
+from envoyconfgen.serialize import unpack_any
+from envoyconfgen.xds import (
+    ADS_SERVICE,
+    CLUSTER_TYPE,
+    LISTENER_TYPE,
+    ResourceStore,
+    start_server,
+)
+
+NODE = core.base.Node(id="test-node", cluster="test")
+
+
+def make_cluster(name):
+    return cluster.cluster.Cluster(name=name, type=cluster.cluster.Cluster.DiscoveryType.STATIC)
+
+
+def make_listener(name, cluster_name):
+    proxy = tcp_proxy.TcpProxy(stat_prefix=name, cluster=cluster_name)
+    return listener.listener.Listener(
+        name=name,
+        filter_chains=[
+            listener.listener_components.FilterChain(
+                filters=[
+                    listener.listener_components.Filter(
+                        name="envoy.filters.network.tcp_proxy", typed_config=typed_config(proxy)
+                    )
+                ]
+            )
+        ],
+    )
+
+
+class Stream:
+    """
+    A client stream whose requests are sent one by one.
+    """
+
+    def __init__(self, channel, method, request_type, response_type):
+        self.request_type = request_type
+        self.requests = queue.Queue()
+        call = channel.stream_stream(
+            f"/{ADS_SERVICE}/{method}",
+            request_serializer=request_type.SerializeToString,
+            response_deserializer=response_type.FromString,
+        )
+        self.responses = call(iter(self.requests.get, None), timeout=30)
+
+    def send(self, **fields):
+        self.requests.put(self.request_type(**fields))
+
+    def receive(self):
+        return next(self.responses)
+
+    def close(self):
+        self.requests.put(None)
+        self.responses.cancel()
+
+
+@pytest.fixture
+def store():
+    return ResourceStore()
+
+
+@pytest.fixture
+def channel(store):
+    server, port = start_server(store, "127.0.0.1:0")
+    channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+    yield channel
+    channel.close()
+    server.stop(grace=None)
+
+
+@pytest.fixture
+def open_stream(channel):
+    streams = []
+
+    def open_stream(delta):
+        if delta:
+            stream = Stream(
+                channel,
+                "DeltaAggregatedResources",
+                discovery.DeltaDiscoveryRequest,
+                discovery.DeltaDiscoveryResponse,
+            )
+        else:
+            stream = Stream(
+                channel,
+                "StreamAggregatedResources",
+                discovery.DiscoveryRequest,
+                discovery.DiscoveryResponse,
+            )
+        streams.append(stream)
+        return stream
+
+    yield open_stream
+    for stream in streams:
+        stream.close()
+
+
+def listener_cluster(message):
+    return unpack_any(message.filter_chains[0].filters[0].typed_config).cluster
+
+
+def sotw_names(response):
+    return sorted(unpack_any(resource).name for resource in response.resources)
+
+
+def delta_names(response):
+    return sorted(resource.name for resource in response.resources)
+
+
+def sotw_subscribe(stream):
+    stream.send(node=NODE, type_url=CLUSTER_TYPE)
+    clusters = stream.receive()
+    stream.send(
+        type_url=CLUSTER_TYPE, version_info=clusters.version_info, response_nonce=clusters.nonce
+    )
+    stream.send(node=NODE, type_url=LISTENER_TYPE)
+    listeners = stream.receive()
+    stream.send(
+        type_url=LISTENER_TYPE, version_info=listeners.version_info, response_nonce=listeners.nonce
+    )
+    return clusters, listeners
+
+
+def delta_subscribe(stream, initial_versions=None):
+    stream.send(node=NODE, type_url=CLUSTER_TYPE, initial_resource_versions=initial_versions or {})
+    clusters = stream.receive()
+    stream.send(type_url=CLUSTER_TYPE, response_nonce=clusters.nonce)
+    stream.send(node=NODE, type_url=LISTENER_TYPE)
+    listeners = stream.receive()
+    stream.send(type_url=LISTENER_TYPE, response_nonce=listeners.nonce)
+    return clusters, listeners
+
+
+def test_sotw_initial_push(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a"), make_cluster("b")])
+    clusters, listeners = sotw_subscribe(open_stream(delta=False))
+
+    assert clusters.type_url == CLUSTER_TYPE
+    assert sotw_names(clusters) == ["a", "b"]
+    assert listeners.type_url == LISTENER_TYPE
+    assert sotw_names(listeners) == ["tcp_80"]
+
+
+def test_sotw_pushes_only_changed_types(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a")])
+    stream = open_stream(delta=False)
+    sotw_subscribe(stream)
+
+    # the clusters are unchanged, so only the listeners are sent again
+    store.update([make_listener("tcp_80", "a"), make_listener("tcp_81", "a")], [make_cluster("a")])
+    response = stream.receive()
+    assert response.type_url == LISTENER_TYPE
+    assert sotw_names(response) == ["tcp_80", "tcp_81"]
+
+    store.update([make_listener("tcp_80", "a"), make_listener("tcp_81", "a")], [make_cluster("b")])
+    response = stream.receive()
+    assert response.type_url == CLUSTER_TYPE
+
+
+def test_sotw_orders_cluster_changes_around_listeners(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a")])
+    stream = open_stream(delta=False)
+    sotw_subscribe(stream)
+
+    store.update([make_listener("tcp_80", "b")], [make_cluster("b")])
+
+    # a state-of-the-world response removes what it leaves out, so "a" stays until the listener
+    # no longer uses it
+    added = stream.receive()
+    assert (added.type_url, sotw_names(added)) == (CLUSTER_TYPE, ["a", "b"])
+    updated = stream.receive()
+    assert (updated.type_url, sotw_names(updated)) == (LISTENER_TYPE, ["tcp_80"])
+    assert listener_cluster(unpack_any(updated.resources[0])) == "b"
+    removed = stream.receive()
+    assert (removed.type_url, sotw_names(removed)) == (CLUSTER_TYPE, ["b"])
+    assert removed.version_info != added.version_info
+
+
+def test_delta_initial_push(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a"), make_cluster("b")])
+    clusters, listeners = delta_subscribe(open_stream(delta=True))
+
+    assert clusters.type_url == CLUSTER_TYPE
+    assert delta_names(clusters) == ["a", "b"]
+    assert list(clusters.removed_resources) == []
+    assert listeners.type_url == LISTENER_TYPE
+    assert delta_names(listeners) == ["tcp_80"]
+
+
+def test_delta_pushes_only_changed_resources(store, open_stream):
+    store.update(
+        [make_listener("tcp_80", "a"), make_listener("tcp_81", "b")],
+        [make_cluster("a"), make_cluster("b")],
+    )
+    stream = open_stream(delta=True)
+    delta_subscribe(stream)
+
+    store.update(
+        [make_listener("tcp_80", "a"), make_listener("tcp_81", "a")],
+        [make_cluster("a"), make_cluster("b")],
+    )
+    response = stream.receive()
+    assert response.type_url == LISTENER_TYPE
+    assert delta_names(response) == ["tcp_81"]
+    assert list(response.removed_resources) == []
+
+
+def test_delta_orders_cluster_changes_around_listeners(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a")])
+    stream = open_stream(delta=True)
+    delta_subscribe(stream)
+
+    store.update([make_listener("tcp_80", "b")], [make_cluster("b")])
+
+    added = stream.receive()
+    assert added.type_url == CLUSTER_TYPE
+    assert (delta_names(added), list(added.removed_resources)) == (["b"], [])
+    updated = stream.receive()
+    assert (updated.type_url, delta_names(updated)) == (LISTENER_TYPE, ["tcp_80"])
+    assert listener_cluster(unpack_any(updated.resources[0].resource)) == "b"
+    removed = stream.receive()
+    assert removed.type_url == CLUSTER_TYPE
+    assert (delta_names(removed), list(removed.removed_resources)) == ([], ["a"])
+
+
+def test_delta_reconnect_with_initial_resource_versions(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a"), make_cluster("b")])
+    clusters, _ = delta_subscribe(open_stream(delta=True))
+    versions = {resource.name: resource.version for resource in clusters.resources}
+
+    # the node reconnects knowing "a" as it is, an outdated "b" and a "c" which is gone
+    stream = open_stream(delta=True)
+    stream.send(
+        node=NODE,
+        type_url=CLUSTER_TYPE,
+        initial_resource_versions={"a": versions["a"], "b": "outdated", "c": "gone"},
+    )
+    response = stream.receive()
+    assert response.type_url == CLUSTER_TYPE
+    assert delta_names(response) == ["b"]
+    assert list(response.removed_resources) == ["c"]
+
+
+def test_delta_reconnect_knowing_everything_still_gets_a_response(store, open_stream):
+    store.update([make_listener("tcp_80", "a")], [make_cluster("a")])
+    clusters, _ = delta_subscribe(open_stream(delta=True))
+
+    stream = open_stream(delta=True)
+    stream.send(
+        node=NODE,
+        type_url=CLUSTER_TYPE,
+        initial_resource_versions={r.name: r.version for r in clusters.resources},
+    )
+    response = stream.receive()
+    # an empty response lets the node finish initializing
+    assert response.type_url == CLUSTER_TYPE
+    assert delta_names(response) == []
+    assert list(response.removed_resources) == []
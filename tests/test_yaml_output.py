@@ -0,0 +1,152 @@
+"""
+libyaml and PyYAML's pure Python emitter write the same bytes for everything envoyconfgen lets
+libyaml write.
+"""
+
+import importlib
+import io
+import os
+
+import pytest
+import yaml
+
+pytest.importorskip("envoyproto")
+
+import envoyproto.envoy.config.cluster.v3 as cluster
+
+from envoyconfgen import registry, serialize, yamlio
+from envoyconfgen.bootstrap import generate_bootstrap
+from envoyconfgen.convert import process_yaml, render
+
+SAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "samples")
+
+requires_libyaml = pytest.mark.skipif(
+    yamlio.backend != "libyaml", reason="PyYAML without libyaml, or ENVOY_CONFGEN_PURE_YAML set"
+)
+
+# printable ASCII which still needs quoting or folding
+PRINTABLE = [
+    "a" * 300,
+    " ".join(["word"] * 80),
+    'it\'s "quoted" \\ with a backslash',
+    "key: value # not a comment",
+    " leading and trailing space ",
+    "yes",
+    "null",
+    "1.5e3",
+    "- dash",
+    ("'quote' " * 40).strip(),
+]
+NON_PRINTABLE = [
+    "café.example.com",
+    "ü" * 30 + ".example.com" + "é" * 80,
+    "\U0001f600" * 50,
+    "tab\tseparated",
+    "line1\nline2",
+    "x\t" * 100,
+    "delete\x7fcharacter",
+    "zero\u200bwidth",
+]
+
+samples = [
+    ("zkfp", os.path.join(SAMPLES, "zkfp", "example.yml")),
+    ("mtls_sidecar", os.path.join(SAMPLES, "mtls_sidecar", "example.yml")),
+]
+
+
+def dump(message, dumper_class):
+    stream = io.BytesIO()
+    serialize.write_yaml(message, stream, dumper_class)
+    return stream.getvalue()
+
+
+def clusters_named(names):
+    return generate_bootstrap([], [cluster.cluster.Cluster(name=name) for name in names])
+
+
+@pytest.fixture
+def pure_yaml(monkeypatch):
+    monkeypatch.setenv("ENVOY_CONFGEN_PURE_YAML", "1")
+    importlib.reload(yamlio)
+    yield
+    monkeypatch.undo()
+    importlib.reload(yamlio)
+
+
+@requires_libyaml
+@pytest.mark.parametrize("processor_name, path", samples)
+def test_samples(processor_name, path):
+    message = process_yaml(registry.load(processor_name)(), path)
+
+    assert serialize.yaml_dumper_class(message) is yaml.CDumper
+    assert dump(message, yaml.CDumper) == dump(message, yaml.Dumper)
+
+
+@requires_libyaml
+@pytest.mark.parametrize("processor_name, path", samples)
+def test_rendered_samples(processor_name, path):
+    processor = registry.load(processor_name)()
+    stream = io.BytesIO()
+    render(processor, path, stream)
+
+    assert stream.getvalue() == dump(process_yaml(processor, path), yaml.Dumper)
+
+
+@requires_libyaml
+@pytest.mark.parametrize("name", PRINTABLE)
+def test_printable_strings(name):
+    message = clusters_named([name])
+
+    assert serialize.yaml_dumper_class(message) is yaml.CDumper
+    assert dump(message, yaml.CDumper) == dump(message, yaml.Dumper)
+    assert yamlio.safe_load(dump(message, yaml.CDumper)) == serialize.to_plain(message)
+
+
+@pytest.mark.parametrize("name", NON_PRINTABLE)
+def test_non_printable_strings_fall_back(name):
+    # libyaml escapes and folds these differently, so the pure Python emitter writes them
+    message = clusters_named(["plain", name])
+
+    assert serialize.yaml_dumper_class(message) is yaml.Dumper
+    assert dump(message, None) == dump(message, yaml.Dumper)
+    assert yamlio.safe_load(dump(message, None)) == serialize.to_plain(message)
+
+
+def test_non_printable_input_falls_back(tmp_path):
+    path = tmp_path / "input.yaml"
+    contents = {
+        "listeners": [
+            {"protocol": "http", "port": 80, "address": "::"},
+            {"protocol": "https", "port": 443, "address": "::"},
+        ],
+        "backends": [
+            {"host": "a.example.com", "patterns": ["café.example.com", "*." + "ü" * 60 + ".de"]},
+            {"host": "b.example.com", "patterns": ["b.example.com"]},
+        ],
+    }
+    path.write_text(yaml.safe_dump(contents, allow_unicode=True), encoding="utf-8")
+    processor = registry.load("zkfp")()
+    stream = io.BytesIO()
+    render(processor, str(path), stream)
+
+    assert stream.getvalue() == dump(process_yaml(processor, str(path)), yaml.Dumper)
+
+
+def test_pure_yaml_environment(pure_yaml):
+    assert yamlio.Dumper is yaml.Dumper
+    assert yamlio.SafeLoader is yaml.SafeLoader
+    assert yamlio.backend == "python"
+
+    message = process_yaml(registry.load("zkfp")(), samples[0][1])
+    assert serialize.yaml_dumper_class(message) is yaml.Dumper
+
+
+@requires_libyaml
+@pytest.mark.parametrize("processor_name, path", samples)
+def test_loaders_agree(processor_name, path):
+    with open(path, "rb") as fp:
+        contents = fp.read()
+
+    assert yaml.load(contents, Loader=yaml.CSafeLoader) == yaml.load(
+        contents, Loader=yaml.SafeLoader
+    )
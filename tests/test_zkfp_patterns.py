@@ -0,0 +1,40 @@
+"""
+The problems found by the zkfp pattern index point at the pattern which has them.
+"""
+
+from envoyconfgen.processors import zkfp
+from envoyconfgen.zkfp.patterns import PatternIndex
+
+
+def index_of(*backends):
+    index = PatternIndex()
+    for patterns in backends:
+        index.add_backend(patterns)
+    return index
+
+
+def test_repeated_pattern_is_located_at_its_repeat():
+    index = index_of(["a.com", "b.com", "a.com"])
+
+    assert [(p.backend, p.index, p.kind) for p in index.redundant] == [(0, 2, "redundant")]
+
+
+def test_duplicates_are_compared_regardless_of_case():
+    index = index_of(["x.com", "A.com"], ["a.COM"])
+
+    assert [(p.backend, p.index, p.other_backend) for p in index.duplicates] == [(1, 0, 0)]
+
+
+def test_warnings_are_located():
+    contents = {
+        "listeners": [{"protocol": "https", "port": 443, "address": "::"}],
+        "backends": [
+            {"host": "a", "patterns": ["*.example.com"]},
+            {"host": "b", "patterns": ["c.org", "x.example.com"]},
+        ],
+    }
+
+    errors, warnings = zkfp().check_yaml(contents)
+
+    assert errors == []
+    assert [warning.path for warning in warnings] == [("backends", 1, "patterns", 1)]